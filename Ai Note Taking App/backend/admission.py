@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+from typing import Dict, FrozenSet, Optional
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+from metrics import UPLOADS_IN_PROGRESS, UPLOADS_REJECTED
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Largest single-request upload; bigger files go through the resumable upload endpoints
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+
+# Uploads streamed at once per worker, how long an upload waits for a slot, and the
+# Retry-After sent when none frees up
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_QUEUE_TIMEOUT = float(os.getenv("UPLOAD_QUEUE_TIMEOUT", "1"))
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "5"))
+
+# Bytes of a file looked at to recognise its type; PDFs may have junk before %PDF-
+SNIFF_BYTES = 1024
+
+PDF_TYPES = frozenset({"pdf"})
+IMAGE_TYPES = frozenset({"png", "jpeg", "gif", "tiff", "bmp", "webp"})
+
+# File types accepted by each multipart upload route
+UPLOAD_ROUTES: Dict[str, FrozenSet[str]] = {
+    "/api/upload-pdf": PDF_TYPES,
+    "/api/handwriting": PDF_TYPES | IMAGE_TYPES,
+}
+
+# Resumable chunk uploads share the concurrency limit; their size is checked against the session
+CHUNK_ROUTE_PREFIX = "/api/uploads/"
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """File type from the first bytes of a file, or None if it is not one we accept"""
+    if b"%PDF-" in head[:SNIFF_BYTES]:
+        return "pdf"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return "tiff"
+    if head.startswith(b"BM"):
+        return "bmp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def check_type(head: bytes, allowed: FrozenSet[str]):
+    """Raise 415 unless the file starts like one of the allowed types"""
+    if sniff_type(head) not in allowed:
+        UPLOADS_REJECTED.inc(reason="unsupported_type")
+        kinds = "PDF" if allowed == PDF_TYPES else "PDF or image"
+        raise HTTPException(status_code=415, detail=f"Unsupported file type: expected a {kinds} file")
+
+def _multipart_file_start(body: bytes) -> int:
+    """Offset of the first file's content in a multipart body, or -1 if its headers have not arrived"""
+    part = body.find(b'filename="')
+    if part < 0:
+        return -1
+    end = body.find(b"\r\n\r\n", part)
+    return -1 if end < 0 else end + 4
+
+class _LimitedBody:
+    """receive() wrapper that counts body bytes and checks the file type from the first ones"""
+
+    def __init__(self, receive, limit: Optional[int], allowed: Optional[FrozenSet[str]]):
+        self._receive = receive
+        self._limit = limit
+        self._allowed = allowed
+        self._head = b""
+        self.received = 0
+
+    async def __call__(self):
+        message = await self._receive()
+        if message["type"] != "http.request":
+            return message
+        body = message.get("body", b"")
+        self.received += len(body)
+        if self._limit is not None and self.received > self._limit:
+            UPLOADS_REJECTED.inc(reason="too_large")
+            raise HTTPException(status_code=413, detail=f"Upload is larger than {self._limit // (1024 * 1024)} MB")
+        if self._allowed is not None:
+            # Raising here stops the multipart parser before the rest of the body is read
+            self._head += body
+            start = _multipart_file_start(self._head)
+            more = message.get("more_body", False)
+            if start >= 0 and (len(self._head) - start >= SNIFF_BYTES or not more):
+                allowed, self._allowed = self._allowed, None
+                check_type(self._head[start:start + SNIFF_BYTES], allowed)
+                self._head = b""
+            elif start < 0 and (len(self._head) > 64 * 1024 or not more):
+                # No file part near the start: leave it to the endpoint's validation
+                self._allowed = None
+                self._head = b""
+        return message
+
+class UploadAdmissionMiddleware:
+    """Gate for upload routes: size and type are checked while the body streams in, and a per-worker
+    limit on concurrent uploads answers 429 with Retry-After instead of queueing without bound"""
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, concurrency: int = UPLOAD_CONCURRENCY):
+        self.app = app
+        self.max_bytes = max_bytes
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        allowed = UPLOAD_ROUTES.get(path) if scope["method"] == "POST" else None
+        is_chunk = scope["method"] == "PUT" and path.startswith(CHUNK_ROUTE_PREFIX)
+        if allowed is None and not is_chunk:
+            return await self.app(scope, receive, send)
+
+        limit = None if is_chunk else self.max_bytes
+        if limit is not None:
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+                # Rejected from the headers, before any of the body is read
+                UPLOADS_REJECTED.inc(reason="too_large")
+                response = JSONResponse(status_code=413,
+                                        content={"detail": f"Upload is larger than {limit // (1024 * 1024)} MB"})
+                return await response(scope, receive, send)
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=UPLOAD_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            UPLOADS_REJECTED.inc(reason="busy")
+            logger.warning(f"Rejecting upload to {path}: {UPLOAD_CONCURRENCY} uploads already in progress")
+            response = JSONResponse(status_code=429, headers={"Retry-After": str(UPLOAD_RETRY_AFTER)},
+                                    content={"detail": "Too many uploads in progress, try again shortly"})
+            return await response(scope, receive, send)
+
+        UPLOADS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, _LimitedBody(receive, limit, allowed), send)
+        finally:
+            UPLOADS_IN_PROGRESS.dec()
+            self._slots.release()
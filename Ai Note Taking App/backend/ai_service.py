@@ -1,64 +1,54 @@
 import os
 import json
+import contextvars
+import hashlib
 import logging
 import re
 import time
 import random
-import requests
-from PIL import Image
-import pytesseract
-from collections import Counter
-from typing import List, Dict, Any, Optional, Union
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import List, Dict, Any, Optional, Tuple
+import deadline
+from metrics import (INFERENCE_SECONDS, INFERENCE_RETRIES, INFERENCE_RATE_LIMITED, INFERENCE_HEDGES,
+                     INFERENCE_DEADLINE_EXCEEDED)
+from cache import get_cache
+from upstream import (HEDGING_ENABLED, Permit, UpstreamUnavailable, get_inference_executor, get_latency_tracker,
+                      get_upstream_guard, hedge_delay)
+from lazy import lazy_import
+import tokenizer
+from stopwords_en import STOP_WORDS
+from document import ParsedDocument, extract_keywords, parse_document
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Try to import NLTK resources
-try:
-    import nltk
-    from nltk.tokenize import sent_tokenize, word_tokenize
-    from nltk.corpus import stopwords
-
-    # Initialize NLTK resources - create data directory if needed
-    nltk_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data')
-    os.makedirs(nltk_data_dir, exist_ok=True)
-    nltk.data.path.append(nltk_data_dir)
-    
-    # Download resources if not already present
-    for resource in ['punkt', 'stopwords']:
-        try:
-            nltk.data.find(f'tokenizers/{resource}')
-            logger.info(f"NLTK resource '{resource}' is already downloaded")
-        except LookupError:
-            logger.info(f"Downloading NLTK resource '{resource}'")
-            nltk.download(resource, download_dir=nltk_data_dir, quiet=True)
-
-    # Get stopwords
-    stop_words = set(stopwords.words('english'))
-    logger.info("NLTK initialized successfully")
-except Exception as e:
-    logger.warning(f"Failed to initialize NLTK: {str(e)}")
-    # Fallback stopwords if NLTK import fails
-    stop_words = {"i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you", "your", "yours",
-                  "yourself", "yourselves", "he", "him", "his", "himself", "she", "her", "hers",
-                  "herself", "it", "its", "itself", "they", "them", "their", "theirs", "themselves",
-                  "what", "which", "who", "whom", "this", "that", "these", "those", "am", "is", "are",
-                  "was", "were", "be", "been", "being", "have", "has", "had", "having", "do", "does",
-                  "did", "doing", "a", "an", "the", "and", "but", "if", "or", "because", "as", "until",
-                  "while", "of", "at", "by", "for", "with", "about", "against", "between", "into",
-                  "through", "during", "before", "after", "above", "below", "to", "from", "up", "down",
-                  "in", "out", "on", "off", "over", "under", "again", "further", "then", "once", "here",
-                  "there", "when", "where", "why", "how", "all", "any", "both", "each", "few", "more",
-                  "most", "other", "some", "such", "no", "nor", "not", "only", "own", "same", "so",
-                  "than", "too", "very", "s", "t", "can", "will", "just", "don", "should", "now"}
+# Heavy modules are imported on first use
+requests = lazy_import("requests")
+
+# Stopwords come from a precompiled frozenset instead of the NLTK corpus
+stop_words = STOP_WORDS
+
+def _retry_after(response) -> Optional[float]:
+    """Seconds from a Retry-After header, if it holds a number"""
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+def _estimated_load_time(response) -> Optional[float]:
+    """Hugging Face reports how long a cold model needs to load in the 503 body"""
+    try:
+        return float(response.json().get("estimated_time"))
+    except Exception:
+        return _retry_after(response)
 
 class AIService:
     def __init__(self):
         # Use environment variable for the API key
         self.api_key = os.getenv('HUGGINGFACE_API_KEY', '')
-        self.api_url = "https://api-inference.huggingface.co/models/"
-        self.model = "mistralai/Mistral-7B-Instruct-v0.3"
+        self.api_url = os.getenv('HUGGINGFACE_API_URL', "https://api-inference.huggingface.co/models/")
+        self.model = os.getenv('HUGGINGFACE_MODEL', "mistralai/Mistral-7B-Instruct-v0.3")
         self.use_api = bool(self.api_key)
 
         # Log configuration
@@ -67,25 +57,34 @@ class AIService:
 
     def _extract_sentences(self, text: str) -> List[str]:
         """Extract sentences from text"""
-        try:
-            return sent_tokenize(text)
-        except:
-            # Fallback if NLTK fails
-            return [s.strip() for s in text.split('.') if s.strip()]
+        return tokenizer.sentences(text)
 
     def _extract_keywords(self, text: str) -> List[str]:
         """Extract keywords from text"""
-        words = text.lower().split()
-        keywords = [w for w in words if len(w) > 3 and w.lower() not in stop_words]
-        word_count = Counter(keywords)
-        return [word for word, _ in word_count.most_common(10)]
+        return extract_keywords(tokenizer.words(text))
+
+    def parse_document(self, text: str) -> ParsedDocument:
+        """Split text into sentences, tokens and keywords once so several generators can share them"""
+        return parse_document(text, self._extract_sentences)
 
     def _query_model(self, prompt: str, task_type: str = "general") -> Optional[str]:
-        """Query the Hugging Face model with retry logic"""
+        """Query the model, answering repeated prompts from the cache shared by all workers"""
         if not self.api_key:
             logger.warning("No API key available for Hugging Face")
             return None
 
+        cache_key = hashlib.sha256(f"{self.model}\0{task_type}\0{prompt}".encode("utf-8")).hexdigest()
+
+        def request() -> Optional[bytes]:
+            result = self._request_model(prompt, task_type)
+            return result.encode("utf-8") if result else None
+
+        # Concurrent requests for the same prompt, on any worker, share one model call
+        cached = get_cache("inference").get_or_compute(cache_key, request)
+        return cached.decode("utf-8") if cached is not None else None
+
+    def _request_model(self, prompt: str, task_type: str = "general") -> Optional[str]:
+        """Query the Hugging Face model with retry logic, within the current request deadline"""
         api_url = f"{self.api_url}{self.model}"
         headers = {"Authorization": f"Bearer {self.api_key}"}
 
@@ -112,73 +111,161 @@ class AIService:
         elif task_type == "mindmap":
             payload["parameters"]["max_new_tokens"] = 400
 
-        # Retry logic
-        max_retries = 3
-        retry_delay = 5
+        # Only transient failures are retried here; when the upstream is overloaded
+        # (429, 503 model loading) the guard opens and callers use their local fallback.
+        # Everything is bounded by the request deadline.
+        max_retries = 2
+        retry_delay = 0.5
 
         for attempt in range(max_retries):
-            try:
-                logger.info(f"Querying model {self.model} for {task_type} (attempt {attempt+1}/{max_retries})")
-                logger.debug(f"Sending payload: {payload}")
-                response = requests.post(api_url, headers=headers, json=payload, timeout=60)  # Increased timeout
-
-                if response.status_code == 200:
-                    try:
-                        result = response.json()
-                        logger.debug(f"API response: {result}")
-
-                        # Handle different response formats
-                        if isinstance(result, list) and len(result) > 0:
-                            if "generated_text" in result[0]:
-                                return result[0]["generated_text"]
-                            else:
-                                return str(result[0])
-                        elif isinstance(result, dict):
-                            if "generated_text" in result:
-                                return result["generated_text"]
-                            else:
-                                return str(result)
-                        else:
-                            return str(result)
-                    except Exception as e:
-                        logger.error(f"Failed to parse API response: {str(e)}")
-                        return response.text  # Return raw text if JSON parsing fails
-
-                elif response.status_code == 429:
-                    logger.warning(f"Rate limit exceeded. Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    continue
+            if deadline.expired():
+                break
+            result, retryable = self._hedged_attempt(api_url, headers, payload, task_type, attempt, max_retries)
+            if result is not None:
+                return result
+            if deadline.expired():
+                break
+            if not retryable:
+                return None
+            if attempt < max_retries - 1:
+                delay = retry_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                if deadline.cap(delay) < delay:
+                    break
+                time.sleep(delay)
+                continue
+            logger.error(f"Failed to get response after {max_retries} attempts")
+            return None
 
-                elif response.status_code == 503:
-                    logger.warning(f"Model is loading. Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    continue
+        logger.warning(f"Deadline reached while querying model for {task_type}, using local fallback")
+        INFERENCE_DEADLINE_EXCEEDED.inc(task=task_type)
+        return None
 
-                else:
-                    logger.error(f"API request failed with status {response.status_code}: {response.text}")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return None
+    def _hedged_attempt(self, api_url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                        task_type: str, attempt: int, max_retries: int) -> Tuple[Optional[str], bool]:
+        """Send the request; if it takes longer than the usual p95, race a second copy and keep the first answer"""
+        executor = get_inference_executor()
+        guard = get_upstream_guard()
 
-            except requests.Timeout:
-                logger.warning(f"Request timed out. Retrying in {retry_delay} seconds...")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
+        def submit(hedge: bool = False) -> Optional[Future]:
+            try:
+                # A hedge is only worth sending with a slot to spare; the first copy queues for one
+                permit = guard.acquire(task_type, wait=not hedge)
+            except UpstreamUnavailable as e:
+                logger.info(f"Skipping model query for {task_type}: {e.reason}")
                 return None
+            # Copy the context so the attempt sees this request's deadline and profile
+            return executor.submit(contextvars.copy_context().run, self._attempt, permit,
+                                   api_url, headers, payload, task_type, attempt, max_retries)
+
+        primary = submit()
+        if primary is None:
+            return None, False
+        pending = {primary}
+        done, _ = wait(pending, timeout=deadline.cap(hedge_delay(task_type)))
+        if not done and HEDGING_ENABLED and not deadline.expired():
+            hedge = submit(hedge=True)
+            if hedge is not None:
+                logger.info(f"Model query for {task_type} is slow, sent a hedged request")
+                INFERENCE_HEDGES.inc(task=task_type, outcome="sent")
+                pending.add(hedge)
+
+        retryable = False
+        while pending:
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                # Out of time: the losing requests finish in the background and release their permits
+                return None, False
+            for future in done:
+                result, future_retryable = future.result()
+                if result is not None:
+                    if future is not primary:
+                        INFERENCE_HEDGES.inc(task=task_type, outcome="won")
+                    return result, False
+                retryable = retryable or future_retryable
+        return None, retryable
+
+    def _attempt(self, permit: Permit, api_url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                 task_type: str, attempt: int, max_retries: int) -> Tuple[Optional[str], bool]:
+        """Send one admitted request and report its outcome to the guard; returns (text, worth retrying)"""
+        try:
+            logger.info(f"Querying model {self.model} for {task_type} (attempt {attempt+1}/{max_retries})")
+            logger.debug(f"Sending payload: {payload}")
+            start = time.perf_counter()
+            status = "error"
+            try:
+                response = requests.post(api_url, headers=headers, json=payload, timeout=deadline.cap(60))
+                status = str(response.status_code)
+            except requests.Timeout:
+                status = "timeout"
+                raise
+            finally:
+                INFERENCE_SECONDS.observe(time.perf_counter() - start, task=task_type, status=status)
 
-            except Exception as e:
-                logger.error(f"Error querying model: {str(e)}")
+            if response.status_code == 200:
+                permit.success()
+                get_latency_tracker().observe(task_type, time.perf_counter() - start)
+                try:
+                    result = response.json()
+                    logger.debug(f"API response: {result}")
+
+                    # Handle different response formats
+                    if isinstance(result, list) and len(result) > 0:
+                        if "generated_text" in result[0]:
+                            return result[0]["generated_text"], False
+                        else:
+                            return str(result[0]), False
+                    elif isinstance(result, dict):
+                        if "generated_text" in result:
+                            return result["generated_text"], False
+                        else:
+                            return str(result), False
+                    else:
+                        return str(result), False
+                except Exception as e:
+                    logger.error(f"Failed to parse API response: {str(e)}")
+                    return response.text, False  # Return raw text if JSON parsing fails
+
+            elif response.status_code == 429:
+                retry_after = _retry_after(response)
+                logger.warning(f"Rate limit exceeded, using local fallback (retry after {retry_after}s)")
+                INFERENCE_RATE_LIMITED.inc(task=task_type)
+                permit.overloaded(retry_after)
+                return None, False
+
+            elif response.status_code == 503:
+                estimated = _estimated_load_time(response)
+                logger.warning(f"Model is loading, using local fallback (ready in about {estimated}s)")
+                permit.overloaded(estimated)
+                return None, False
+
+            elif response.status_code >= 500:
+                logger.error(f"API request failed with status {response.status_code}: {response.text}")
+                permit.failure()
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                return None
+                    INFERENCE_RETRIES.inc(task=task_type, reason="error")
+                return None, True
 
-        logger.error(f"Failed to get response after {max_retries} attempts")
-        return None
+            else:
+                # Client errors will not succeed on retry and say nothing about upstream health
+                logger.error(f"API request failed with status {response.status_code}: {response.text}")
+                permit.cancel()
+                return None, False
+
+        except requests.Timeout:
+            logger.warning("Request timed out")
+            permit.failure()
+            if attempt < max_retries - 1:
+                INFERENCE_RETRIES.inc(task=task_type, reason="timeout")
+            return None, True
+
+        except Exception as e:
+            logger.error(f"Error querying model: {str(e)}")
+            permit.failure()
+            if attempt < max_retries - 1:
+                INFERENCE_RETRIES.inc(task=task_type, reason="exception")
+            return None, True
 
-    def summarize_text(self, text: str) -> str:
+    def summarize_text(self, text: str, doc: Optional[ParsedDocument] = None) -> str:
         """Generate a summary of the text"""
         if not text or not text.strip():
             return "No content to summarize."
@@ -211,7 +298,8 @@ Your summary should capture the main points and key details in a clear, coherent
                         return cleaned_result
 
             # Local implementation as fallback
-            sentences = self._extract_sentences(text)
+            doc = doc or self.parse_document(text)
+            sentences = doc.sentences
 
             if not sentences:
                 return "No content to summarize."
@@ -220,14 +308,11 @@ Your summary should capture the main points and key details in a clear, coherent
             summary = sentences[0]
 
             # Extract keywords
-            keywords = self._extract_keywords(text)
+            keywords = doc.keywords
 
             # Find sentences with keywords (excluding the first sentence)
-            important_sentences = []
-            for sentence in sentences[1:]:
-                score = sum(1 for keyword in keywords if keyword.lower() in sentence.lower())
-                if score > 0:
-                    important_sentences.append((sentence, score))
+            important_sentences = [(sentences[index], score)
+                                   for index, score in sorted(doc.keyword_sentence_scores().items()) if index > 0]
 
             # Sort by importance score and add top sentences to summary
             important_sentences.sort(key=lambda x: x[1], reverse=True)
@@ -244,7 +329,7 @@ Your summary should capture the main points and key details in a clear, coherent
             logger.error(f"Error during summarization: {str(e)}")
             return "Error generating summary. Please try again."
 
-    def generate_quiz(self, text: str) -> Dict[str, List[Dict[str, Any]]]:
+    def generate_quiz(self, text: str, doc: Optional[ParsedDocument] = None) -> Dict[str, List[Dict[str, Any]]]:
         """Generate a quiz based on the text"""
         if not text.strip():
             return {"mcq": [], "true_false": [], "fill_blank": []}
@@ -292,8 +377,9 @@ Text to create quiz from:
                     logger.error(f"Failed to parse quiz JSON: {str(e)}")
 
         # Local implementation as fallback
-        sentences = self._extract_sentences(text)
-        keywords = self._extract_keywords(text)
+        doc = doc or self.parse_document(text)
+        sentences = doc.sentences
+        keywords = doc.keywords
 
         quiz = {
             "mcq": [],
@@ -339,7 +425,6 @@ Text to create quiz from:
                     if len(words) > 3:
                         # Replace a word with a keyword
                         idx = random.randint(0, len(words) - 1)
-                        original_word = words[idx]
                         words[idx] = random.choice(keywords) if keywords else "different"
                         question = f"The text states: '{' '.join(words)}'"
                     else:
@@ -354,18 +439,19 @@ Text to create quiz from:
         if keywords:
             for i in range(min(2, len(keywords))):
                 keyword = keywords[i]
+                keyword_id = doc.keyword_ids[i]
 
-                # Find a sentence containing the keyword
-                for sentence in sentences:
-                    if keyword.lower() in sentence.lower():
-                        # Create a fill-in-the-blank question
-                        blank_sentence = re.sub(r'\b' + re.escape(keyword) + r'\b', "______", sentence, flags=re.IGNORECASE)
+                # First sentence containing the keyword
+                containing = doc.sentences_with(keyword_id)
+                if containing:
+                    sentence = sentences[containing[0]]
+                    # Create a fill-in-the-blank question
+                    blank_sentence = re.sub(r'\b' + re.escape(keyword) + r'\b', "______", sentence, flags=re.IGNORECASE)
 
-                        quiz["fill_blank"].append({
-                            "question": blank_sentence,
-                            "answer": keyword
-                        })
-                        break
+                    quiz["fill_blank"].append({
+                        "question": blank_sentence,
+                        "answer": keyword
+                    })
 
         # Ensure there's at least one question in each category
         if not quiz["mcq"]:
@@ -389,7 +475,7 @@ Text to create quiz from:
 
         return quiz
 
-    def generate_mindmap(self, text: str) -> Dict[str, Any]:
+    def generate_mindmap(self, text: str, doc: Optional[ParsedDocument] = None) -> Dict[str, Any]:
         """Generate a mind map from the text"""
         if not text.strip():
             return {"central": "Empty", "branches": []}
@@ -429,8 +515,8 @@ Text to create mind map from:
                     logger.error(f"Failed to parse mindmap JSON: {str(e)}")
 
         # Local implementation as fallback
-        keywords = self._extract_keywords(text)
-        sentences = self._extract_sentences(text)
+        doc = doc or self.parse_document(text)
+        keywords = doc.keywords
 
         # Create simple mind map structure
         central_topic = "Main Topic"
@@ -440,21 +526,11 @@ Text to create mind map from:
             central_topic = keywords[0].capitalize()
 
         branches = []
-        for word in keywords[1:7]:  # Use the next 6 most common words as branches
-            # Find sentences containing this keyword
-            related_sentences = [s for s in sentences if word.lower() in s.lower()]
-            related_words = []
-
-            if related_sentences:
-                # Extract related words from sentences containing this keyword
-                for sentence in related_sentences:
-                    words = [w for w in sentence.split()
-                           if len(w) > 3 and w.lower() != word.lower() and w.lower() not in stop_words]
-                    related_words.extend(words)
-
-            # Get the most common related words
-            related_count = Counter(related_words)
-            subtopics = [w.capitalize() for w, _ in related_count.most_common(3)]
+        for keyword_id in doc.keyword_ids[1:7]:  # Use the next 6 most common words as branches
+            word = doc.vocab[keyword_id]
+
+            # Words that co-occur most with this keyword, from the document's posting lists
+            subtopics = [doc.vocab[term_id].capitalize() for term_id in doc.related_terms(keyword_id, 3)]
 
             # If we couldn't find related words, use generic subtopics
             if not subtopics:
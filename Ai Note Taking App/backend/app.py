@@ -1,25 +1,47 @@
+# Imported first so startup phases are measured from the beginning of the import
+import startup
 from fastapi import FastAPI, HTTPException, Body, Depends, Request, UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel, Field
 import os
 from pathlib import Path
-import uvicorn
 import logging
 from typing import List, Dict, Optional, Any, Union
 import json
-import requests
 import time
 from functools import lru_cache
 import asyncio
-import httpx
 from contextlib import asynccontextmanager
 from ai_service import get_ai_service
-from PyPDF2 import PdfReader
-from werkzeug.utils import secure_filename
-from PIL import Image
-import pytesseract
+from upstream import get_upstream_guard
+from deadline import budget, request_budget
+from serialization import DefaultJSONResponse, RawJSONResponse, dumps
+from sync import change_notifier, fetch_changes, stream_changes
+from metrics import (registry, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_PROGRESS, PDF_PAGES,
+                     PDF_EXTRACTION_SECONDS, PDF_PAGES_PER_SECOND, NOTE_VERSION_CONFLICTS)
+from profiling import (PROFILING_ENABLED, PROFILING_SAMPLE_RATE, profile_request, stage,
+                       list_profiles, load_profile)
+from lazy import lazy_import, warm_up
+from upload_store import get_upload_store, spool_upload
+from temp_storage import get_temp_storage
+from cache import get_backend
+from resumable_uploads import UploadSessionError, get_resumable_uploads
+from admission import UploadAdmissionMiddleware
+from scheduler import SchedulerMiddleware, get_scheduler
+from write_behind import get_write_behind
+from pdf_extraction import PDFExtraction, first_line_title
+import extraction_workers
+from extraction_workers import ExtractionFailed, describe_failure, extract_pdf, extract_image_text
+
+# Heavy modules are imported on first use or by the background warm-up
+requests = lazy_import("requests")
+
+# Load heavy modules in the background after startup instead of on the first request
+WARM_UP = os.getenv("WARM_UP", "true").lower() in ("1", "true", "yes")
 
 # Configure logging
 logging.basicConfig(
@@ -34,22 +56,49 @@ logger = logging.getLogger(__name__)
 
 # Application startup and shutdown events
 # Import the init_db function from database module
-from database import init_db, get_all_notes, get_note_by_id, save_note, update_note, delete_note
+from database import (init_db, prune_tombstones, get_all_notes_json, get_note_by_id, save_note, update_note, delete_note,
+                      VersionConflict)
+from text_patch import PatchError, apply_edits, apply_unified_diff
+
+startup.mark("imports")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Initializing database...")
     try:
-        init_db()  # This line was causing the error
+        with startup.phase("database"):
+            init_db()  # This line was causing the error
+            prune_tombstones()
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.critical(f"Database initialization failed: {str(e)}")
     
+    registry.start_flusher()
+    
+    # Remove uploads left behind by earlier runs, then sweep expired ones and expired cache entries periodically
+    temp_storage = get_temp_storage()
+    temp_storage.cleanup_orphans()
+    janitor = asyncio.create_task(temp_storage.run_janitor(on_sweep=get_backend().purge_expired))
+    
+    # Autosaves are merged and written in batches; pending ones are flushed on shutdown
+    write_behind = get_write_behind()
+    flusher = asyncio.create_task(write_behind.run(change_notifier.notify)) if write_behind.enabled else None
+    
+    if WARM_UP:
+        asyncio.get_running_loop().run_in_executor(None, warm_up)
+    
     yield
     
     # Shutdown
     logger.info("Shutting down...")
+    janitor.cancel()
+    if flusher is not None:
+        flusher.cancel()
+    flushed = write_behind.flush()
+    if flushed:
+        logger.info(f"Flushed pending updates of {flushed} notes")
+    extraction_workers.shutdown()
 
     logger.info("Shutting down application...")
 
@@ -58,15 +107,23 @@ app = FastAPI(
     title="Smart Note-Taking API",
     description="An API for managing notes with AI-powered summarization, quiz generation, and mind mapping",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=DefaultJSONResponse
 )
 
+# Reject oversized, mistyped or excess concurrent uploads while their bodies stream in
+# (added before CORS so rejections still carry CORS headers)
+app.add_middleware(UploadAdmissionMiddleware)
+
+# Separate pools and queues for interactive, AI and ingestion requests; shed with 503 past the queue SLO
+app.add_middleware(SchedulerMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
     allow_origins=os.getenv("ALLOWED_ORIGINS", "*").split(","),
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["*"],
     max_age=86400,  # 24 hours
     expose_headers=["Content-Length", "Content-Type", "Content-Disposition"],
@@ -77,6 +134,21 @@ app.add_middleware(
 async def get_status():
     return {"status": "ok", "version": "2.0.0"}
 
+# Give every request a time budget (REQUEST_TIMEOUT, or less via X-Request-Timeout);
+# AI calls made while serving it stop and fall back locally when it runs out. File
+# ingestion gets INGESTION_TIMEOUT instead, so long PDF/OCR extractions are not cut short.
+@app.middleware("http")
+async def deadline_middleware(request: Request, call_next):
+    request_class = get_scheduler().classify(request.method, request.url.path)
+    ingestion = request_class is not None and request_class.name == "ingestion"
+    with budget(request_budget(request.headers, ingestion=ingestion)):
+        return await call_next(request)
+
+# Opt-in request profiling (X-Profile header or sampled)
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    return await profile_request(request, call_next)
+
 # Add error handling middleware
 @app.middleware("http")
 async def error_handling_middleware(request: Request, call_next):
@@ -89,6 +161,27 @@ async def error_handling_middleware(request: Request, call_next):
             content={"detail": "Internal server error. Please try again later."}
         )
 
+# Record request latency per route template (not per raw path, to keep label cardinality bounded)
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    start = time.perf_counter()
+    method = request.method
+    status = 500
+    HTTP_REQUESTS_IN_PROGRESS.inc(method=method)
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUESTS_IN_PROGRESS.dec(method=method)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=method, route=route, status=str(status))
+
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Define the path to the frontend directory
 frontend_dir = Path(__file__).parent.parent / "frontend"
 if not frontend_dir.exists():
@@ -125,6 +218,15 @@ class NoteCreate(BaseModel):
     quiz: Optional[str] = Field(None, description="Quiz related to the note content")
     mindmap: Optional[str] = Field(None, description="Mind map of the note content")
 
+class UploadSessionCreate(BaseModel):
+    filename: str = Field(..., min_length=1, max_length=255, description="Name of the file being uploaded")
+    size: int = Field(..., gt=0, description="Total size of the file in bytes")
+    kind: str = Field("pdf", description="Process the file like /api/upload-pdf (pdf) or /api/handwriting (handwriting)")
+    sha256: Optional[str] = Field(None, description="SHA-256 of the whole file, checked when the upload completes")
+
+class UploadSessionComplete(BaseModel):
+    sha256: Optional[str] = Field(None, description="SHA-256 of the whole file, if not given when the session was created")
+
 class NoteUpdate(BaseModel):
     title: Optional[str] = Field(None, min_length=1, max_length=200, description="The updated title of the note")
     content: Optional[str] = Field(None, min_length=1, description="The updated content of the note")
@@ -132,6 +234,17 @@ class NoteUpdate(BaseModel):
     quiz: Optional[str] = Field(None, description="Updated quiz related to the note content")
     mindmap: Optional[str] = Field(None, description="Updated mind map of the note content")
 
+class NoteEdit(BaseModel):
+    offset: int = Field(..., ge=0, description="Position in the base content, in Unicode code points")
+    delete: int = Field(0, ge=0, description="Number of characters removed at the offset")
+    insert: str = Field("", description="Text inserted at the offset")
+
+class NotePatch(BaseModel):
+    base_version: int = Field(..., ge=1, description="Version of the note the edits were made against")
+    ops: Optional[List[NoteEdit]] = Field(None, description="Edits of the content, sorted by offset and not overlapping")
+    diff: Optional[str] = Field(None, description="Unified diff of the content against the base version")
+    title: Optional[str] = Field(None, min_length=1, max_length=200, description="The updated title of the note")
+
 # API Configuration class
 class APIConfig:
     def __init__(self):
@@ -149,20 +262,56 @@ class APIConfig:
 def get_api_config():
     return APIConfig()
 
+# Helper function to write this worker's buffered updates before acting on the stored notes
+async def flush_write_behind():
+    write_behind = get_write_behind()
+    if write_behind.has_unwritten() and await run_in_threadpool(write_behind.flush):
+        change_notifier.notify()
+
 # API endpoints for notes
-@app.get("/api/notes", response_model=Dict[str, List[Dict[str, Any]]])
+# The list is built from trusted database rows, so it skips response_model
+# validation and is serialized directly to JSON bytes
+@app.get("/api/notes", response_class=RawJSONResponse)
 async def api_get_notes():
     try:
-        notes = get_all_notes()
-        return {"notes": notes}
+        # This worker's buffered autosaves are overlaid, not flushed, so they keep being merged
+        return RawJSONResponse(content=get_all_notes_json(overlay=get_write_behind().overlay_notes))
     except Exception as e:
         logger.error(f"Failed to retrieve notes: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to retrieve notes")
 
+# Delta sync: only the notes created, updated or deleted after a change cursor.
+# Pass wait=<seconds> to long-poll until something changes.
+@app.get("/api/notes/changes", response_class=RawJSONResponse)
+async def api_get_note_changes(since: int = 0, wait: float = 0):
+    try:
+        changes = await fetch_changes(since, wait)
+        if changes is None:
+            raise HTTPException(status_code=500, detail="Failed to retrieve changes")
+        changes["notes"] = get_write_behind().overlay_notes(changes["notes"])
+        return RawJSONResponse(content=dumps(changes))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to retrieve changes since {since}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve changes")
+
+# Server-sent events stream of note changes
+@app.get("/api/notes/changes/stream")
+async def api_stream_note_changes(request: Request, since: Optional[int] = None):
+    # EventSource reconnects with the last event id it received
+    if since is None:
+        since = int(request.headers.get("last-event-id", 0) or 0)
+    return StreamingResponse(
+        stream_changes(request, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/notes/{note_id}", response_model=Dict[str, Any])
 async def api_get_note(note_id: int):
     try:
-        note = get_note_by_id(note_id)
+        note = get_write_behind().overlay(get_note_by_id(note_id))
         if not note:
             raise HTTPException(status_code=404, detail=f"Note with ID {note_id} not found")
         return note
@@ -172,6 +321,53 @@ async def api_get_note(note_id: int):
         logger.error(f"Failed to retrieve note {note_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve note {note_id}")
 
+# Results for empty notes, matching the individual AI endpoints
+EMPTY_ANALYSIS = {
+    "summary": "No content to summarize.",
+    "quiz": {"mcq": [], "true_false": [], "fill_blank": []},
+    "mindmap": {"central": "Empty", "branches": []},
+}
+
+@app.post("/api/notes/{note_id}/analyze")
+async def analyze_note(note_id: int):
+    """Summary, quiz and mind map of a note, streamed as NDJSON lines in the order they finish"""
+    try:
+        note = get_write_behind().overlay(get_note_by_id(note_id))
+    except Exception as e:
+        logger.error(f"Failed to retrieve note {note_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve note {note_id}")
+    if not note:
+        raise HTTPException(status_code=404, detail=f"Note with ID {note_id} not found")
+
+    content = (note.get("content") or "").strip()
+    ai_service = get_ai_service()
+    generators = {
+        "summary": ai_service.summarize_text,
+        "quiz": ai_service.generate_quiz,
+        "mindmap": ai_service.generate_mindmap,
+    }
+
+    async def results():
+        if not content:
+            for task, result in EMPTY_ANALYSIS.items():
+                yield dumps({"task": task, task: result}) + b"\n"
+            return
+
+        # Split the text once; all three generators reuse the sentences, tokens and keywords
+        doc = await run_in_threadpool(ai_service.parse_document, content)
+
+        async def run(task: str, generate):
+            try:
+                return {"task": task, task: await run_in_threadpool(generate, content, doc)}
+            except Exception as e:
+                logger.error(f"Failed to generate {task} for note {note_id}: {str(e)}")
+                return {"task": task, "error": f"Failed to generate {task}"}
+
+        for finished in asyncio.as_completed([run(task, generate) for task, generate in generators.items()]):
+            yield dumps(await finished) + b"\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.post("/api/notes", response_model=Dict[str, Union[int, str]])
 async def api_create_note(note: NoteCreate):
     try:
@@ -184,6 +380,7 @@ async def api_create_note(note: NoteCreate):
         )
         if note_id == -1:
             raise HTTPException(status_code=500, detail="Failed to create note")
+        change_notifier.notify()
         return {"id": note_id, "message": "Note created successfully"}
     except HTTPException:
         raise
@@ -194,15 +391,22 @@ async def api_create_note(note: NoteCreate):
 @app.put("/api/notes/{note_id}", response_model=Dict[str, str])
 async def api_update_note(note_id: int, note: NoteUpdate):
     try:
-        existing_note = get_note_by_id(note_id)
+        write_behind = get_write_behind()
+        existing_note = write_behind.overlay(get_note_by_id(note_id))
         if not existing_note:
             raise HTTPException(status_code=404, detail=f"Note with ID {note_id} not found")
 
         update_data = {key: value for key, value in note.dict().items() if value is not None}
-        success = update_note(note_id, update_data)
+        if write_behind.enabled:
+            # Written with other pending updates within WRITE_BEHIND_WINDOW; reads here see it already,
+            # at the version it will have once written
+            write_behind.update(note_id, update_data, existing_note["version"])
+            return {"message": "Note updated successfully"}
 
+        success = update_note(note_id, update_data)
         if not success:
             raise HTTPException(status_code=500, detail="Update failed")
+        change_notifier.notify()
         return {"message": "Note updated successfully"}
     except HTTPException:
         raise
@@ -210,6 +414,60 @@ async def api_update_note(note_id: int, note: NoteUpdate):
         logger.error(f"Failed to update note {note_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update note {note_id}")
 
+def version_conflict_response(version: int, stage: str) -> JSONResponse:
+    NOTE_VERSION_CONFLICTS.inc(stage=stage)
+    return JSONResponse(status_code=409, content={
+        "detail": "Note has changed since the base version, fetch it and apply the edit again",
+        "version": version,
+    })
+
+@app.patch("/api/notes/{note_id}", response_model=Dict[str, Any])
+async def api_patch_note(note_id: int, patch: NotePatch):
+    """Apply edits or a unified diff to a note's content, if the note is still at the base version"""
+    if patch.ops is not None and patch.diff is not None:
+        raise HTTPException(status_code=422, detail="Send either ops or diff, not both")
+    if patch.ops is None and patch.diff is None and patch.title is None:
+        raise HTTPException(status_code=422, detail="Nothing to change: send ops, diff or title")
+    try:
+        # Buffered autosaves are written first so the edit is checked against the stored version
+        await flush_write_behind()
+        existing_note = get_note_by_id(note_id)
+        if not existing_note:
+            raise HTTPException(status_code=404, detail=f"Note with ID {note_id} not found")
+        if existing_note["version"] != patch.base_version:
+            return version_conflict_response(existing_note["version"], stage="request")
+
+        update_data: Dict[str, Any] = {}
+        try:
+            if patch.ops is not None:
+                update_data["content"] = apply_edits(existing_note["content"],
+                                                     [(op.offset, op.delete, op.insert) for op in patch.ops])
+            elif patch.diff is not None:
+                update_data["content"] = apply_unified_diff(existing_note["content"], patch.diff)
+        except PatchError as e:
+            raise HTTPException(status_code=422, detail=f"Patch does not apply: {str(e)}")
+        if patch.title is not None:
+            update_data["title"] = patch.title
+
+        # Never buffered: the version check and the write happen together, so a conflict is answered here
+        try:
+            success = update_note(note_id, update_data, expected_version=patch.base_version)
+        except VersionConflict:
+            # Another worker wrote the note since it was read
+            current = get_note_by_id(note_id)
+            if not current:
+                raise HTTPException(status_code=404, detail=f"Note with ID {note_id} not found")
+            return version_conflict_response(current["version"], stage="write")
+        if not success:
+            raise HTTPException(status_code=500, detail="Update failed")
+        change_notifier.notify()
+        return {"message": "Note updated successfully", "version": patch.base_version + 1}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to patch note {note_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to patch note {note_id}")
+
 @app.delete("/api/notes/{note_id}", response_model=Dict[str, str])
 async def api_delete_note(note_id: int):
     try:
@@ -217,9 +475,11 @@ async def api_delete_note(note_id: int):
         if not existing_note:
             raise HTTPException(status_code=404, detail=f"Note with ID {note_id} not found")
 
+        get_write_behind().discard(note_id)
         success = delete_note(note_id)
         if not success:
             raise HTTPException(status_code=500, detail="Delete failed")
+        change_notifier.notify()
         return {"message": "Note deleted successfully"}
     except HTTPException:
         raise
@@ -238,6 +498,66 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Helper function to extract the text of an uploaded PDF
+async def extract_uploaded_pdf(file_path: Path, filename: str, digest: str):
+    """Text of a spooled PDF upload, reusing an earlier extraction of the same bytes"""
+    temp_storage = get_temp_storage()
+    
+    # The same bytes were uploaded before: reuse that extraction
+    upload_store = get_upload_store()
+    cached = upload_store.get_result(digest, "upload-pdf")
+    if cached is not None:
+        logger.info(f"Reusing extracted text of {digest[:12]} for {filename}")
+        return {"truncated": False, **cached, "filename": filename}
+
+    # Extract text from PDF
+    extracted_text = ""
+    try:
+        start = time.perf_counter()
+        # Text layer where there is one, OCR for scanned pages
+        extraction = await run_in_threadpool(extract_pdf, file_path, "upload-pdf")
+        for page_text in extraction.texts:
+            if page_text:
+                extracted_text += page_text + "\n\n"
+        record_pdf_extraction("upload-pdf", extraction.page_count, time.perf_counter() - start)
+
+        # Clean up the extracted text
+        extracted_text = extracted_text.strip()
+
+        # Get a title suggestion from the first few words
+        title_suggestion = " ".join(extracted_text.split()[:5]) + "..."
+        if len(title_suggestion) > 50:
+            title_suggestion = title_suggestion[:50] + "..."
+
+        logger.info(f"Successfully extracted {len(extracted_text)} characters from PDF")
+
+        result = {
+            "text": extracted_text,
+            "title": title_suggestion,
+            "pages": extraction.page_count,
+            "ocr_pages": extraction.ocr_pages,
+            "truncated": False
+        }
+        if not extraction.complete:
+            # A limit stopped extraction early: return what we have, but do not keep it
+            return {**result, **truncation_fields(extraction), "filename": filename}
+        upload_store.put(digest, file_path, "upload-pdf", result)
+
+        return {**result, "filename": filename}
+    except ExtractionFailed as e:
+        logger.error(f"Error extracting text from PDF: {str(e)}")
+        temp_storage.discard(file_path)
+        return extraction_failed_response(e)
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF: {str(e)}")
+        # Try to clean up the file
+        temp_storage.discard(file_path)
+
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Error extracting text from PDF: {str(e)}"}
+        )
+
 # Single PDF upload endpoint
 @app.post("/api/upload-pdf")
 async def upload_pdf(file: UploadFile = File(...)):
@@ -254,62 +574,16 @@ async def upload_pdf(file: UploadFile = File(...)):
                 content={"detail": "Only PDF files are accepted"}
             )
         
-        # Create temp directory if it doesn't exist
-        temp_dir = Path(__file__).parent / "temp"
-        temp_dir.mkdir(exist_ok=True)
+        # Save the uploaded file under a unique name; the temp janitor deletes it later
+        temp_storage = get_temp_storage()
+        file_path = temp_storage.new_path(file.filename)
         
-        # Save the uploaded file with a timestamp to avoid conflicts
-        timestamp = int(time.time())
-        safe_filename = secure_filename(file.filename)
-        file_path = temp_dir / f"{timestamp}_{safe_filename}"
-        
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        
-        logger.info(f"Saved PDF to {file_path}")
-        
-        # Extract text from PDF
-        extracted_text = ""
-        try:
-            with open(file_path, "rb") as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        extracted_text += page_text + "\n\n"
-            
-            # Clean up the extracted text
-            extracted_text = extracted_text.strip()
-            
-            # Get a title suggestion from the first few words
-            title_suggestion = " ".join(extracted_text.split()[:5]) + "..."
-            if len(title_suggestion) > 50:
-                title_suggestion = title_suggestion[:50] + "..."
-            
-            logger.info(f"Successfully extracted {len(extracted_text)} characters from PDF")
-            
-            # Schedule file for deletion after 10 minutes
-            asyncio.create_task(delete_file_after_delay(file_path, delay=600))
-            
-            return {
-                "text": extracted_text,
-                "title": title_suggestion,
-                "pages": len(pdf_reader.pages),
-                "filename": file.filename
-            }
-        except Exception as e:
-            logger.error(f"Error extracting text from PDF: {str(e)}")
-            # Try to clean up the file
-            try:
-                if file_path.exists():
-                    file_path.unlink()
-            except:
-                pass
-                
-            return JSONResponse(
-                status_code=500,
-                content={"detail": f"Error extracting text from PDF: {str(e)}"}
-            )
+        with stage("upload_spool"):
+            digest, _ = await spool_upload(file, file_path)
+        with temp_storage.in_use(file_path):
+            temp_storage.register(file_path)
+            logger.info(f"Saved PDF to {file_path}")
+            return await extract_uploaded_pdf(file_path, file.filename, digest)
     except Exception as e:
         logger.error(f"Error processing PDF upload: {str(e)}")
         return JSONResponse(
@@ -317,16 +591,27 @@ async def upload_pdf(file: UploadFile = File(...)):
             content={"detail": f"Error processing PDF upload: {str(e)}"}
         )
 
-# Helper function to delete files after a delay
-async def delete_file_after_delay(file_path: Path, delay: int = 600):
-    """Delete a file after a specified delay in seconds"""
-    try:
-        await asyncio.sleep(delay)
-        if file_path.exists():
-            file_path.unlink()
-            logger.info(f"Deleted temporary file {file_path} after {delay} seconds")
-    except Exception as e:
-        logger.error(f"Error deleting temporary file {file_path}: {str(e)}")
+# Helper function to answer an extraction stopped by a worker limit
+def extraction_failed_response(error: ExtractionFailed) -> JSONResponse:
+    status_code = 503 if error.reason == "busy" else 422
+    return JSONResponse(status_code=status_code, content={"detail": str(error)})
+
+# Helper function to describe an extraction that stopped early or skipped OCR
+def truncation_fields(extraction: PDFExtraction) -> Dict[str, Any]:
+    return {
+        "partial": True,
+        "truncated": True,
+        "pages_extracted": extraction.pages_extracted,
+        "total_pages": extraction.total_pages,
+        "warning": describe_failure(extraction.error)
+    }
+
+# Helper function to record PDF extraction throughput
+def record_pdf_extraction(endpoint: str, pages: int, elapsed: float):
+    PDF_PAGES.inc(pages, endpoint=endpoint)
+    PDF_EXTRACTION_SECONDS.observe(elapsed, endpoint=endpoint)
+    if elapsed > 0:
+        PDF_PAGES_PER_SECOND.observe(pages / elapsed, endpoint=endpoint)
 
 # Helper function to extract items from text
 def extract_items_from_text(text: str) -> List[str]:
@@ -358,6 +643,128 @@ def extract_items_from_text(text: str) -> List[str]:
 
     return items
 
+# Helper function to extract the text of an uploaded handwriting image or PDF
+async def extract_handwriting(file_path: Path, filename: str, digest: str):
+    """Text of a spooled handwriting upload: PDF extraction or OCR of an image"""
+    temp_storage = get_temp_storage()
+    upload_store = get_upload_store()
+
+    # Check if it's a PDF file
+    if filename.lower().endswith('.pdf'):
+        logger.info("Processing PDF file")
+
+        # The same bytes were uploaded before: reuse that extraction
+        cached = upload_store.get_result(digest, "handwriting-pdf")
+        if cached is not None:
+            logger.info(f"Reusing extracted text of {digest[:12]} for {filename}")
+            return {
+                "text": cached["text"],
+                "title": cached["title"] or "Notes from " + filename,
+                "pages": cached["pages"],
+                "ocr_pages": cached.get("ocr_pages", 0),
+                "truncated": False,
+                "filename": filename
+            }
+
+        # Extract text from PDF
+        text = ""
+        title = "Notes from " + filename
+        page_title = None
+
+        try:
+            start = time.perf_counter()
+            # Text layer where there is one, OCR for scanned and handwritten pages
+            extraction = await run_in_threadpool(extract_pdf, file_path, "handwriting")
+            for page_text in extraction.texts:
+                if page_text:
+                    text += page_text + "\n\n"
+
+            # If we have a title page, use its first line as the title
+            if extraction.pages:
+                page_title = first_line_title(extraction.pages[0].text)
+                if page_title:
+                    title = page_title
+            record_pdf_extraction("handwriting", extraction.page_count, time.perf_counter() - start)
+
+            logger.info(f"Successfully extracted {len(text)} characters from PDF "
+                        f"({extraction.ocr_pages} pages OCRed)")
+            response = {
+                "text": text,
+                "title": title,
+                "pages": extraction.page_count,
+                "ocr_pages": extraction.ocr_pages,
+                "truncated": False,
+                "filename": filename
+            }
+            if not extraction.complete:
+                # A limit stopped extraction early: return what we have, but do not keep it
+                return {**response, **truncation_fields(extraction)}
+            upload_store.put(digest, file_path, "handwriting-pdf",
+                             {"text": text, "title": page_title, "pages": extraction.page_count,
+                              "ocr_pages": extraction.ocr_pages})
+
+
+            # Return in the same format as the upload-pdf endpoint for consistency
+            return response
+
+        except ExtractionFailed as e:
+            logger.error(f"Error extracting text from PDF: {str(e)}")
+            temp_storage.discard(file_path)
+            return extraction_failed_response(e)
+        except Exception as e:
+            logger.error(f"Error extracting text from PDF: {str(e)}")
+            # Try to clean up the file
+            temp_storage.discard(file_path)
+
+            return JSONResponse(
+                status_code=500,
+                content={"detail": f"Error extracting text from PDF: {str(e)}"}
+            )
+    else:
+        # For non-PDF files, use OCR
+        logger.info("Processing non-PDF file with OCR")
+        try:
+            # The same image was recognized before: reuse that OCR output
+            cached = upload_store.get_result(digest, "ocr")
+            if cached is not None:
+                logger.info(f"Reusing OCR output of {digest[:12]} for {filename}")
+                text = cached["text"]
+            else:
+                # OCR in an isolated, resource-limited extraction process
+                text = await run_in_threadpool(extract_image_text, file_path)
+
+                if text and len(text.strip()) >= 10:
+                    upload_store.put(digest, file_path, "ocr", {"text": text})
+
+            if not text or len(text.strip()) < 10:
+                # Try to clean up the file
+                temp_storage.discard(file_path)
+
+                return JSONResponse(
+                    status_code=400, 
+                    content={"detail": "Could not extract meaningful text from the image"}
+                )
+
+
+            return {
+                "text": text,
+                "title": "Notes from " + filename,
+                "filename": filename
+            }
+        except ExtractionFailed as e:
+            logger.error(f"Error processing image with OCR: {str(e)}")
+            temp_storage.discard(file_path)
+            return extraction_failed_response(e)
+        except Exception as e:
+            logger.error(f"Error processing image with OCR: {str(e)}")
+            # Try to clean up the file
+            temp_storage.discard(file_path)
+
+            return JSONResponse(
+                status_code=500,
+                content={"detail": f"Error processing image: {str(e)}"}
+            )
+
 # Handwriting recognition endpoint
 @app.post("/api/handwriting")
 async def process_handwriting(file: UploadFile = File(...)):
@@ -366,135 +773,99 @@ async def process_handwriting(file: UploadFile = File(...)):
     """
     logger.info(f"Processing handwriting from file: {file.filename}")
     
-    # Create a temporary directory if it doesn't exist
-    temp_dir = Path(__file__).parent / "temp"
-    temp_dir.mkdir(exist_ok=True)
-    
-    # Secure the filename to prevent path traversal attacks
-    timestamp = int(time.time())
-    safe_filename = secure_filename(file.filename)
-    file_path = temp_dir / f"{timestamp}_{safe_filename}"
+    # Unique temp path; the filename is secured to prevent path traversal attacks
+    temp_storage = get_temp_storage()
+    file_path = temp_storage.new_path(file.filename)
     
     try:
         # Save the uploaded file
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        logger.info(f"File saved to {file_path}")
-        
-        # Check if it's a PDF file
-        if file.filename.lower().endswith('.pdf'):
-            logger.info("Processing PDF file")
-            
-            # Extract text from PDF
-            text = ""
-            title = "Notes from " + file.filename
-            
-            try:
-                with open(file_path, "rb") as f:
-                    pdf = PdfReader(f)
-                    
-                    # Extract text from each page
-                    for page_num in range(len(pdf.pages)):
-                        page = pdf.pages[page_num]
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n\n"
-                    
-                    # If we have a title page, use it as the title
-                    if len(pdf.pages) > 0:
-                        first_page = pdf.pages[0].extract_text()
-                        if first_page:
-                            # Try to extract a title from the first few lines
-                            lines = first_page.split('\n')
-                            if lines and len(lines[0].strip()) > 0 and len(lines[0].strip()) < 100:
-                                title = lines[0].strip()
-                
-                logger.info(f"Successfully extracted {len(text)} characters from PDF")
-                
-                # Schedule file for deletion after 10 minutes
-                asyncio.create_task(delete_file_after_delay(file_path, delay=600))
-                
-                # Return in the same format as the upload-pdf endpoint for consistency
-                return {
-                    "text": text,
-                    "title": title,
-                    "pages": len(pdf.pages),
-                    "filename": file.filename
-                }
-                
-            except Exception as e:
-                logger.error(f"Error extracting text from PDF: {str(e)}")
-                # Try to clean up the file
-                try:
-                    if file_path.exists():
-                        file_path.unlink()
-                except:
-                    pass
-                    
-                return JSONResponse(
-                    status_code=500,
-                    content={"detail": f"Error extracting text from PDF: {str(e)}"}
-                )
-        else:
-            # For non-PDF files, use pytesseract for OCR
-            logger.info("Processing non-PDF file with OCR")
-            try:
-                # Load the image
-                image = Image.open(file_path)
-                
-                # Perform OCR
-                text = pytesseract.image_to_string(image)
-                
-                if not text or len(text.strip()) < 10:
-                    # Try to clean up the file
-                    try:
-                        if file_path.exists():
-                            file_path.unlink()
-                    except:
-                        pass
-                        
-                    return JSONResponse(
-                        status_code=400, 
-                        content={"detail": "Could not extract meaningful text from the image"}
-                    )
-                
-                # Schedule file for deletion after 10 minutes
-                asyncio.create_task(delete_file_after_delay(file_path, delay=600))
-                
-                return {
-                    "text": text,
-                    "title": "Notes from " + file.filename,
-                    "filename": file.filename
-                }
-            except Exception as e:
-                logger.error(f"Error processing image with OCR: {str(e)}")
-                # Try to clean up the file
-                try:
-                    if file_path.exists():
-                        file_path.unlink()
-                except:
-                    pass
-                    
-                return JSONResponse(
-                    status_code=500,
-                    content={"detail": f"Error processing image: {str(e)}"}
-                )
+        with stage("upload_spool"):
+            digest, _ = await spool_upload(file, file_path)
+        with temp_storage.in_use(file_path):
+            temp_storage.register(file_path)
+            logger.info(f"File saved to {file_path}")
+            return await extract_handwriting(file_path, file.filename, digest)
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}")
         # Try to clean up the file
-        try:
-            if file_path.exists():
-                file_path.unlink()
-        except:
-            pass
+        temp_storage.discard(file_path)
             
         return JSONResponse(
             status_code=500, 
             content={"detail": f"Error processing file: {str(e)}"}
         )
 
+# Helper function to turn an upload session error into an HTTP error carrying the resume offset
+def upload_session_http_error(error: UploadSessionError) -> HTTPException:
+    headers = {"Upload-Offset": str(error.offset)} if error.offset is not None else None
+    return HTTPException(status_code=error.status_code, detail=error.detail, headers=headers)
+
+# Resumable upload endpoints: create a session, PUT chunks at their offset, then complete
+@app.post("/api/uploads", status_code=201, response_model=Dict[str, Any])
+async def create_upload(session: UploadSessionCreate):
+    try:
+        return get_resumable_uploads().create(session.filename, session.size, session.kind, session.sha256)
+    except UploadSessionError as e:
+        raise upload_session_http_error(e)
+
+@app.get("/api/uploads/{upload_id}", response_model=Dict[str, Any])
+async def get_upload(upload_id: str):
+    try:
+        return get_resumable_uploads().status(upload_id)
+    except UploadSessionError as e:
+        raise upload_session_http_error(e)
+
+@app.put("/api/uploads/{upload_id}", response_model=Dict[str, Any])
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    """
+    Write the request body at offset; after a dropped connection, GET the session and resume from its offset.
+    """
+    try:
+        with stage("upload_spool"):
+            return await get_resumable_uploads().write(upload_id, offset, request.stream())
+    except UploadSessionError as e:
+        raise upload_session_http_error(e)
+    except ClientDisconnect:
+        logger.info(f"Client disconnected while uploading a chunk of {upload_id}")
+        raise HTTPException(status_code=400, detail="Client disconnected")
+
+@app.delete("/api/uploads/{upload_id}", response_model=Dict[str, str])
+async def abort_upload(upload_id: str):
+    try:
+        get_resumable_uploads().abort(upload_id)
+        return {"message": f"Upload {upload_id} aborted"}
+    except UploadSessionError as e:
+        raise upload_session_http_error(e)
+
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, body: UploadSessionComplete = Body(default_factory=UploadSessionComplete)):
+    """
+    Verify the size and checksum of a finished upload and extract its text like the single-request endpoints.
+    """
+    uploads = get_resumable_uploads()
+    temp_storage = get_temp_storage()
+    try:
+        session = uploads.status(upload_id)
+        file_path = temp_storage.new_path(session["filename"])
+        session, digest = await run_in_threadpool(uploads.finalize, upload_id, file_path, body.sha256)
+    except UploadSessionError as e:
+        raise upload_session_http_error(e)
+    logger.info(f"Completed upload {upload_id} ({session['size']} bytes) to {file_path}")
+    
+    try:
+        with temp_storage.in_use(file_path):
+            temp_storage.register(file_path)
+            if session["kind"] == "pdf":
+                return await extract_uploaded_pdf(file_path, session["filename"], digest)
+            return await extract_handwriting(file_path, session["filename"], digest)
+    except Exception as e:
+        logger.error(f"Error processing completed upload {upload_id}: {str(e)}")
+        temp_storage.discard(file_path)
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Error processing file: {str(e)}"}
+        )
+
 # Text-to-speech endpoint
 @app.post("/api/text-to-speech", response_model=Dict[str, str])
 async def text_to_speech(note: NoteContent):
@@ -504,47 +875,19 @@ async def text_to_speech(note: NoteContent):
         logger.error(f"Failed to convert text to speech: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to convert text to speech: {str(e)}")
 
-# Start the application
-if __name__ == "__main__":
-    import socket
-
-    def find_available_port(start_port=8000, max_attempts=10):
-        for port_attempt in range(start_port, start_port + max_attempts):
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.bind(('0.0.0.0', port_attempt))
-                    return port_attempt
-            except OSError:
-                logger.warning(f"Port {port_attempt} is already in use, trying next port...")
-                continue
-
-        logger.warning(f"No available ports found in range {start_port}-{start_port + max_attempts - 1}")
-        return start_port + max_attempts
-
-    preferred_port = 8000
-    port = find_available_port(preferred_port)
-
-    logger.info(f"Starting server on port {port}")
-    
-    import sys
-    if "--reload" in sys.argv:
-        # Development mode with auto-reload
-        import uvicorn
-        uvicorn.run("app:app", host="0.0.0.0", port=port, reload=True)
-    else:
-        # Production mode
-        import uvicorn
-        uvicorn.run(app, host="0.0.0.0", port=port)
-
 # Add this endpoint after your other API endpoints
 @app.post("/api/test-ai", response_model=Dict[str, str])
 async def test_ai_service(content: NoteContent):
     try:
         ai_service = get_ai_service()
-        summary = ai_service.summarize_text(content.content)
-        quiz_result = ai_service.generate_quiz(content.content)
+        # The three generators are independent; each falls back locally if the deadline runs out
+        doc = await run_in_threadpool(ai_service.parse_document, content.content)
+        summary, quiz_result, mindmap_result = await asyncio.gather(
+            run_in_threadpool(ai_service.summarize_text, content.content, doc),
+            run_in_threadpool(ai_service.generate_quiz, content.content, doc),
+            run_in_threadpool(ai_service.generate_mindmap, content.content, doc),
+        )
         quiz_json = json.dumps(quiz_result)
-        mindmap_result = ai_service.generate_mindmap(content.content)
         mindmap_json = json.dumps(mindmap_result)
         return {
             "status": "success",
@@ -561,11 +904,50 @@ async def debug_ai_service():
     try:
         ai_service = get_ai_service()
         result = ai_service.debug_api_connection()
+        result["upstream"] = get_upstream_guard().status()
         return result
     except Exception as e:
         logger.error(f"AI service debug failed: {str(e)}")
         return {"success": False, "error": str(e)}
 
+# Startup phase timings
+@app.get("/api/debug/startup", response_model=Dict[str, Any])
+async def debug_startup():
+    return startup.report()
+
+# Request class pools and queues of this worker
+@app.get("/api/debug/scheduler", response_model=Dict[str, Any])
+async def debug_scheduler():
+    return get_scheduler().stats()
+
+# Stored request profiles
+def require_profiling():
+    if not PROFILING_ENABLED and PROFILING_SAMPLE_RATE <= 0:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+
+@app.get("/api/debug/profiles", response_model=Dict[str, List[Dict[str, Any]]])
+async def debug_list_profiles():
+    require_profiling()
+    return {"profiles": list_profiles()}
+
+@app.get("/api/debug/profiles/{profile_id}", response_model=Dict[str, Any])
+async def debug_get_profile(profile_id: str):
+    require_profiling()
+    profile = load_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    profile.pop("flame", None)
+    return profile
+
+# Collapsed stacks for flamegraph.pl or speedscope
+@app.get("/api/debug/profiles/{profile_id}/flame", response_class=PlainTextResponse)
+async def debug_get_profile_flame(profile_id: str):
+    require_profiling()
+    profile = load_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return PlainTextResponse("\n".join(profile.get("flame", [])) + "\n")
+
 # Improved HuggingFace API client
 async def query_huggingface(
     payload: Dict[str, Any],
@@ -662,7 +1044,7 @@ async def generate_summary(note: NoteContent):
 
     try:
         ai_service = get_ai_service()
-        summary = ai_service.summarize_text(content)
+        summary = await run_in_threadpool(ai_service.summarize_text, content)
         return {"summary": summary}
     except Exception as e:
         logger.error(f"Failed to generate summary: {str(e)}")
@@ -677,7 +1059,7 @@ async def generate_quiz(note: NoteContent):
 
     try:
         ai_service = get_ai_service()
-        quiz = ai_service.generate_quiz(content)
+        quiz = await run_in_threadpool(ai_service.generate_quiz, content)
         return {"quiz": quiz}
     except Exception as e:
         logger.error(f"Failed to generate quiz: {str(e)}")
@@ -692,8 +1074,15 @@ async def generate_mindmap(note: NoteContent):
 
     try:
         ai_service = get_ai_service()
-        mindmap = ai_service.generate_mindmap(content)
+        mindmap = await run_in_threadpool(ai_service.generate_mindmap, content)
         return {"mindmap": mindmap}
     except Exception as e:
         logger.error(f"Failed to generate mind map: {str(e)}")
         return {"mindmap": {"central": "Error", "branches": []}}
+
+startup.mark("routes")
+
+# Start the application
+if __name__ == "__main__":
+    from serve import main
+    main(app=app)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the local (fallback) summary, quiz and mind map generators.
+
+Builds a long synthetic document, roughly the text of an N-page PDF, and times
+parsing it into a ParsedDocument and running each generator on the cached
+document. The generators run without an API key, so only local work is measured.
+
+Usage:
+    python benchmarks/bench_generators.py --pages 500 --runs 5
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+os.environ["HUGGINGFACE_API_KEY"] = ""
+
+from ai_service import AIService
+from benchmarks.corpus import paragraph
+from document import get_document_cache
+
+def make_document(pages: int, paragraphs_per_page: int = 8, seed: int = 42) -> str:
+    """Text of a document with the given number of pages"""
+    rng = random.Random(seed)
+    return "\n\n".join(paragraph(rng) for _ in range(pages * paragraphs_per_page))
+
+def time_calls(fn, runs: int):
+    """Call fn repeatedly and return the latencies in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def report(name: str, timings):
+    """Print latency statistics for a benchmark"""
+    print(f"{name:<28} mean {statistics.mean(timings):9.2f} ms  "
+          f"min {min(timings):9.2f} ms  max {max(timings):9.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local AI generators")
+    parser.add_argument("--pages", type=int, default=500, help="Pages of synthetic text")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per step")
+    args = parser.parse_args()
+
+    ai_service = AIService()
+    text = make_document(args.pages)
+    cache = get_document_cache()
+
+    def parse_cold():
+        cache.clear()
+        return ai_service.parse_document(text)
+
+    report("parse (cold cache)", time_calls(parse_cold, args.runs))
+    doc = ai_service.parse_document(text)
+    print(f"{args.pages} pages: {len(text) / 1024 / 1024:.2f} MB, {len(doc.sentences)} sentences, "
+          f"{len(doc.vocab)} distinct tokens")
+
+    report("parse (cached)", time_calls(lambda: ai_service.parse_document(text), args.runs))
+    report("summarize_text", time_calls(lambda: ai_service.summarize_text(text, doc), args.runs))
+    report("generate_quiz", time_calls(lambda: ai_service.generate_quiz(text, doc), args.runs))
+    report("generate_mindmap", time_calls(lambda: ai_service.generate_mindmap(text, doc), args.runs))
+
+if __name__ == "__main__":
+    main()
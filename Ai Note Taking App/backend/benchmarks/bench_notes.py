@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the GET /api/notes list endpoint.
+
+Seeds a temporary database with synthetic notes and measures the latency of
+the list endpoint, comparing it with the old jsonable_encoder + JSONResponse
+path.
+
+Usage:
+    python benchmarks/bench_notes.py --notes 10000 --runs 20
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import database
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+WORDS = ("note lecture data model network function memory process system theory "
+         "energy cell market history language design algorithm structure").split()
+
+def seed_notes(db_path: Path, count: int, content_words: int):
+    """Insert synthetic notes directly into the database"""
+    rng = random.Random(42)
+    conn = sqlite3.connect(str(db_path))
+    rows = []
+    for i in range(count):
+        content = " ".join(rng.choice(WORDS) for _ in range(content_words))
+        rows.append((f"Note {i}", content, content[:200], None, None))
+    conn.executemany(
+        "INSERT INTO notes (title, content, summary, quiz, mindmap) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+def time_calls(fn, runs: int):
+    """Call fn repeatedly and return the latencies in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def report(name: str, timings, size: int):
+    """Print latency statistics for a benchmark"""
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<28} mean {statistics.mean(timings):8.2f} ms  "
+          f"p50 {statistics.median(timings):8.2f} ms  p95 {p95:8.2f} ms  "
+          f"payload {size / 1024 / 1024:.2f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the notes list endpoint")
+    parser.add_argument("--notes", type=int, default=10000, help="Number of notes to seed")
+    parser.add_argument("--words", type=int, default=200, help="Words of content per note")
+    parser.add_argument("--runs", type=int, default=20, help="Number of timed requests")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = Path(tmp) / "bench_notes.db"
+        database.init_db()
+        seed_notes(database.DB_PATH, args.notes, args.words)
+
+        from app import app
+
+        print(f"Seeded {args.notes} notes with {args.words} words each")
+
+        # Old path: list of dicts through jsonable_encoder and the stdlib encoder
+        def legacy_path():
+            conn = sqlite3.connect(str(database.DB_PATH))
+            conn.row_factory = sqlite3.Row
+            notes = [dict(row) for row in conn.execute("SELECT * FROM notes ORDER BY updated_at DESC")]
+            conn.close()
+            return JSONResponse(content=jsonable_encoder({"notes": notes})).body
+
+        legacy_size = len(legacy_path())
+        report("legacy serialization", time_calls(legacy_path, args.runs), legacy_size)
+
+        fast_size = len(database.get_all_notes_json())
+        report("direct row serialization", time_calls(database.get_all_notes_json, args.runs), fast_size)
+
+        with TestClient(app) as client:
+            response = client.get("/api/notes")
+            assert response.status_code == 200, response.text
+            report("GET /api/notes", time_calls(lambda: client.get("/api/notes"), args.runs),
+                   len(response.content))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the OCR engines.
+
+Renders text images and reports images per second for each available backend:
+the tesseract CLI through pytesseract (one process per image) and the pooled
+in-process tesserocr engine, both sequentially and from several threads.
+
+Usage:
+    python benchmarks/bench_ocr.py --images 50 --threads 4
+"""
+
+import argparse
+import io
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import ocr_engine
+from benchmarks.corpus import make_image
+
+def load_images(count: int):
+    from PIL import Image
+    images = []
+    for seed in range(count):
+        image = Image.open(io.BytesIO(make_image(seed=seed)))
+        image.load()
+        images.append(image)
+    return images
+
+def images_per_second(engine: ocr_engine.OCREngine, images, threads: int) -> float:
+    start = time.perf_counter()
+    if threads <= 1:
+        for image in images:
+            engine.recognize(image)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(engine.recognize, images))
+    return len(images) / (time.perf_counter() - start)
+
+def available_engines():
+    engines = []
+    if shutil.which("tesseract"):
+        engines.append(ocr_engine.SubprocessEngine())
+    else:
+        print("tesseract binary not found, skipping the subprocess engine")
+    try:
+        import tesserocr
+        engines.append(ocr_engine.TesserocrEngine(tesserocr))
+    except ImportError:
+        print("tesserocr is not installed, skipping the in-process engine")
+    return engines
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR engines")
+    parser.add_argument("--images", type=int, default=50, help="Images per run")
+    parser.add_argument("--threads", type=int, default=4, help="Threads for the concurrent run")
+    args = parser.parse_args()
+
+    engines = available_engines()
+    if not engines:
+        print("No OCR engine available")
+        return 1
+
+    images = load_images(args.images)
+    print(f"{'engine':<12} {'threads':>7} {'images/s':>10}")
+    for engine in engines:
+        # One untimed call so lazy imports and the first model load are not measured
+        engine.recognize(images[0])
+        for threads in sorted({1, args.threads}):
+            print(f"{engine.name:<12} {threads:>7} {images_per_second(engine, images, threads):>10.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
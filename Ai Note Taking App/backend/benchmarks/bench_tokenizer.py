@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark for sentence and word tokenization.
+
+Extracts the text of a generated multi-page PDF and reports throughput in
+characters per second for each available sentence splitter (regex, blingfire,
+NLTK punkt) and for word tokenization, next to the old split('.') / str.split
+approach.
+
+Usage:
+    python benchmarks/bench_tokenizer.py --pages 200 --runs 5
+"""
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import tokenizer
+from benchmarks.corpus import make_pdf
+
+def extract_pdf_text(pages: int) -> str:
+    """Text layer of a generated PDF, as the upload endpoint would see it"""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(make_pdf(pages=pages)))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+def throughput(fn, text: str, runs: int):
+    """Best-of-runs characters per second, plus the size of the result"""
+    best = float("inf")
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - start)
+    return len(text) / best, len(result)
+
+def report(name: str, chars_per_second: float, items: int, unit: str):
+    print(f"{name:<28} {chars_per_second / 1e6:8.2f} M chars/s  {items:>9} {unit}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentence and word tokenization")
+    parser.add_argument("--pages", type=int, default=200, help="Pages in the generated PDF")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per tokenizer (best is reported)")
+    args = parser.parse_args()
+
+    text = extract_pdf_text(args.pages)
+    print(f"Extracted {len(text) / 1024 / 1024:.2f} MB of text from {args.pages} pages")
+
+    splitters = {
+        "split('.') (old fallback)": lambda t: [s.strip() for s in t.split('.') if s.strip()],
+        "regex": tokenizer.regex_sentences,
+    }
+    blingfire = tokenizer._load_blingfire()
+    if blingfire is not None:
+        splitters["blingfire"] = blingfire
+    punkt = tokenizer._load_punkt()
+    if punkt is not None:
+        splitters["nltk punkt"] = punkt
+
+    for name, split in splitters.items():
+        report(f"sentences: {name}", *throughput(split, text, args.runs), "sentences")
+
+    report("words: lower().split() (old)", *throughput(lambda t: t.lower().split(), text, args.runs), "tokens")
+    report("words: regex + intern", *throughput(tokenizer.words, text, args.runs), "tokens")
+
+if __name__ == "__main__":
+    main()
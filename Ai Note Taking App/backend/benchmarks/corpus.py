@@ -0,0 +1,91 @@
+"""
+Synthetic corpora for the benchmark suite.
+
+Everything is generated from a seeded random source so runs are comparable:
+note bodies, multi-page PDFs with a real text layer, and rendered text images
+for the OCR path.
+"""
+
+import io
+import random
+from typing import Dict, List
+
+WORDS = ("note lecture data model network function memory process system theory energy "
+         "cell market history language design algorithm structure protein photosynthesis "
+         "equation gradient neuron economy climate molecule database index cache query").split()
+
+def sentence(rng: random.Random, min_words: int = 6, max_words: int = 18) -> str:
+    """Generate one sentence of filler text"""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+def paragraph(rng: random.Random, sentences: int = 5) -> str:
+    """Generate a paragraph of filler text"""
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+def make_notes(count: int, words: int = 200, seed: int = 42) -> List[Dict[str, str]]:
+    """Generate note payloads for POST /api/notes"""
+    rng = random.Random(seed)
+    notes = []
+    for i in range(count):
+        text = []
+        while sum(len(s.split()) for s in text) < words:
+            text.append(sentence(rng))
+        notes.append({"title": f"Benchmark note {i}", "content": " ".join(text)})
+    return notes
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(pages: int = 10, lines_per_page: int = 40, seed: int = 42) -> bytes:
+    """Build a PDF with a real text layer on every page"""
+    rng = random.Random(seed)
+    objects: List[bytes] = []
+
+    # 1: catalog, 2: page tree, 3: font, then a page and content stream per page
+    page_ids = [4 + i * 2 for i in range(pages)]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for pid in page_ids:
+        lines = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for _ in range(lines_per_page):
+            lines.append(f"({_pdf_escape(sentence(rng))}) Tj T*")
+        lines.append("ET")
+        stream = "\n".join(lines).encode("latin-1")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {pid + 1} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+def make_image(lines: int = 8, seed: int = 42, image_format: str = "PNG") -> bytes:
+    """Render lines of text into an image for the OCR path"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    text_lines = [sentence(rng, 4, 8) for _ in range(lines)]
+    image = Image.new("L", (900, 40 + lines * 36), color=255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(text_lines):
+        draw.text((20, 20 + i * 36), line, fill=0)
+    # The default bitmap font is tiny; upscale so Tesseract can read it
+    image = image.resize((image.width * 2, image.height * 2))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Redis server.
+
+Speaks enough of the Redis protocol for the cache's redis backend (PING, AUTH,
+SELECT, GET, SET with EX/PX/NX/XX, DEL, EXISTS, DBSIZE, FLUSHDB, and EVAL of the
+backend's compare-and-delete script), keeping keys in memory, so the shared cache can be tried across several workers or nodes without
+installing Redis.
+
+Usage:
+    python benchmarks/fake_redis.py --port 6379
+    CACHE_BACKEND=redis CACHE_URL=redis://localhost:6379/0 python serve.py
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# The only script the cache sends: delete KEYS[1] if it still holds ARGV[1]
+_DELETE_IF_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) else return 0 end"
+)
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Like Redis's tcp-backlog; the default of 5 drops connects when many threads open theirs at once
+    request_queue_size = 511
+
+    def __init__(self, address, password: Optional[str] = None):
+        super().__init__(address, FakeRedisHandler)
+        self.password = password
+        # Per database: key -> (value, expires_at or None)
+        self.databases: Dict[int, Dict[bytes, Tuple[bytes, Optional[float]]]] = {}
+        self.lock = threading.Lock()
+
+    def _db(self, index: int) -> Dict[bytes, Tuple[bytes, Optional[float]]]:
+        return self.databases.setdefault(index, {})
+
+    def _live(self, db: Dict[bytes, Tuple[bytes, Optional[float]]], key: bytes) -> Optional[bytes]:
+        entry = db.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < time.time():
+            del db[key]
+            return None
+        return entry[0]
+
+    def execute(self, db_index: int, name: str, args: List[bytes]):
+        """Run one command; returns the reply, or an Exception for an error reply"""
+        with self.lock:
+            db = self._db(db_index)
+            if name == "GET":
+                return self._live(db, args[0])
+            if name == "SET":
+                key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+                expires_at = None
+                if b"EX" in options:
+                    expires_at = time.time() + int(args[2 + options.index(b"EX") + 1])
+                if b"PX" in options:
+                    expires_at = time.time() + int(args[2 + options.index(b"PX") + 1]) / 1000
+                exists = self._live(db, key) is not None
+                if (b"NX" in options and exists) or (b"XX" in options and not exists):
+                    return None
+                db[key] = (value, expires_at)
+                return "OK"
+            if name == "DEL":
+                return sum(1 for key in args if db.pop(key, None) is not None)
+            if name == "EXISTS":
+                return sum(1 for key in args if self._live(db, key) is not None)
+            if name == "DBSIZE":
+                return sum(1 for key in list(db) if self._live(db, key) is not None)
+            if name == "FLUSHDB":
+                db.clear()
+                return "OK"
+            if name == "EVAL":
+                if args[0].decode() != _DELETE_IF_SCRIPT or args[1] != b"1":
+                    return Exception("ERR only the cache's compare-and-delete script is supported")
+                if self._live(db, args[2]) != args[3]:
+                    return 0
+                del db[args[2]]
+                return 1
+        return Exception(f"ERR unknown command '{name}'")
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        db_index = 0
+        authenticated = self.server.password is None
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            name, args = command[0].decode().upper(), command[1:]
+            if name == "PING":
+                reply = "PONG"
+            elif name == "AUTH":
+                authenticated = args[-1].decode() == self.server.password
+                reply = "OK" if authenticated else Exception("WRONGPASS invalid password")
+            elif not authenticated:
+                reply = Exception("NOAUTH Authentication required.")
+            elif name == "SELECT":
+                db_index = int(args[0])
+                reply = "OK"
+            else:
+                reply = self.server.execute(db_index, name, args)
+            self.wfile.write(_encode(reply))
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, as typed into telnet
+            return line.split()
+        parts = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return parts
+
+def _encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return f"-{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+def start_fake_redis(port: int = 0, password: Optional[str] = None, host: str = "127.0.0.1") -> FakeRedisServer:
+    """Start the fake server in a daemon thread and return it"""
+    server = FakeRedisServer((host, port), password)
+    thread = threading.Thread(target=server.serve_forever, name="fake-redis", daemon=True)
+    thread.start()
+    return server
+
+def fake_redis_url(server: FakeRedisServer, db: int = 0) -> str:
+    """URL to use for CACHE_URL"""
+    host, port = server.server_address[:2]
+    auth = f":{server.password}@" if server.password else ""
+    return f"redis://{auth}{host}:{port}/{db}"
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Run a local in-memory server speaking the Redis protocol")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--password", default=None, help="Require AUTH with this password")
+    args = parser.parse_args(argv)
+
+    server = start_fake_redis(args.port, args.password)
+    print(f"Fake Redis listening on {fake_redis_url(server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
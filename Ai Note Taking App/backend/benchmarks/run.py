@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Benchmark and load-test suite for the API.
+
+Starts the app in a uvicorn subprocess against a temporary database and a
+local stub inference server, generates a synthetic corpus, then measures
+throughput and p50/p95/p99 latency for each scenario. Results are written to
+JSON so runs can be compared for regressions.
+
+Usage:
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --scenarios list,summarize --requests 500 --concurrency 16
+    python benchmarks/run.py --output new.json --compare old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from benchmarks.corpus import make_image, make_notes, make_pdf
+from benchmarks.stub_inference import start_stub_server, stub_base_url
+
+def free_port() -> int:
+    """Ask the OS for an unused TCP port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+class AppServer:
+    """Runs the API in a uvicorn subprocess with its database, cache and upload directories in a temp dir"""
+
+    def __init__(self, inference_url: str, workers: int = 1):
+        self.tmp = tempfile.TemporaryDirectory(prefix="scribe-bench-")
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            **os.environ,
+            "DATABASE_PATH": str(Path(self.tmp.name) / "bench.db"),
+            "HUGGINGFACE_API_KEY": "benchmark",
+            "HUGGINGFACE_API_URL": inference_url,
+            "METRICS_MULTIPROC_DIR": str(Path(self.tmp.name) / "metrics"),
+            "CACHE_PATH": str(Path(self.tmp.name) / "cache.db"),
+            "UPLOAD_STORE_DIR": str(Path(self.tmp.name) / "upload_store"),
+            "TEMP_DIR": str(Path(self.tmp.name) / "temp"),
+            "UPLOAD_SESSIONS_DIR": str(Path(self.tmp.name) / "upload_sessions"),
+            # Measure the inference path itself, not the provider quota
+            "INFERENCE_RATE_LIMIT": "0",
+            "INFERENCE_MAX_CONCURRENCY": "64",
+            # Measure extraction, not the upload admission limit
+            "UPLOAD_CONCURRENCY": "64",
+            "AI_MAX_QUEUE": "1024",
+            "INGESTION_MAX_QUEUE": "1024",
+        }
+        self.workers = workers
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        cmd = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+               "--port", str(self.port), "--log-level", "warning", "--workers", str(self.workers)]
+        self.log = open(Path(self.tmp.name) / "server.log", "wb")
+        self.process = subprocess.Popen(cmd, cwd=str(backend_dir), env=self.env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited early, see {self.log.name}")
+            try:
+                if httpx.get(f"{self.url}/api/status", timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("Server did not become ready within 60 seconds")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+        self.tmp.cleanup()
+
+class Runner:
+    """Drives one scenario with a fixed number of requests and concurrency"""
+
+    def __init__(self, base_url: str, concurrency: int):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self._local = threading.local()
+
+    def client(self) -> httpx.Client:
+        if not hasattr(self._local, "client"):
+            self._local.client = httpx.Client(base_url=self.base_url, timeout=300)
+        return self._local.client
+
+    def run(self, name: str, requests: int, call: Callable[[httpx.Client, int], httpx.Response]) -> Dict[str, Any]:
+        latencies: List[float] = []
+        errors = 0
+        lock = threading.Lock()
+
+        def one(i: int):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                response = call(self.client(), i)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed * 1000)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(one, range(requests)))
+        duration = time.perf_counter() - started
+
+        latencies.sort()
+        result = {
+            "requests": requests,
+            "concurrency": self.concurrency,
+            "errors": errors,
+            "duration_s": round(duration, 4),
+            "throughput_rps": round(requests / duration, 2) if duration else 0.0,
+            "mean_ms": round(statistics.mean(latencies), 3) if latencies else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+        }
+        print(f"{name:<12} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:9.2f} ms  "
+              f"p95 {result['p95_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  errors {errors}")
+        return result
+
+def build_scenarios(args, runner: Runner) -> Dict[str, Callable[[], Dict[str, Any]]]:
+    """Map scenario names to callables; order matters because later ones reuse created notes"""
+    notes = make_notes(args.requests, words=args.note_words)
+    note_ids: List[int] = []
+    ids_lock = threading.Lock()
+    rng = random.Random(7)
+    pdf = make_pdf(pages=args.pdf_pages)
+    image = make_image()
+
+    def upload_bytes(payload: bytes, i: int) -> bytes:
+        # Identical bytes are answered from the extraction cache after the first upload; trailing
+        # bytes after %%EOF or the PNG IEND chunk are ignored by the readers but change the hash
+        if args.reuse_uploads:
+            return payload
+        return payload + b"\n%% bench upload %d\n" % i
+
+    def create(client, i):
+        response = client.post("/api/notes", json=notes[i % len(notes)])
+        if response.status_code == 200:
+            with ids_lock:
+                note_ids.append(response.json()["id"])
+        return response
+
+    def random_note_id() -> Optional[int]:
+        # Runs without "create" first (e.g. --scenarios read) have no notes to pick from
+        with ids_lock:
+            return rng.choice(note_ids) if note_ids else None
+
+    def read(client, i):
+        note_id = random_note_id()
+        if note_id is None:
+            return httpx.Response(404)
+        return client.get(f"/api/notes/{note_id}")
+
+    def update(client, i):
+        note_id = random_note_id()
+        if note_id is None:
+            return httpx.Response(404)
+        return client.put(f"/api/notes/{note_id}", json={"content": notes[i % len(notes)]["content"] + " edited"})
+
+    def listing(client, i):
+        return client.get("/api/notes")
+
+    def changes(client, i):
+        return client.get("/api/notes/changes", params={"since": max(0, len(note_ids) - 10)})
+
+    def upload_pdf(client, i):
+        return client.post("/api/upload-pdf", files={"file": (f"bench_{i}.pdf", upload_bytes(pdf, i), "application/pdf")})
+
+    def ocr(client, i):
+        return client.post("/api/handwriting", files={"file": (f"bench_{i}.png", upload_bytes(image, i), "image/png")})
+
+    def summarize(client, i):
+        return client.post("/api/summarize", json={"content": notes[i % len(notes)]["content"]})
+
+    def delete(client, i):
+        with ids_lock:
+            if not note_ids:
+                return httpx.Response(404)
+            note_id = note_ids.pop()
+        return client.delete(f"/api/notes/{note_id}")
+
+    heavy = max(1, args.requests // 10)
+    return {
+        "create": lambda: runner.run("create", args.requests, create),
+        "read": lambda: runner.run("read", args.requests, read),
+        "update": lambda: runner.run("update", args.requests, update),
+        "list": lambda: runner.run("list", max(1, args.requests // 5), listing),
+        "changes": lambda: runner.run("changes", args.requests, changes),
+        "upload_pdf": lambda: runner.run("upload_pdf", heavy, upload_pdf),
+        "ocr": lambda: runner.run("ocr", heavy, ocr),
+        "summarize": lambda: runner.run("summarize", heavy, summarize),
+        "delete": lambda: runner.run("delete", args.requests, delete),
+    }
+
+def compare(current: Dict[str, Any], baseline_path: str, threshold: float) -> bool:
+    """Print the change against a previous run; returns True when a scenario regressed"""
+    baseline = json.loads(Path(baseline_path).read_text())["results"]
+    regressed = False
+    print(f"\nComparison against {baseline_path} (threshold {threshold:.0%})")
+    for name, result in current["results"].items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        p95_change = (result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+        rps_change = (result["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] if old["throughput_rps"] else 0.0
+        flag = ""
+        if p95_change > threshold or rps_change < -threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{name:<12} p95 {p95_change:+7.1%}  throughput {rps_change:+7.1%}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the note taking API")
+    parser.add_argument("--scenarios", default="create,read,update,list,changes,upload_pdf,ocr,summarize,delete",
+                        help="Comma-separated scenarios to run, in order")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per CRUD scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads")
+    parser.add_argument("--workers", type=int, default=1, help="Uvicorn worker processes")
+    parser.add_argument("--note-words", type=int, default=300, help="Words per synthetic note")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="Pages per synthetic PDF")
+    parser.add_argument("--reuse-uploads", action="store_true",
+                        help="Upload identical files so upload_pdf and ocr measure the extraction cache")
+    parser.add_argument("--inference-latency", type=float, default=0.05, help="Stub inference delay in seconds")
+    parser.add_argument("--output", default="", help="Write results to this JSON file")
+    parser.add_argument("--compare", default="", help="Previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change that counts as a regression")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    if "ocr" in selected and not shutil.which("tesseract"):
+        print("tesseract binary not found, skipping the ocr scenario")
+        selected.remove("ocr")
+
+    stub = start_stub_server(latency=args.inference_latency)
+    results: Dict[str, Any] = {}
+    try:
+        with AppServer(stub_base_url(stub), workers=args.workers) as server:
+            runner = Runner(server.url, args.concurrency)
+            scenarios = build_scenarios(args, runner)
+            unknown = [name for name in selected if name not in scenarios]
+            if unknown:
+                parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+            for name in selected:
+                results[name] = scenarios[name]()
+    finally:
+        stub.shutdown()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.output}")
+
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Hugging Face inference API.
+
+Answers POST /models/<model> with canned generations in the same format as the
+real API, after an optional artificial delay, so benchmarks never touch the
+network. Quiz and mind map prompts get valid JSON back.
+
+Usage:
+    python benchmarks/stub_inference.py --port 8765 --latency 0.2
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+QUIZ = {
+    "mcq": [{"question": "What is the main topic?", "options": ["A", "B", "C", "D"], "answer": "A"}],
+    "true_false": [{"question": "The text is synthetic.", "answer": True}],
+    "fill_blank": [{"question": "Benchmarks measure ______.", "answer": "latency"}]
+}
+
+MINDMAP = {
+    "central": "Benchmark",
+    "branches": [{"topic": "Latency", "subtopics": ["p50", "p95", "p99"]}]
+}
+
+SUMMARY = "This synthetic document describes a benchmark corpus used to measure the latency of the note taking API."
+
+def generate(prompt: str) -> str:
+    """Return a canned generation that matches the kind of prompt"""
+    if "Create a quiz" in prompt:
+        return json.dumps(QUIZ)
+    if "Create a mind map" in prompt:
+        return json.dumps(MINDMAP)
+    return SUMMARY
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    status = 200
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.status != 200:
+            body = json.dumps({"error": "stubbed failure"}).encode()
+        else:
+            body = json.dumps([{"generated_text": generate(payload.get("inputs", ""))}]).encode()
+
+        self.send_response(self.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+def start_stub_server(port: int = 0, latency: float = 0.0, status: int = 200,
+                      host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Start the stub server in a daemon thread and return it"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"latency": latency, "status": status})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="stub-inference", daemon=True)
+    thread.start()
+    return server
+
+def stub_base_url(server: ThreadingHTTPServer) -> str:
+    """Base URL to use for HUGGINGFACE_API_URL"""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/models/"
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Run a local stub of the inference API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--status", type=int, default=200, help="HTTP status to answer with")
+    args = parser.parse_args(argv)
+
+    server = start_stub_server(args.port, args.latency, args.status)
+    print(f"Stub inference API listening on {stub_base_url(server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import deadline
+from metrics import record_cache
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Where cached values live: "memory" (per process), "sqlite" (shared by the workers of one host)
+# or "redis" (shared by every node; any server speaking the Redis protocol)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite").lower()
+
+# Cache database shared by every worker process on this host
+CACHE_PATH = Path(__file__).parent / os.getenv("CACHE_PATH", "cache.db")
+
+# Server for the redis backend: redis://[[user]:password@]host[:port][/db]
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+
+# Seconds to wait for the redis server before treating a lookup as a miss, and how long
+# an unreachable server is skipped before connecting again
+CACHE_TIMEOUT = float(os.getenv("CACHE_TIMEOUT", "0.5"))
+CACHE_RETRY_INTERVAL = float(os.getenv("CACHE_RETRY_INTERVAL", "5"))
+
+# Entries kept by the memory backend before the least recently used are dropped
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "10000"))
+
+# Prepended to every key, so several deployments can share one server
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "scribe")
+
+# Default lifetime of cached entries in seconds
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(24 * 3600)))
+
+# How long one caller may hold the right to compute a missing value, and how long the
+# others wait for its result before computing it themselves
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", "60"))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "30"))
+
+class CacheBackend:
+    """Byte values with expiry; failures are logged and read as misses so the cache never breaks a request"""
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached value, or None if missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        """Store a value for ttl seconds"""
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Store a value only if the key is missing or expired; True if it was stored"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """Remove a value"""
+        raise NotImplementedError
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        """Remove a value only if it is still the given one, e.g. a lock that may have expired and been
+        taken by someone else; True if it was removed"""
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Delete expired entries and return how many were removed"""
+        return 0
+
+class MemoryCache(CacheBackend):
+    """Cache in this process only, least recently used entries dropped past max_entries"""
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _store(self, key: str, value: bytes, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._store(key, value, time.time() + ttl)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._store(key, value, now + ttl)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        with self._lock:
+            if self._live(key, time.time()) != value:
+                return False
+            del self._entries[key]
+            return True
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._entries.items() if expires_at < now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+class SQLiteCache(CacheBackend):
+    """Key/value cache with expiry stored in SQLite, shared across worker processes"""
+
+    def __init__(self, path: Path = CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections are per thread and per process; a forked worker opens its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            ''')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < time.time():
+                return None
+            return row[0]
+        except Exception as e:
+            logger.error(f"Cache read failed for {key}: {str(e)}")
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+        except Exception as e:
+            logger.error(f"Cache write failed for {key}: {str(e)}")
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        now = time.time()
+        try:
+            # Only an expired row is overwritten; a live one leaves the row count at 0
+            cursor = self._connection().execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE cache.expires_at < ?",
+                (key, value, now + ttl, now)
+            )
+            return cursor.rowcount == 1
+        except Exception as e:
+            logger.error(f"Cache write failed for {key}: {str(e)}")
+            return True
+
+    def delete(self, key: str):
+        try:
+            self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except Exception as e:
+            logger.error(f"Cache delete failed for {key}: {str(e)}")
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        try:
+            cursor = self._connection().execute(
+                "DELETE FROM cache WHERE key = ? AND value = ? AND expires_at >= ?", (key, value, time.time())
+            )
+            return cursor.rowcount == 1
+        except Exception as e:
+            logger.error(f"Cache delete failed for {key}: {str(e)}")
+            return False
+
+    def purge_expired(self) -> int:
+        try:
+            cursor = self._connection().execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Cache purge failed: {str(e)}")
+            return 0
+
+# Deletes KEYS[1] only while it holds ARGV[1], in one step on the server
+_DELETE_IF_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) else return 0 end"
+)
+
+class RedisError(Exception):
+    """Error reply from the server"""
+
+class _RESPConnection:
+    """One connection speaking the Redis serialization protocol (RESP2)"""
+
+    def __init__(self, host: str, port: int, db: int, username: Optional[str], password: Optional[str],
+                 timeout: float):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if password is not None:
+            self.command("AUTH", *([username] if username else []), password)
+        if db:
+            self.command("SELECT", str(db))
+
+    def command(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode())
+            parts.append(data)
+            parts.append(b"\r\n")
+        self._sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the cache server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode()
+        if prefix == b"-":
+            raise RedisError(rest.decode())
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the cache server")
+            return data[:-2]
+        if prefix == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the cache server: {line[:32]!r}")
+
+    def close(self):
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+class RedisCache(CacheBackend):
+    """Cache on a Redis-protocol server shared by every node, without a client library dependency"""
+
+    def __init__(self, url: str = CACHE_URL, timeout: float = CACHE_TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme != "redis":
+            raise ValueError(f"Unsupported cache URL scheme: {parts.scheme}")
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password is not None else None
+        self.timeout = timeout
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def _command(self, *args):
+        # Connections are per thread and per process, like the SQLite ones
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            if time.monotonic() < self._down_until:
+                raise ConnectionError("cache server unreachable, retrying later")
+            try:
+                conn = _RESPConnection(self.host, self.port, self.db, self.username, self.password, self.timeout)
+            except OSError:
+                self._down_until = time.monotonic() + CACHE_RETRY_INTERVAL
+                raise
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        try:
+            return conn.command(*args)
+        except (OSError, ConnectionError):
+            # The connection may be half-read; start over on the next call
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._command("GET", key)
+        except Exception as e:
+            logger.error(f"Cache read failed for {key}: {str(e)}")
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        try:
+            self._command("SET", key, value, "PX", max(1, int(ttl * 1000)))
+        except Exception as e:
+            logger.error(f"Cache write failed for {key}: {str(e)}")
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        try:
+            return self._command("SET", key, value, "PX", max(1, int(ttl * 1000)), "NX") is not None
+        except Exception as e:
+            logger.error(f"Cache write failed for {key}: {str(e)}")
+            # Without the server nobody can coordinate; let the caller compute
+            return True
+
+    def delete(self, key: str):
+        try:
+            self._command("DEL", key)
+        except Exception as e:
+            logger.error(f"Cache delete failed for {key}: {str(e)}")
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        try:
+            return self._command("EVAL", _DELETE_IF_SCRIPT, 1, key, value) == 1
+        except Exception as e:
+            logger.error(f"Cache delete failed for {key}: {str(e)}")
+            return False
+
+class Namespace:
+    """Keys of one cache user under their own prefix, with a default TTL and stampede protection"""
+
+    def __init__(self, backend: CacheBackend, name: str, ttl: float = CACHE_TTL):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self._prefix = f"{CACHE_KEY_PREFIX}:{name}:"
+        self._flights: Dict[str, List] = {}
+        self._flights_lock = threading.Lock()
+
+    def key(self, key: str) -> str:
+        return self._prefix + key
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.backend.get(self.key(key))
+        record_cache(self.name, value is not None)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self.backend.set(self.key(key), value, ttl if ttl is not None else self.ttl)
+
+    def delete(self, key: str):
+        self.backend.delete(self.key(key))
+
+    @contextmanager
+    def _single_flight(self, key: str):
+        # Threads of this process missing on the same key queue behind one lock, for at most
+        # CACHE_LOCK_WAIT or the request's deadline; yields whether the lock was taken
+        with self._flights_lock:
+            flight = self._flights.setdefault(key, [threading.Lock(), 0])
+            flight[1] += 1
+        try:
+            acquired = flight[0].acquire(timeout=deadline.cap(CACHE_LOCK_WAIT))
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    flight[0].release()
+        finally:
+            with self._flights_lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    del self._flights[key]
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[bytes]],
+                       ttl: Optional[float] = None) -> Optional[bytes]:
+        """Cached value of key, or compute() stored for ttl; concurrent misses on any node compute it once.
+        None from compute() is returned but not cached."""
+        full_key = self.key(key)
+        value = self.backend.get(full_key)
+        if value is None:
+            with self._single_flight(full_key) as acquired:
+                if not acquired:
+                    logger.info(f"Computing {full_key} without waiting any longer for another thread")
+                    record_cache(self.name, False)
+                    return compute()
+                value = self.backend.get(full_key)
+                if value is None:
+                    record_cache(self.name, False)
+                    return self._compute_once(full_key, compute, ttl if ttl is not None else self.ttl)
+        record_cache(self.name, True)
+        return value
+
+    def _compute_once(self, full_key: str, compute: Callable[[], Optional[bytes]], ttl: float) -> Optional[bytes]:
+        lock_key = full_key + ":lock"
+        token = uuid.uuid4().hex.encode()
+        if self.backend.add(lock_key, token, CACHE_LOCK_TTL):
+            try:
+                value = compute()
+                if value is not None:
+                    self.backend.set(full_key, value, ttl)
+                return value
+            finally:
+                # A compute slower than CACHE_LOCK_TTL lost the lock; leave the next holder's alone
+                self.backend.delete_if(lock_key, token)
+
+        # Another worker or node is computing it: poll for its result
+        give_up = time.monotonic() + deadline.cap(CACHE_LOCK_WAIT)
+        delay = 0.05
+        while time.monotonic() < give_up:
+            time.sleep(min(delay, max(0.0, give_up - time.monotonic())))
+            value = self.backend.get(full_key)
+            if value is not None:
+                return value
+            if self.backend.get(lock_key) is None:
+                # The holder finished without a cacheable result, or died
+                break
+            delay = min(delay * 2, 0.5)
+        logger.info(f"Computing {full_key} without waiting any longer for another worker")
+        return compute()
+
+def create_backend(kind: str = CACHE_BACKEND) -> CacheBackend:
+    if kind == "memory":
+        return MemoryCache()
+    if kind == "sqlite":
+        return SQLiteCache()
+    if kind == "redis":
+        return RedisCache()
+    raise ValueError(f"Unknown cache backend: {kind}")
+
+# Create a singleton instance
+_backend = None
+_namespaces: Dict[str, Namespace] = {}
+_lock = threading.Lock()
+
+def get_backend() -> CacheBackend:
+    """Get the cache backend singleton instance"""
+    global _backend
+    with _lock:
+        if _backend is None:
+            try:
+                _backend = create_backend()
+            except ValueError as e:
+                logger.error(f"Invalid cache configuration, using SQLite: {str(e)}")
+                _backend = SQLiteCache()
+            logger.info(f"Using the {type(_backend).__name__} cache backend")
+    return _backend
+
+def get_cache(namespace: str, ttl: float = CACHE_TTL) -> Namespace:
+    """Get the shared cache for one namespace; the TTL of its first caller is the default"""
+    backend = get_backend()
+    with _lock:
+        if namespace not in _namespaces:
+            _namespaces[namespace] = Namespace(backend, namespace, ttl)
+        return _namespaces[namespace]
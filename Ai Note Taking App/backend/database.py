@@ -1,13 +1,17 @@
 import sqlite3
 import os
 import logging
+import threading
 from pathlib import Path
+from serialization import dumps
+from metrics import DB_QUERY_SECONDS, timed
+from note_cache import NOTE_CACHE_MAX_CHANGES, NoteCache, get_note_cache
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Database file path - use absolute path to match models.py
-DB_PATH = Path(__file__).parent / "notes.db"
+# Database file path - relative paths are resolved against the backend directory
+DB_PATH = Path(__file__).parent / os.getenv("DATABASE_PATH", "notes.db")
 
 def init_db():
     """Initialize the database with required tables"""
@@ -28,6 +32,10 @@ def init_db():
             else:
                 logger.warning("Notes table not found in existing database, creating it")
                 create_notes_table(cursor)
+            
+            # Older databases predate change tracking
+            create_sync_tables(cursor)
+            add_version_column(cursor)
                 
             conn.commit()
             conn.close()
@@ -36,6 +44,8 @@ def init_db():
             conn = sqlite3.connect(str(DB_PATH))
             cursor = conn.cursor()
             create_notes_table(cursor)
+            create_sync_tables(cursor)
+            add_version_column(cursor)
             conn.commit()
             conn.close()
             logger.info("Database created successfully")
@@ -55,10 +65,126 @@ def create_notes_table(cursor):
         quiz TEXT,
         mindmap TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        change_seq INTEGER NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 1
+    )
+    ''')
+
+def add_version_column(cursor):
+    """Older databases predate note versions, used to check patches against their base"""
+    cursor.execute("PRAGMA table_info(notes)")
+    if "version" not in [row[1] for row in cursor.fetchall()]:
+        logger.info("Adding version column to notes table")
+        cursor.execute("ALTER TABLE notes ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+def create_sync_tables(cursor):
+    """Create the change tracking tables used for delta sync"""
+    cursor.execute("PRAGMA table_info(notes)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if "change_seq" not in columns:
+        logger.info("Adding change_seq column to notes table")
+        cursor.execute("ALTER TABLE notes ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notes_change_seq ON notes (change_seq)")
+    
+    # Deleted notes leave a tombstone so clients can drop them locally
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS note_tombstones (
+        note_id INTEGER PRIMARY KEY,
+        change_seq INTEGER NOT NULL,
+        deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_change_seq ON note_tombstones (change_seq)")
+    
+    # Monotonic change sequence shared by every writer
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('change_seq', 0)")
+    cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('tombstone_floor', 0)")
+
+def next_change_seq(cursor):
+    """Allocate the next change sequence number inside the current transaction"""
+    cursor.execute("UPDATE sync_state SET value = value + 1 WHERE key = 'change_seq'")
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'change_seq'")
+    return cursor.fetchone()[0]
+
+@timed(DB_QUERY_SECONDS, operation="get_change_cursor")
+def get_change_cursor():
+    """Return the latest change sequence number"""
+    try:
+        conn = sqlite3.connect(str(DB_PATH))
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'change_seq'")
+        row = cursor.fetchone()
+        
+        conn.close()
+        return row[0] if row else 0
+    except Exception as e:
+        logger.error(f"Error retrieving change cursor: {str(e)}")
+        return 0
+
+@timed(DB_QUERY_SECONDS, operation="get_changes_since")
+def get_changes_since(since):
+    """Retrieve the notes created, updated or deleted after a change sequence number"""
+    try:
+        conn = sqlite3.connect(str(DB_PATH))
+        cursor = conn.cursor()
+        
+        # Read everything from one snapshot so the cursor matches the rows
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT key, value FROM sync_state WHERE key IN ('change_seq', 'tombstone_floor')")
+        state = dict(cursor.fetchall())
+        latest = state.get("change_seq", 0)
+        
+        # Tombstones older than the floor were pruned, so the client must resync
+        reset = since < state.get("tombstone_floor", 0)
+        if reset:
+            cursor.execute("SELECT * FROM notes ORDER BY updated_at DESC")
+        else:
+            cursor.execute("SELECT * FROM notes WHERE change_seq > ? ORDER BY change_seq", (since,))
+        columns = [column[0] for column in cursor.description]
+        notes = [dict(zip(columns, row)) for row in cursor]
+        
+        deleted = []
+        if not reset:
+            cursor.execute("SELECT note_id FROM note_tombstones WHERE change_seq > ? ORDER BY change_seq", (since,))
+            deleted = [row[0] for row in cursor]
+        
+        conn.commit()
+        conn.close()
+        return {"cursor": latest, "reset": reset, "notes": notes, "deleted": deleted}
+    except Exception as e:
+        logger.error(f"Error retrieving changes since {since}: {str(e)}")
+        return None
+
+def prune_tombstones(max_age_days=30):
+    """Remove old tombstones and raise the floor below which clients must resync"""
+    try:
+        conn = sqlite3.connect(str(DB_PATH))
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "SELECT MAX(change_seq) FROM note_tombstones WHERE deleted_at < datetime('now', ?)",
+            (f"-{max_age_days} days",)
+        )
+        floor = cursor.fetchone()[0]
+        if floor:
+            cursor.execute("DELETE FROM note_tombstones WHERE change_seq <= ?", (floor,))
+            cursor.execute("UPDATE sync_state SET value = MAX(value, ?) WHERE key = 'tombstone_floor'", (floor,))
+            logger.info(f"Pruned tombstones up to change {floor}")
+        
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Error pruning tombstones: {str(e)}")
 
+@timed(DB_QUERY_SECONDS, operation="get_all_notes")
 def get_all_notes():
     """Retrieve all notes from the database"""
     try:
@@ -75,8 +201,80 @@ def get_all_notes():
         logger.error(f"Error retrieving notes: {str(e)}")
         return []
 
+@timed(DB_QUERY_SECONDS, operation="get_all_notes_json")
+def get_all_notes_json(overlay=None):
+    """Retrieve all notes serialized straight from the sqlite rows to JSON bytes; overlay, if given,
+    replaces the list of note dicts before serializing"""
+    try:
+        conn = sqlite3.connect(str(DB_PATH))
+        cursor = conn.cursor()
+        
+        # Read the cursor in the same snapshot so clients can continue with delta sync
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'change_seq'")
+        row = cursor.fetchone()
+        change_cursor = row[0] if row else 0
+        
+        cursor.execute("SELECT * FROM notes ORDER BY updated_at DESC")
+        columns = [column[0] for column in cursor.description]
+        notes = [dict(zip(columns, row)) for row in cursor]
+        
+        conn.commit()
+        conn.close()
+        if overlay is not None:
+            notes = overlay(notes)
+        return dumps({"notes": notes, "cursor": change_cursor})
+    except Exception as e:
+        logger.error(f"Error retrieving notes: {str(e)}")
+        return dumps({"notes": []})
+
+# Connections kept open per thread for note reads served through the note cache
+_readers = threading.local()
+
+def _reader():
+    conn = getattr(_readers, "conn", None)
+    if conn is None or _readers.pid != os.getpid() or _readers.path != DB_PATH:
+        conn = sqlite3.connect(str(DB_PATH), isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        _readers.conn = conn
+        _readers.pid = os.getpid()
+        _readers.path = DB_PATH
+    return conn
+
+def _sync_note_cache(cache: NoteCache, conn):
+    """Drop cached notes that other workers changed or deleted since the last check"""
+    latest = conn.execute("SELECT value FROM sync_state WHERE key = 'change_seq'").fetchone()[0]
+    if cache.seen_seq is None or latest - cache.seen_seq > NOTE_CACHE_MAX_CHANGES:
+        cache.clear(latest)
+    elif latest > cache.seen_seq:
+        changed = conn.execute("SELECT id, change_seq FROM notes WHERE change_seq > ?",
+                               (cache.seen_seq,)).fetchall()
+        deleted = conn.execute("SELECT note_id FROM note_tombstones WHERE change_seq > ?",
+                               (cache.seen_seq,)).fetchall()
+        cache.apply_changes(latest, [tuple(row) for row in changed], [row[0] for row in deleted])
+
+@timed(DB_QUERY_SECONDS, operation="get_note_by_id")
 def get_note_by_id(note_id):
     """Retrieve a specific note by ID"""
+    cache = get_note_cache()
+    if cache.enabled:
+        try:
+            conn = _reader()
+            _sync_note_cache(cache, conn)
+            note = cache.get(note_id)
+            if note is not None:
+                return note
+            generation = cache.generation()
+            row = conn.execute("SELECT * FROM notes WHERE id = ?", (note_id,)).fetchone()
+            if row is None:
+                return None
+            note = dict(row)
+            cache.fill(note, generation)
+            return note
+        except Exception as e:
+            # Open a fresh reader next time and answer this one without the cache
+            logger.error(f"Cached read of note {note_id} failed, reading it directly: {str(e)}")
+            _readers.conn = None
     try:
         conn = sqlite3.connect(str(DB_PATH))
         conn.row_factory = sqlite3.Row
@@ -94,6 +292,15 @@ def get_note_by_id(note_id):
         logger.error(f"Error retrieving note {note_id}: {str(e)}")
         return None
 
+def _read_back(cursor, note_id):
+    """The row as just written, for write-through to the note cache"""
+    cursor.execute("SELECT * FROM notes WHERE id = ?", (note_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+@timed(DB_QUERY_SECONDS, operation="save_note")
 def save_note(title, content, summary=None, quiz=None, mindmap=None):
     """Save a new note to the database"""
     try:
@@ -101,21 +308,34 @@ def save_note(title, content, summary=None, quiz=None, mindmap=None):
         cursor = conn.cursor()
         
         cursor.execute(
-            "INSERT INTO notes (title, content, summary, quiz, mindmap) VALUES (?, ?, ?, ?, ?)",
-            (title, content, summary, quiz, mindmap)
+            "INSERT INTO notes (title, content, summary, quiz, mindmap, change_seq) VALUES (?, ?, ?, ?, ?, ?)",
+            (title, content, summary, quiz, mindmap, next_change_seq(cursor))
         )
         
         note_id = cursor.lastrowid
+        note = _read_back(cursor, note_id) if get_note_cache().enabled else None
         conn.commit()
         conn.close()
         
+        if note is not None:
+            get_note_cache().put(note)
         return note_id
     except Exception as e:
         logger.error(f"Error saving note: {str(e)}")
         return -1
 
-def update_note(note_id, update_data):
-    """Update an existing note"""
+class VersionConflict(Exception):
+    """The note is no longer at the version an edit was based on"""
+
+    def __init__(self, note_id, expected_version):
+        super().__init__(f"Note {note_id} is not at version {expected_version}")
+        self.note_id = note_id
+        self.expected_version = expected_version
+
+@timed(DB_QUERY_SECONDS, operation="update_note")
+def update_note(note_id, update_data, expected_version=None):
+    """Update an existing note; with expected_version, only if the note is still at that version"""
+    updated = True
     try:
         if not update_data:
             return True
@@ -123,27 +343,76 @@ def update_note(note_id, update_data):
         conn = sqlite3.connect(str(DB_PATH))
         cursor = conn.cursor()
         
-        # Build the update query dynamically
-        set_clause = ", ".join([f"{key} = ?" for key in update_data.keys()])
-        values = list(update_data.values())
+        updated, note = _update_row(cursor, note_id, update_data, expected_version)
         
-        # Add updated_at timestamp
-        set_clause += ", updated_at = CURRENT_TIMESTAMP"
+        conn.commit()
+        conn.close()
         
-        # Add the note_id to the values
-        values.append(note_id)
+        if note is not None:
+            get_note_cache().put(note)
+    except Exception as e:
+        logger.error(f"Error updating note {note_id}: {str(e)}")
+        return False
+    if not updated and expected_version is not None:
+        raise VersionConflict(note_id, expected_version)
+    return True
+
+@timed(DB_QUERY_SECONDS, operation="update_notes")
+def update_notes(updates):
+    """Apply updates to several notes ({note_id: fields}) in one transaction; returns the ids of
+    notes that no longer exist, or None if the transaction failed"""
+    try:
+        conn = sqlite3.connect(str(DB_PATH))
+        cursor = conn.cursor()
         
-        query = f"UPDATE notes SET {set_clause} WHERE id = ?"
-        cursor.execute(query, values)
+        notes = []
+        missing = []
+        for note_id, update_data in updates.items():
+            if not update_data:
+                continue
+            updated, note = _update_row(cursor, note_id, update_data)
+            if not updated:
+                missing.append(note_id)
+            notes.append(note)
         
         conn.commit()
         conn.close()
         
-        return True
+        cache = get_note_cache()
+        for note in notes:
+            if note is not None:
+                cache.put(note)
+        return missing
     except Exception as e:
-        logger.error(f"Error updating note {note_id}: {str(e)}")
-        return False
+        logger.error(f"Error updating {len(updates)} notes: {str(e)}")
+        return None
+
+def _update_row(cursor, note_id, update_data, expected_version=None):
+    """UPDATE one note inside the current transaction; returns (updated, new row for the note cache)"""
+    # Build the update query dynamically
+    set_clause = ", ".join([f"{key} = ?" for key in update_data.keys()])
+    values = list(update_data.values())
+    
+    # Every change moves the version on, assigned here so concurrent writers never reuse one
+    set_clause += ", version = version + 1"
+    
+    # Add updated_at timestamp and the change sequence
+    set_clause += ", updated_at = CURRENT_TIMESTAMP, change_seq = ?"
+    values.append(next_change_seq(cursor))
+    
+    # Add the note_id to the values
+    query = f"UPDATE notes SET {set_clause} WHERE id = ?"
+    values.append(note_id)
+    if expected_version is not None:
+        query += " AND version = ?"
+        values.append(expected_version)
+    
+    cursor.execute(query, values)
+    if not cursor.rowcount:
+        return False, None
+    return True, _read_back(cursor, note_id) if get_note_cache().enabled else None
 
+@timed(DB_QUERY_SECONDS, operation="delete_note")
 def delete_note(note_id):
     """Delete a note from the database"""
     try:
@@ -151,10 +420,16 @@ def delete_note(note_id):
         cursor = conn.cursor()
         
         cursor.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+        if cursor.rowcount:
+            cursor.execute(
+                "INSERT OR REPLACE INTO note_tombstones (note_id, change_seq) VALUES (?, ?)",
+                (note_id, next_change_seq(cursor))
+            )
         
         conn.commit()
         conn.close()
         
+        get_note_cache().invalidate(note_id)
         return True
     except Exception as e:
         logger.error(f"Error deleting note {note_id}: {str(e)}")
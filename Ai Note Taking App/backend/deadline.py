@@ -0,0 +1,59 @@
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Time budget of a request in seconds; clients may ask for less with the header
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+
+# Budget of file ingestion requests (PDF extraction, OCR), which legitimately take minutes
+INGESTION_TIMEOUT = float(os.getenv("INGESTION_TIMEOUT", "600"))
+DEADLINE_HEADER = "x-request-timeout"
+
+# Absolute time.monotonic() deadline of the current request. Context variables are
+# copied into run_in_threadpool calls, so blocking code sees its request's deadline.
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, or None when there is no deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+def cap(timeout: float) -> float:
+    """Shorten a timeout so it does not outlive the current deadline"""
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+@contextmanager
+def budget(seconds: float):
+    """Run a block with a deadline; nested budgets can only shorten the outer one"""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def request_budget(headers, ingestion: bool = False) -> float:
+    """Budget for an HTTP request: REQUEST_TIMEOUT (INGESTION_TIMEOUT for file ingestion), or less
+    if the client asks for it"""
+    limit = INGESTION_TIMEOUT if ingestion else REQUEST_TIMEOUT
+    try:
+        requested = float(headers.get(DEADLINE_HEADER, ""))
+    except ValueError:
+        return limit
+    return min(max(requested, 0.0), limit)
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+import tokenizer
+from metrics import record_cache
+from stopwords_en import STOP_WORDS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Number of keywords kept per document
+MAX_KEYWORDS = 10
+
+# Parsed documents kept per worker, keyed by content hash
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "64"))
+
+def is_content_word(token: str) -> bool:
+    """Words worth treating as keywords"""
+    return len(token) > 3 and token not in STOP_WORDS
+
+class ParsedDocument:
+    """A note's text preprocessed once and shared by the summary, quiz and mind map generators.
+
+    Tokens come from tokenizer.words (lowercased, punctuation stripped) and are stored as ids
+    into `vocab`. Each sentence keeps its distinct term ids (sorted) with their counts, so
+    membership and term frequency need no string work.
+    Content words also get a posting list of the sentences they occur in, so the generators
+    look keywords up instead of scanning every sentence per keyword.
+    """
+
+    __slots__ = ("content_hash", "sentences", "vocab", "sentence_terms", "sentence_counts",
+                 "term_counts", "keyword_ids", "keyword_rank", "postings", "_related")
+
+    def __init__(self, sentences: List[str], content_hash: str = ""):
+        self.content_hash = content_hash
+        self.sentences = sentences
+        self.vocab: List[str] = []
+        self.sentence_terms: List[array] = []
+        self.sentence_counts: List[array] = []
+
+        self.postings: Dict[int, array] = {}
+        self._related: Dict[Tuple[int, int], List[int]] = {}
+
+        ids: Dict[str, int] = {}
+        totals: List[int] = []
+        for index, sentence in enumerate(sentences):
+            counts: Dict[int, int] = {}
+            for token in tokenizer.sentence_words(sentence):
+                term_id = ids.get(token)
+                if term_id is None:
+                    # Interned, so documents cached side by side share their vocabulary strings
+                    token = sys.intern(token)
+                    term_id = ids[token] = len(self.vocab)
+                    self.vocab.append(token)
+                    totals.append(0)
+                    if is_content_word(token):
+                        self.postings[term_id] = array("I")
+                totals[term_id] += 1
+                counts[term_id] = counts.get(term_id, 0) + 1
+            terms = sorted(counts)
+            self.sentence_terms.append(array("I", terms))
+            self.sentence_counts.append(array("I", (counts[t] for t in terms)))
+            # Sentences are visited in order, so every posting list comes out sorted
+            for term_id in terms:
+                posting = self.postings.get(term_id)
+                if posting is not None:
+                    posting.append(index)
+        self.term_counts = array("I", totals)
+
+        # Most frequent content words; ties keep first-occurrence order like Counter.most_common
+        content = Counter({term_id: totals[term_id] for term_id in self.postings})
+        self.keyword_ids = [term_id for term_id, _ in content.most_common(MAX_KEYWORDS)]
+        self.keyword_rank = {term_id: rank for rank, term_id in enumerate(self.keyword_ids)}
+
+    @property
+    def keywords(self) -> List[str]:
+        return [self.vocab[term_id] for term_id in self.keyword_ids]
+
+    def term_frequency(self, sentence_index: int, term_id: int) -> int:
+        """How often a term occurs in a sentence"""
+        terms = self.sentence_terms[sentence_index]
+        position = bisect_left(terms, term_id)
+        if position < len(terms) and terms[position] == term_id:
+            return self.sentence_counts[sentence_index][position]
+        return 0
+
+    def contains(self, sentence_index: int, term_id: int) -> bool:
+        return self.term_frequency(sentence_index, term_id) > 0
+
+    def sentences_with(self, term_id: int) -> array:
+        """Indices of the sentences containing a content word, in document order"""
+        return self.postings.get(term_id, _EMPTY_POSTING)
+
+    def keyword_sentence_scores(self) -> Dict[int, int]:
+        """Number of distinct keywords in each sentence that has at least one"""
+        scores: Dict[int, int] = {}
+        for keyword_id in self.keyword_ids:
+            for index in self.sentences_with(keyword_id):
+                scores[index] = scores.get(index, 0) + 1
+        return scores
+
+    def related_terms(self, term_id: int, limit: int = 3) -> List[int]:
+        """Content words that co-occur most often with a term in the same sentences"""
+        key = (term_id, limit)
+        related = self._related.get(key)
+        if related is None:
+            cooccurrence: Counter = Counter()
+            for index in self.sentences_with(term_id):
+                for other, count in zip(self.sentence_terms[index], self.sentence_counts[index]):
+                    if other != term_id and other in self.postings:
+                        cooccurrence[other] += count
+            related = self._related[key] = [other for other, _ in cooccurrence.most_common(limit)]
+        return related
+
+_EMPTY_POSTING = array("I")
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def extract_keywords(tokens: List[str], limit: int = MAX_KEYWORDS) -> List[str]:
+    """Most frequent content words of lowercased tokens"""
+    word_count = Counter(w for w in tokens if is_content_word(w))
+    return [word for word, _ in word_count.most_common(limit)]
+
+class DocumentCache:
+    """LRU of parsed documents keyed by content hash"""
+
+    def __init__(self, max_entries: int = DOCUMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ParsedDocument]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_parse(self, text: str, split_sentences: Callable[[str], List[str]]) -> ParsedDocument:
+        key = content_hash(text)
+        with self._lock:
+            doc = self._entries.get(key)
+            if doc is not None:
+                self._entries.move_to_end(key)
+        record_cache("document", doc is not None)
+        if doc is not None:
+            return doc
+
+        # Parse outside the lock; two threads parsing the same text just do the work twice
+        doc = ParsedDocument(split_sentences(text), key)
+        with self._lock:
+            self._entries[key] = doc
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return doc
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Create a singleton instance
+_document_cache = None
+
+def get_document_cache() -> DocumentCache:
+    """Get the parsed document cache singleton instance"""
+    global _document_cache
+    if _document_cache is None:
+        _document_cache = DocumentCache()
+    return _document_cache
+
+def parse_document(text: str, split_sentences: Callable[[str], List[str]]) -> ParsedDocument:
+    """Preprocess text with the given sentence splitter, reusing a cached result for the same content"""
+    return get_document_cache().get_or_parse(text, split_sentences)
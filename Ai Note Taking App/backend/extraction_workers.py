@@ -0,0 +1,298 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import deadline
+from metrics import EXTRACTION_LIMITS
+from pdf_extraction import PDFExtraction, PDFPage, record_page_kinds
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Run PDF and image extraction in separate worker processes, so a malformed file or
+# decompression bomb cannot take the API worker down with it
+EXTRACTION_ISOLATION = os.getenv("EXTRACTION_ISOLATION", "true").lower() in ("1", "true", "yes")
+
+# Extraction processes per API worker
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+
+# Limits per extraction process: address space, CPU seconds per file, and image size
+EXTRACTION_MAX_MEMORY_MB = int(os.getenv("EXTRACTION_MAX_MEMORY_MB", "2048"))
+EXTRACTION_CPU_SECONDS = int(os.getenv("EXTRACTION_CPU_SECONDS", "120"))
+EXTRACTION_MAX_IMAGE_PIXELS = int(os.getenv("EXTRACTION_MAX_IMAGE_PIXELS", "89478485"))
+
+# Longest wait for the next page before the process is killed and partial results returned
+EXTRACTION_PAGE_TIMEOUT = float(os.getenv("EXTRACTION_PAGE_TIMEOUT", "60"))
+
+# Processes are replaced after this many files, or once their peak RSS passes the limit
+EXTRACTION_MAX_TASKS = int(os.getenv("EXTRACTION_MAX_TASKS", "50"))
+EXTRACTION_RECYCLE_RSS_MB = int(os.getenv("EXTRACTION_RECYCLE_RSS_MB", "1024"))
+
+# Why an extraction stopped, as shown to the client
+_REASONS = {
+    "timeout": "took too long to process",
+    "cpu": "used too much CPU time",
+    "memory": "used too much memory",
+    "image_pixels": "contains an image that is too large",
+    "crash": "crashed the extraction process",
+    "busy": "could not be processed because all extraction workers are busy",
+    "error": "could not be read",
+}
+
+def describe_failure(reason: str) -> str:
+    return f"File {_REASONS.get(reason, reason)}"
+
+class ExtractionFailed(Exception):
+    """Extraction stopped by a limit or a crash before producing any text"""
+
+    def __init__(self, reason: str, detail: Optional[str] = None):
+        message = describe_failure(reason)
+        super().__init__(f"{message}: {detail}" if detail else message)
+        self.reason = reason
+
+# Worker process side
+
+def _apply_limits():
+    from PIL import Image
+
+    # Pillow raises DecompressionBombError past twice this size; make the warning fatal too
+    Image.MAX_IMAGE_PIXELS = EXTRACTION_MAX_IMAGE_PIXELS
+    import warnings
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    try:
+        import resource
+    except ImportError:
+        return
+    if EXTRACTION_MAX_MEMORY_MB > 0:
+        limit = EXTRACTION_MAX_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _limit_cpu():
+    """Allow EXTRACTION_CPU_SECONDS more CPU time for the next file; past it the kernel sends SIGXCPU"""
+    try:
+        import resource
+    except ImportError:
+        return
+    if EXTRACTION_CPU_SECONDS > 0:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + EXTRACTION_CPU_SECONDS
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.RLIM_INFINITY))
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _limit_reason(error: BaseException) -> str:
+    if isinstance(error, MemoryError):
+        return "memory"
+    if type(error).__name__ in ("DecompressionBombError", "DecompressionBombWarning"):
+        return "image_pixels"
+    return "error"
+
+def _run_task(conn, kind: str, path: str):
+    if kind == "pdf":
+        from pdf_extraction import extract_pages
+        for page in extract_pages(path, lambda count: conn.send(("pages", count))):
+            conn.send(("page", page.index, page.kind, page.text, page.ocr, page.ocr_skipped))
+    else:
+        import ocr_engine
+        conn.send(("pages", 1))
+        conn.send(("page", 0, "image", ocr_engine.file_to_text(path), True, False))
+
+def _worker_main(conn):
+    """Entry point of an extraction process: run files from the pipe until told to stop or recycled"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # The API worker handles Ctrl+C; this process exits when its pipe closes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _apply_limits()
+    tasks = 0
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        kind, path = task
+        tasks += 1
+        _limit_cpu()
+        try:
+            _run_task(conn, kind, path)
+        except BaseException as e:
+            reason = _limit_reason(e)
+            conn.send(("error", reason, f"{type(e).__name__}: {str(e)}"))
+            # After running out of memory the process state cannot be trusted
+            if reason == "memory":
+                return
+        recycle = tasks >= EXTRACTION_MAX_TASKS or _peak_rss_mb() > EXTRACTION_RECYCLE_RSS_MB
+        conn.send(("done", recycle))
+        if recycle:
+            return
+
+# API worker side
+
+class _Worker:
+    """One extraction process and the pipe to it"""
+
+    def __init__(self, context):
+        self.error_detail: Optional[str] = None
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True,
+                                       name="extraction-worker")
+        self.process.start()
+        child_conn.close()
+
+    def run(self, kind: str, path: str) -> Tuple[Dict[int, PDFPage], int, Optional[str], bool]:
+        """Send a file and collect pages until done; returns (pages, page count, failure reason, reusable)"""
+        pages: Dict[int, PDFPage] = {}
+        page_count = 0
+        self.error_detail = None
+        self.conn.send((kind, path))
+        while True:
+            wait = deadline.cap(EXTRACTION_PAGE_TIMEOUT)
+            if not self.conn.poll(wait):
+                self.kill()
+                return pages, page_count, "timeout", False
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                return pages, page_count, self._exit_reason(), False
+            if message[0] == "pages":
+                page_count = message[1]
+            elif message[0] == "page":
+                _, index, page_kind, text, ocr, ocr_skipped = message
+                page = pages[index] = PDFPage(index, page_kind, text)
+                page.ocr = ocr
+                page.ocr_skipped = ocr_skipped
+            elif message[0] == "error":
+                logger.warning(f"Extraction of {path} failed: {message[2]}")
+                self.error_detail = message[2]
+                if message[1] == "memory":
+                    self.process.join(5)
+                    return pages, page_count, "memory", False
+                error = message[1]
+                done = self.conn.recv() if self.conn.poll(5) else ("done", True)
+                return pages, page_count, error, not done[1]
+            elif message[0] == "done":
+                return pages, page_count, None, not message[1]
+
+    def _exit_reason(self) -> str:
+        self.process.join(5)
+        code = self.process.exitcode
+        if code is not None and -code == getattr(signal, "SIGXCPU", 0):
+            return "cpu"
+        if code is not None and -code == signal.SIGKILL:
+            # The kernel's OOM killer, or a hard limit
+            return "memory"
+        return "crash"
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+class ExtractionPool:
+    """Long-lived extraction processes, started on demand and replaced when a limit trips or they recycle"""
+
+    def __init__(self, size: int = EXTRACTION_WORKERS):
+        self.size = max(1, size)
+        # Spawned rather than forked: the API worker runs threads whose locks a fork would copy
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: "queue.LifoQueue[_Worker]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._closed = False
+
+    def _checkout(self) -> _Worker:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return _Worker(self._context)
+            if worker.process.is_alive():
+                return worker
+            worker.kill()
+
+    def extract(self, kind: str, path, endpoint: Optional[str] = None) -> PDFExtraction:
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=deadline.cap(EXTRACTION_PAGE_TIMEOUT)):
+            raise ExtractionFailed("busy")
+        try:
+            worker = self._checkout()
+            pages, page_count, error, reusable = worker.run(kind, str(path))
+            detail = worker.error_detail
+            if reusable and not self._closed:
+                self._idle.put(worker)
+            else:
+                worker.stop()
+        finally:
+            self._slots.release()
+
+        if error is not None:
+            EXTRACTION_LIMITS.inc(limit=error)
+            logger.warning(f"Extraction of {path} stopped ({error}) after {len(pages)} of {page_count} pages "
+                           f"in {time.perf_counter() - start:.1f}s")
+        ordered = [pages[index] for index in sorted(pages)]
+        if endpoint is not None:
+            record_page_kinds(endpoint, ordered)
+        if error is not None and not any(page.text.strip() for page in ordered):
+            raise ExtractionFailed(error, detail if error == "error" else None)
+        return PDFExtraction(ordered, complete=error is None, error=error, total_pages=page_count)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+# Create a singleton instance
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_extraction_pool() -> ExtractionPool:
+    """Get the extraction pool singleton instance (created lazily, after any fork)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionPool()
+    return _pool
+
+def shutdown():
+    """Stop the idle extraction processes"""
+    if _pool is not None:
+        _pool.close()
+
+def extract_pdf(path, endpoint: str) -> PDFExtraction:
+    """Extract a PDF in an isolated process when enabled; partial when a limit stopped it"""
+    if not EXTRACTION_ISOLATION:
+        from pdf_extraction import extract_pdf as extract_in_process
+        return extract_in_process(path, endpoint)
+    return get_extraction_pool().extract("pdf", path, endpoint)
+
+def extract_image_text(path) -> str:
+    """OCR an image file in an isolated process when enabled"""
+    if not EXTRACTION_ISOLATION:
+        import ocr_engine
+        return ocr_engine.file_to_text(path)
+    return get_extraction_pool().extract("image", path).texts[0]
@@ -0,0 +1,96 @@
+import importlib
+import logging
+import threading
+import time
+import types
+from typing import Callable, Dict, Iterable, Optional
+
+import startup
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+
+class LazyModule(types.ModuleType):
+    """Module proxy that imports the real module on first attribute access"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_name = name
+        self._lazy_module: Optional[types.ModuleType] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self._lazy_module
+        if module is None:
+            with _lock:
+                if self._lazy_module is None:
+                    start = time.perf_counter()
+                    self._lazy_module = importlib.import_module(self._lazy_name)
+                    startup.record(f"import:{self._lazy_name}", time.perf_counter() - start)
+                module = self._lazy_module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+_modules: Dict[str, LazyModule] = {}
+
+def lazy_import(name: str) -> LazyModule:
+    """Return a proxy for a module that is imported the first time it is used"""
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
+
+class LazyResource:
+    """Value computed on first use (e.g. tokenizer data), shared by all threads"""
+
+    _missing = object()
+
+    def __init__(self, name: str, loader: Callable[[], object]):
+        self.name = name
+        self._loader = loader
+        self._value = self._missing
+
+    def get(self):
+        value = self._value
+        if value is self._missing:
+            with _lock:
+                if self._value is self._missing:
+                    start = time.perf_counter()
+                    try:
+                        self._value = self._loader()
+                    except Exception as e:
+                        logger.warning(f"Failed to load resource '{self.name}': {str(e)}")
+                        self._value = None
+                    startup.record(f"load:{self.name}", time.perf_counter() - start)
+                value = self._value
+        return value
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not self._missing
+
+_resources: Dict[str, LazyResource] = {}
+
+def lazy_resource(name: str, loader: Callable[[], object]) -> LazyResource:
+    """Register a resource that is loaded on first use or during warm-up"""
+    with _lock:
+        if name not in _resources:
+            _resources[name] = LazyResource(name, loader)
+        return _resources[name]
+
+def warm_up(modules: Optional[Iterable[str]] = None):
+    """Load the registered lazy modules and resources ahead of the first request"""
+    with startup.phase("warm_up"):
+        for name in list(modules if modules is not None else _modules):
+            try:
+                lazy_import(name)._load()
+            except Exception as e:
+                logger.warning(f"Warm-up import of {name} failed: {str(e)}")
+        for resource in list(_resources.values()):
+            resource.get()
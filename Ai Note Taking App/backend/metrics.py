@@ -0,0 +1,396 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Directory shared by all workers; each process writes its own snapshot file there
+# so /metrics reports totals for the whole deployment, not just one worker
+MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+
+# How often each worker writes its snapshot when running multi-process
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+# Callbacks notified of every histogram observation, e.g. the request profiler
+_observers: List[Callable[[str, Dict[str, str], float], None]] = []
+
+def add_observer(callback: Callable[[str, Dict[str, str], float], None]):
+    """Register a callback receiving (metric name, labels, value) for each histogram observation"""
+    _observers.append(callback)
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    """Format a label set in the Prometheus text format"""
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    """Base class for labelled metrics"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+class Counter(Metric):
+    """Monotonically increasing counter"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(snapshots: List[Dict[LabelValues, float]]) -> Dict[LabelValues, float]:
+        merged: Dict[LabelValues, float] = {}
+        for snapshot in snapshots:
+            for key, value in snapshot.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, values: Dict[LabelValues, float]) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+class Gauge(Counter):
+    """Value that can go up and down; summed across live workers"""
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed buckets"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts followed by the running sum
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 1)
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+        for observer in _observers:
+            observer(self.name, labels, value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager that observes the elapsed wall time"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[LabelValues, List[float]]:
+        with self._lock:
+            return {key: list(counts) for key, counts in self._values.items()}
+
+    @staticmethod
+    def merge(snapshots: List[Dict[LabelValues, List[float]]]) -> Dict[LabelValues, List[float]]:
+        merged: Dict[LabelValues, List[float]] = {}
+        for snapshot in snapshots:
+            for key, counts in snapshot.items():
+                if key not in merged:
+                    merged[key] = list(counts)
+                else:
+                    merged[key] = [a + b for a, b in zip(merged[key], counts)]
+        return merged
+
+    def render(self, values: Dict[LabelValues, List[float]]) -> List[str]:
+        lines = []
+        for key, counts in sorted(values.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+class Registry:
+    """Holds every metric of this process and renders the exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Dict[LabelValues, object]]:
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    # Multi-process support
+
+    def _snapshot_path(self, pid: int) -> Path:
+        return Path(MULTIPROC_DIR) / f"metrics_{pid}.json"
+
+    def flush(self):
+        """Write this worker's snapshot to the shared directory"""
+        if not MULTIPROC_DIR:
+            return
+        try:
+            data = {name: [[list(key), value] for key, value in values.items()]
+                    for name, values in self.snapshot().items()}
+            path = self._snapshot_path(os.getpid())
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(data))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Failed to flush metrics snapshot: {str(e)}")
+
+    def start_flusher(self):
+        """Start the background thread that periodically flushes this worker's snapshot"""
+        if not MULTIPROC_DIR or self._flusher is not None:
+            return
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+        def run():
+            while True:
+                time.sleep(FLUSH_INTERVAL)
+                self.flush()
+
+        self._flusher = threading.Thread(target=run, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+        logger.info(f"Writing metrics snapshots to {MULTIPROC_DIR} every {FLUSH_INTERVAL}s")
+
+    def _collect(self) -> Dict[str, List[Dict[LabelValues, object]]]:
+        """Gather snapshots from this process and, if configured, every other worker"""
+        if not MULTIPROC_DIR:
+            return {name: [values] for name, values in self.snapshot().items()}
+
+        self.flush()
+        collected: Dict[str, List[Dict[LabelValues, object]]] = {}
+        for path in Path(MULTIPROC_DIR).glob("metrics_*.json"):
+            try:
+                pid = int(path.stem.split("_")[1])
+                alive = _pid_alive(pid)
+                data = json.loads(path.read_text())
+            except Exception:
+                continue
+            for name, items in data.items():
+                metric = self._metrics.get(name)
+                # Gauges describe current state, so only live workers count
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                collected.setdefault(name, []).append({tuple(key): value for key, value in items})
+        return collected
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        collected = self._collect()
+        for name, metric in sorted(self._metrics.items()):
+            values = type(metric).merge(collected.get(name, []))
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(values))
+        lines.extend(_render_cache_ratios(collected.get(CACHE_REQUESTS.name, [])))
+        return "\n".join(lines) + "\n"
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+def _render_cache_ratios(snapshots) -> List[str]:
+    """Derive cache_hit_ratio from the cache request counters"""
+    totals: Dict[str, List[float]] = {}
+    for key, value in Counter.merge(snapshots).items():
+        cache, result = key
+        hits_total = totals.setdefault(cache, [0.0, 0.0])
+        hits_total[1] += value
+        if result == "hit":
+            hits_total[0] += value
+    lines = ["# HELP cache_hit_ratio Fraction of cache lookups that were hits",
+             "# TYPE cache_hit_ratio gauge"]
+    for cache, (hits, total) in sorted(totals.items()):
+        ratio = hits / total if total else 0.0
+        lines.append(f'cache_hit_ratio{{cache="{_escape(cache)}"}} {_format_value(ratio)}')
+    return lines
+
+# Process-wide registry
+registry = Registry()
+
+def reset_multiproc_dir():
+    """Remove snapshots left by a previous run; called by the master before forking workers"""
+    if not MULTIPROC_DIR:
+        return
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for path in Path(MULTIPROC_DIR).glob("metrics_*"):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+def timed(histogram: Histogram, **labels):
+    """Decorator that records the duration of every call in a histogram"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup for the hit ratio"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+# HTTP
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ["method", "route", "status"])
+HTTP_REQUESTS_IN_PROGRESS = registry.gauge(
+    "http_requests_in_progress", "HTTP requests currently being served", ["method"])
+
+# Database
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "Time spent in database operations", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+# Extraction
+PDF_PAGES = registry.counter("pdf_pages_total", "PDF pages processed", ["endpoint"])
+PDF_EXTRACTION_SECONDS = registry.histogram(
+    "pdf_extraction_duration_seconds", "Time spent extracting text from PDFs", ["endpoint"])
+PDF_PAGES_PER_SECOND = registry.histogram(
+    "pdf_pages_per_second", "PDF text extraction throughput per document", ["endpoint"],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+PDF_PAGE_KINDS = registry.counter(
+    "pdf_pages_by_kind_total", "PDF pages by text layer: text, garbled or image (OCRed)", ["endpoint", "kind"])
+EXTRACTION_LIMITS = registry.counter(
+    "extraction_limit_exceeded_total", "Extractions stopped early by a worker limit or crash", ["limit"])
+OCR_SECONDS = registry.histogram(
+    "ocr_duration_seconds", "Time spent running OCR on an image", ["backend"])
+
+# Request scheduling
+SCHEDULER_QUEUE_SECONDS = registry.histogram(
+    "scheduler_queue_seconds", "Time requests waited for a slot in their class's pool", ["request_class"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+SCHEDULER_QUEUE_DEPTH = registry.gauge(
+    "scheduler_queue_depth", "Requests waiting for a slot", ["request_class"])
+SCHEDULER_IN_FLIGHT = registry.gauge(
+    "scheduler_in_flight", "Requests holding a slot", ["request_class"])
+SCHEDULER_SHED = registry.counter(
+    "scheduler_shed_total", "Requests answered with 503 instead of being queued", ["request_class", "reason"])
+
+# Uploads
+UPLOADS_IN_PROGRESS = registry.gauge("uploads_in_progress", "Upload request bodies being received")
+UPLOADS_REJECTED = registry.counter(
+    "uploads_rejected_total", "Uploads refused by admission control", ["reason"])
+
+# Inference
+INFERENCE_SECONDS = registry.histogram(
+    "inference_duration_seconds", "Upstream inference request latency", ["task", "status"])
+INFERENCE_RETRIES = registry.counter(
+    "inference_retries_total", "Upstream inference retries", ["task", "reason"])
+INFERENCE_RATE_LIMITED = registry.counter(
+    "inference_rate_limited_total", "Upstream inference responses with status 429", ["task"])
+INFERENCE_HEDGES = registry.counter(
+    "inference_hedges_total", "Hedged inference requests sent, and how often the hedge answered first",
+    ["task", "outcome"])
+INFERENCE_DEADLINE_EXCEEDED = registry.counter(
+    "inference_deadline_exceeded_total", "Inference calls abandoned because the request ran out of time",
+    ["task"])
+UPSTREAM_REJECTED = registry.counter(
+    "inference_rejected_total", "Inference calls answered by the local fallback without calling upstream",
+    ["task", "reason"])
+UPSTREAM_CONCURRENCY_LIMIT = registry.gauge(
+    "inference_concurrency_limit", "Current adaptive limit on concurrent upstream inference calls")
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "inference_in_flight", "Upstream inference calls in progress")
+UPSTREAM_CIRCUIT_STATE = registry.gauge(
+    "inference_circuit_state", "Inference circuit breaker state (0 closed, 1 half-open, 2 open)")
+
+# Caches
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "Cache lookups by result", ["cache", "result"])
+NOTE_CACHE_BYTES = registry.gauge("note_cache_bytes", "Approximate memory held by the hot note cache")
+NOTE_CACHE_ENTRIES = registry.gauge("note_cache_entries", "Notes held by the hot note cache")
+NOTE_CACHE_INVALIDATIONS = registry.counter(
+    "note_cache_invalidations_total", "Cached notes dropped because they changed", ["source"])
+
+# Write-behind
+WRITE_BEHIND_PENDING = registry.gauge("write_behind_pending_notes", "Notes with updates waiting to be written")
+WRITE_BEHIND_MERGED = registry.counter(
+    "write_behind_merged_total", "Note updates merged into one still waiting to be written")
+WRITE_BEHIND_FLUSHED = registry.counter(
+    "write_behind_flushed_notes_total", "Notes written by write-behind flushes")
+WRITE_BEHIND_DROPPED = registry.counter(
+    "write_behind_dropped_notes_total", "Buffered note updates dropped because the note was deleted meanwhile")
+
+# Note edits
+NOTE_VERSION_CONFLICTS = registry.counter(
+    "note_version_conflicts_total", "Note patches rejected because their base version was stale", ["stage"])
@@ -0,0 +1,142 @@
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from metrics import NOTE_CACHE_BYTES, NOTE_CACHE_ENTRIES, NOTE_CACHE_INVALIDATIONS, record_cache
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Memory for decoded notes kept by each worker; 0 disables the cache
+NOTE_CACHE_MAX_BYTES = int(float(os.getenv("NOTE_CACHE_MAX_MB", "32")) * 1024 * 1024)
+
+# When more notes than this changed since the last check, the cache is emptied instead
+# of invalidating them one by one
+NOTE_CACHE_MAX_CHANGES = int(os.getenv("NOTE_CACHE_MAX_CHANGES", "1000"))
+
+def note_size(note: Dict[str, Any]) -> int:
+    """Approximate memory held by a decoded note"""
+    return sys.getsizeof(note) + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in note.items())
+
+class NoteCache:
+    """Least recently used notes of this worker, bounded by bytes; entries carry the change_seq
+    they were read at, so notes changed by other workers are dropped precisely"""
+
+    def __init__(self, max_bytes: int = NOTE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # Latest change sequence whose changes have been applied to the cache
+        self.seen_seq: Optional[int] = None
+        self.bytes = 0
+        self._entries: "OrderedDict[int, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        # Bumped by every write and invalidation; a read that started before one may be stale
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def generation(self) -> int:
+        """Token to pass to fill() for a row read after this call"""
+        return self._generation
+
+    def get(self, note_id: int) -> Optional[Dict[str, Any]]:
+        """A copy of the cached note, or None"""
+        with self._lock:
+            entry = self._entries.get(note_id)
+            if entry is not None:
+                self._entries.move_to_end(note_id)
+        record_cache("notes", entry is not None)
+        return dict(entry[0]) if entry is not None else None
+
+    def fill(self, note: Dict[str, Any], generation: int):
+        """Cache a note read from the database, unless something was written since the read began"""
+        with self._lock:
+            if generation == self._generation:
+                self._store(note)
+
+    def put(self, note: Dict[str, Any]):
+        """Write-through of a note just saved by this worker"""
+        with self._lock:
+            self._generation += 1
+            self._store(note)
+
+    def _store(self, note: Dict[str, Any]):
+        note_id = note["id"]
+        current = self._entries.get(note_id)
+        if current is not None:
+            if current[0].get("change_seq", 0) > note.get("change_seq", 0):
+                return
+            self._remove(note_id)
+        size = note_size(note)
+        if size > self.max_bytes:
+            return
+        self._entries[note_id] = (dict(note), size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        self._report()
+
+    def _remove(self, note_id: int) -> bool:
+        entry = self._entries.pop(note_id, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[1]
+        return True
+
+    def _report(self):
+        NOTE_CACHE_BYTES.set(self.bytes)
+        NOTE_CACHE_ENTRIES.set(len(self._entries))
+
+    def invalidate(self, note_id: int):
+        """Drop a note this worker changed or deleted"""
+        with self._lock:
+            self._generation += 1
+            if self._remove(note_id):
+                NOTE_CACHE_INVALIDATIONS.inc(source="local")
+                self._report()
+
+    def apply_changes(self, latest: int, changed: Iterable[Tuple[int, int]], deleted: Iterable[int]):
+        """Drop notes changed (as (id, change_seq)) or deleted since seen_seq, then move seen_seq to latest"""
+        with self._lock:
+            self._generation += 1
+            dropped = 0
+            for note_id, change_seq in changed:
+                entry = self._entries.get(note_id)
+                # Our own write-through already holds this version
+                if entry is not None and entry[0].get("change_seq", 0) < change_seq:
+                    dropped += self._remove(note_id)
+            for note_id in deleted:
+                dropped += self._remove(note_id)
+            if self.seen_seq is None or latest > self.seen_seq:
+                self.seen_seq = latest
+            if dropped:
+                NOTE_CACHE_INVALIDATIONS.inc(dropped, source="remote")
+            self._report()
+
+    def clear(self, latest: Optional[int] = None):
+        """Drop everything, e.g. when too many notes changed to invalidate them one by one"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.bytes = 0
+            self.seen_seq = latest
+            self._report()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "seen_seq": self.seen_seq or 0}
+
+# Create a singleton instance
+_note_cache = None
+
+def get_note_cache() -> NoteCache:
+    """Get the note cache singleton instance"""
+    global _note_cache
+    if _note_cache is None:
+        _note_cache = NoteCache()
+    return _note_cache
@@ -0,0 +1,143 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
+from lazy import lazy_import, lazy_resource
+from metrics import OCR_SECONDS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+Image = lazy_import("PIL.Image")
+pytesseract = lazy_import("pytesseract")
+
+# OCR backend: "auto" (tesserocr if installed, else the tesseract CLI), "tesserocr" or "subprocess"
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+
+# Tesseract language(s), e.g. "eng" or "eng+deu"
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+# Tesseract instances kept per worker; each holds its own copy of the language model
+OCR_THREADS = int(os.getenv("OCR_THREADS", "4"))
+
+class OCREngine:
+    """Turns a PIL image into text"""
+
+    name = "base"
+
+    def recognize(self, image) -> str:
+        raise NotImplementedError
+
+class SubprocessEngine(OCREngine):
+    """pytesseract: one tesseract process per image, loading the language data every time"""
+
+    name = "subprocess"
+
+    def recognize(self, image) -> str:
+        return pytesseract.image_to_string(image, lang=OCR_LANG)
+
+class TesserocrEngine(OCREngine):
+    """Pool of in-process Tesseract instances that load the language data once and take images from memory"""
+
+    name = "tesserocr"
+
+    def __init__(self, module, size: int = OCR_THREADS):
+        self._module = module
+        self._size = max(1, size)
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # Create the first instance now so a missing language model is noticed at startup
+        self._idle.put(self._new_api())
+        self._created = 1
+
+    def _new_api(self):
+        kwargs = {"lang": OCR_LANG}
+        if os.getenv("TESSDATA_PREFIX"):
+            kwargs["path"] = os.environ["TESSDATA_PREFIX"]
+        return self._module.PyTessBaseAPI(**kwargs)
+
+    @contextmanager
+    def _api(self):
+        # An instance is used by one thread at a time; new ones are created up to the pool size
+        try:
+            api = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self._size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    api = self._new_api()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                api = self._idle.get()
+        try:
+            yield api
+        finally:
+            api.Clear()
+            self._idle.put(api)
+
+    def recognize(self, image) -> str:
+        with self._api() as api:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+
+def _load_engine() -> OCREngine:
+    """The configured OCR engine, falling back to the tesseract CLI"""
+    if OCR_BACKEND in ("auto", "tesserocr"):
+        try:
+            import tesserocr
+            engine = TesserocrEngine(tesserocr)
+            logger.info(f"Using in-process Tesseract OCR ({OCR_LANG}, up to {OCR_THREADS} instances)")
+            return engine
+        except ImportError:
+            logger.info("tesserocr is not installed, running the tesseract CLI per image")
+        except Exception as e:
+            logger.warning(f"Could not start in-process Tesseract, running the tesseract CLI per image: {str(e)}")
+    return SubprocessEngine()
+
+# Loaded during warm-up, so the language data is read before the workers fork
+_engine = lazy_resource("ocr_engine", _load_engine)
+_fallback = SubprocessEngine()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_ocr_engine() -> OCREngine:
+    """Get the OCR engine singleton instance"""
+    return _engine.get() or _fallback
+
+def get_ocr_executor() -> ThreadPoolExecutor:
+    """Threads that OCR pages in parallel (created lazily, after any fork)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, OCR_THREADS), thread_name_prefix="ocr")
+    return _executor
+
+def image_to_text(image, engine: Optional[OCREngine] = None) -> str:
+    """OCR a PIL image with the configured engine, retrying with the CLI if the engine fails"""
+    engine = engine or get_ocr_engine()
+    try:
+        with OCR_SECONDS.time(backend=engine.name):
+            return engine.recognize(image)
+    except Exception as e:
+        if engine is _fallback:
+            raise
+        logger.warning(f"{engine.name} OCR failed, retrying with the tesseract CLI: {str(e)}")
+        with OCR_SECONDS.time(backend=_fallback.name):
+            return _fallback.recognize(image)
+
+def file_to_text(path) -> str:
+    """OCR an image file"""
+    with Image.open(path) as image:
+        image.load()
+        return image_to_text(image)
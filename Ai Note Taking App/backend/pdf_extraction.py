@@ -0,0 +1,192 @@
+import contextvars
+import io
+import logging
+import os
+import threading
+from concurrent.futures import as_completed
+from typing import Callable, Iterator, List, Optional
+
+import deadline
+import ocr_engine
+from lazy import lazy_import
+from metrics import PDF_PAGE_KINDS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+PyPDF2 = lazy_import("PyPDF2")
+Image = lazy_import("PIL.Image")
+
+# OCR pages without a usable text layer (scanned or handwritten pages)
+PDF_OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Resolution pages are rendered at for OCR
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "200"))
+
+# Pages with fewer non-blank characters than this are treated as images
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", "20"))
+
+# Share of characters that must look like ordinary text for a text layer to be trusted
+_MIN_CLEAN_RATIO = 0.85
+_COMMON_PUNCTUATION = frozenset(".,;:!?'\"()[]{}-/%&*+=<>@#$_‘’“”–—•")
+
+def classify_text(text: str) -> str:
+    """Kind of a page from its extracted text: "text", "garbled" (broken font encoding) or "image" """
+    visible = "".join(text.split())
+    if len(visible) < PDF_MIN_TEXT_CHARS:
+        return "image"
+    # Fonts without a Unicode map come out as (cid:N) codes, replacement or control characters
+    if "(cid:" in text:
+        return "garbled"
+    clean = sum(1 for c in visible if c.isalnum() or c in _COMMON_PUNCTUATION)
+    return "text" if clean / len(visible) >= _MIN_CLEAN_RATIO else "garbled"
+
+class PDFPage:
+    __slots__ = ("index", "kind", "text", "ocr", "ocr_skipped")
+
+    def __init__(self, index: int, kind: str, text: str):
+        self.index = index
+        self.kind = kind
+        self.text = text
+        self.ocr = False
+        # Needed OCR, but the request ran out of time first
+        self.ocr_skipped = False
+
+class PDFExtraction:
+    """Per-page text of a PDF, from the text layer or OCR; incomplete when a limit stopped extraction early
+    or pages were left without OCR"""
+
+    def __init__(self, pages: List[PDFPage], complete: bool = True, error: Optional[str] = None,
+                 total_pages: Optional[int] = None):
+        self.pages = pages
+        self.error = error
+        if complete and any(page.ocr_skipped for page in pages):
+            self.error = "timeout"
+        self.complete = self.error is None
+        self.total_pages = max(total_pages or 0, len(pages))
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    @property
+    def pages_extracted(self) -> int:
+        """Pages with all their text; the rest are missing or kept only their text layer"""
+        return sum(1 for page in self.pages if not page.ocr_skipped)
+
+    @property
+    def ocr_pages(self) -> int:
+        return sum(1 for page in self.pages if page.ocr)
+
+    @property
+    def texts(self) -> List[str]:
+        return [page.text for page in self.pages]
+
+class _Rasterizer:
+    """Page images for OCR: rendered with PyMuPDF when installed, else the page's largest embedded image"""
+
+    def __init__(self, path, reader):
+        self._reader = reader
+        self._doc = None
+        # Neither library is thread-safe; pages are rendered one at a time and OCRed in parallel
+        self._lock = threading.Lock()
+        try:
+            import fitz
+            self._doc = fitz.open(str(path))
+        except ImportError:
+            logger.info("PyMuPDF is not installed, OCRing the embedded images of scanned pages")
+        except Exception as e:
+            logger.warning(f"PyMuPDF could not open the PDF, OCRing embedded images: {str(e)}")
+
+    def render(self, index: int):
+        with self._lock:
+            if self._doc is not None:
+                pixmap = self._doc[index].get_pixmap(dpi=PDF_OCR_DPI)
+                return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+            return self._largest_image(index)
+
+    def _largest_image(self, index: int):
+        try:
+            images = self._reader.pages[index].images
+        except Exception:
+            return None
+        if not images:
+            return None
+        data = max(images, key=lambda image: len(image.data)).data
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def close(self):
+        with self._lock:
+            if self._doc is not None:
+                self._doc.close()
+                self._doc = None
+
+def _ocr_page(rasterizer: _Rasterizer, page: PDFPage):
+    # Pages still queued when the request runs out of time keep their native text
+    if deadline.expired():
+        page.ocr_skipped = True
+        return
+    image = rasterizer.render(page.index)
+    if image is None:
+        return
+    text = ocr_engine.image_to_text(image)
+    # A garbled text layer is mostly (cid:N) codes, long but useless, so OCR always replaces it;
+    # an image page keeps whatever little native text it had unless OCR finds more
+    if page.kind == "garbled" or len(text.strip()) >= len(page.text.strip()):
+        page.text = text
+        page.ocr = True
+
+def extract_pages(path, on_page_count: Optional[Callable[[int], None]] = None) -> Iterator[PDFPage]:
+    """Yield the pages of a PDF as they are done: text layer pages first, then OCRed pages as OCR finishes"""
+    reader = PyPDF2.PdfReader(str(path))
+    if on_page_count is not None:
+        on_page_count(len(reader.pages))
+    needs_ocr = []
+    for index, page in enumerate(reader.pages):
+        text = page.extract_text() or ""
+        page = PDFPage(index, classify_text(text), text)
+        if page.kind == "text" or not PDF_OCR_ENABLED:
+            yield page
+        else:
+            needs_ocr.append(page)
+    if not needs_ocr:
+        return
+
+    logger.info(f"OCRing {len(needs_ocr)} of {len(reader.pages)} PDF pages without a usable text layer")
+    rasterizer = _Rasterizer(path, reader)
+    executor = ocr_engine.get_ocr_executor()
+    futures = {}
+    try:
+        # Copy the context so the workers see this request's deadline
+        futures = {executor.submit(contextvars.copy_context().run, _ocr_page, rasterizer, page): page
+                   for page in needs_ocr}
+        for future in as_completed(futures):
+            page = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"OCR of PDF page {page.index + 1} failed: {str(e)}")
+            yield page
+    finally:
+        for future in futures:
+            future.cancel()
+        rasterizer.close()
+
+def record_page_kinds(endpoint: str, pages: List[PDFPage]):
+    for page in pages:
+        PDF_PAGE_KINDS.inc(endpoint=endpoint, kind=page.kind)
+
+def extract_pdf(path, endpoint: str) -> PDFExtraction:
+    """Extract each page natively and OCR, in parallel, only the pages without a usable text layer"""
+    pages = sorted(extract_pages(path), key=lambda page: page.index)
+    record_page_kinds(endpoint, pages)
+    return PDFExtraction(pages)
+
+def first_line_title(text: Optional[str]) -> Optional[str]:
+    """First line of a page if it is short enough to be a title"""
+    if not text:
+        return None
+    line = text.split('\n')[0].strip()
+    return line if 0 < len(line) < 100 else None
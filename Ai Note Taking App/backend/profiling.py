@@ -0,0 +1,303 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Allow clients to request a profile with the X-Profile header
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Fraction of requests profiled automatically (0.0 - 1.0)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+
+# Profiles are stored as JSON files so any worker can serve them
+PROFILE_DIR = Path(__file__).parent / os.getenv("PROFILE_DIR", "profiles")
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", "50"))
+
+PROFILE_HEADER = "x-profile"
+
+# Functions below this share of the request time are left out of the call tree
+MIN_NODE_FRACTION = 0.005
+MAX_TREE_DEPTH = 40
+
+# Prefer pyinstrument's sampling call tree when it is installed
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+# Only one request is profiled at a time: the profilers and tracemalloc are process-wide
+_profile_lock = threading.Lock()
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None)
+
+class RequestProfile:
+    """Call tree, stage timings and allocation peak captured for one request"""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = time.time()
+        self.stages: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+        self._profiler = None
+        self._duration = 0.0
+        self._started_tracemalloc = False
+        self.result: Dict[str, Any] = {}
+
+    def start(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        if SamplingProfiler is not None:
+            self._profiler = SamplingProfiler(interval=0.001, async_mode="enabled")
+            self._profiler.start()
+            return
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def stop(self):
+        """Stop the profiler; it hooks the calling thread, so this runs on the thread that started it"""
+        self._duration = time.perf_counter() - self._start
+        if isinstance(self._profiler, cProfile.Profile):
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+
+    def render(self, status: int):
+        """Build the stored result; slow for large call trees, so it runs off the event loop"""
+        duration = self._duration
+        if isinstance(self._profiler, cProfile.Profile):
+            tree, flame = _cprofile_tree(self._profiler, duration)
+            profiler_name = "cProfile"
+        else:
+            session = self._profiler.last_session
+            tree, flame = _sampling_tree(session.root_frame() if session else None, duration)
+            profiler_name = "pyinstrument"
+
+        current, peak = tracemalloc.get_traced_memory()
+        top_allocations = []
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            for stat in snapshot.statistics("lineno")[:10]:
+                frame = stat.traceback[0]
+                top_allocations.append({"location": f"{frame.filename}:{frame.lineno}",
+                                        "size_bytes": stat.size, "count": stat.count})
+        except Exception as e:
+            logger.error(f"Failed to snapshot allocations: {str(e)}")
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        self.result = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": round(duration * 1000, 3),
+            "profiler": profiler_name,
+            "stages": self.stages,
+            "memory": {"peak_bytes": peak, "current_bytes": current, "top_allocations": top_allocations},
+            "call_tree": tree,
+            "flame": flame,
+        }
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages.append({"stage": name, "ms": round(seconds * 1000, 3),
+                            "at_ms": round((time.perf_counter() - self._start - seconds) * 1000, 3)})
+
+def _cprofile_tree(profiler: cProfile.Profile, duration: float):
+    """Rebuild an approximate call tree from cProfile's caller/callee edges"""
+    stats = pstats.Stats(profiler).stats
+    callees: Dict[Any, Dict[Any, float]] = {}
+    roots = []
+    for func, (_, _, _, cumulative, callers) in stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, {})[func] = caller_stats[3]
+
+    threshold = duration * MIN_NODE_FRACTION
+    flame: List[str] = []
+
+    def label(func) -> str:
+        filename, line, name = func
+        return f"{name} ({os.path.basename(filename)}:{line})" if line else name
+
+    def walk(func, budget: float, stack: List[str], depth: int) -> Dict[str, Any]:
+        own = stats[func]
+        scale = budget / own[3] if own[3] else 0.0
+        node = {"function": label(func), "ms": round(budget * 1000, 3), "children": []}
+        path = stack + [label(func)]
+        children_time = 0.0
+        if depth < MAX_TREE_DEPTH:
+            for callee, cumulative in sorted(callees.get(func, {}).items(), key=lambda item: -item[1]):
+                child_budget = cumulative * scale
+                if child_budget < threshold or label(callee) in path:
+                    continue
+                children_time += child_budget
+                node["children"].append(walk(callee, child_budget, path, depth + 1))
+        self_time = max(0.0, budget - children_time)
+        if self_time > 0:
+            flame.append(f"{';'.join(path)} {int(self_time * 1_000_000)}")
+        return node
+
+    tree = [walk(root, stats[root][3], [], 0) for root in roots if stats[root][3] >= threshold]
+    tree.sort(key=lambda node: -node["ms"])
+    return tree, flame
+
+def _sampling_tree(root_frame, duration: float):
+    """Convert a pyinstrument frame tree to the stored format"""
+    flame: List[str] = []
+    if root_frame is None:
+        return [], flame
+    threshold = duration * MIN_NODE_FRACTION
+
+    def walk(frame, stack: List[str], depth: int) -> Dict[str, Any]:
+        name = f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+        path = stack + [name]
+        node = {"function": name, "ms": round(frame.time * 1000, 3), "children": []}
+        children_time = 0.0
+        for child in frame.children:
+            if depth >= MAX_TREE_DEPTH or child.time < threshold:
+                continue
+            children_time += child.time
+            node["children"].append(walk(child, path, depth + 1))
+        self_time = max(0.0, frame.time - children_time)
+        if self_time > 0:
+            flame.append(f"{';'.join(path)} {int(self_time * 1_000_000)}")
+        return node
+
+    return [walk(root_frame, [], 0)], flame
+
+def _record_metric(name: str, labels: Dict[str, str], value: float):
+    """Turn histogram observations made during a profiled request into stage timings"""
+    profile = _current_profile.get()
+    if profile is None or not name.endswith("_seconds"):
+        return
+    suffix = ",".join(str(v) for v in labels.values())
+    stage_name = name[:-len("_seconds")].replace("_duration", "")
+    profile.add_stage(f"{stage_name}[{suffix}]" if suffix else stage_name, value)
+
+metrics.add_observer(_record_metric)
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a named stage of the current profiled request (no-op otherwise)"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_stage(name, time.perf_counter() - start)
+
+def should_profile(headers) -> Optional[str]:
+    """Decide whether to profile a request; returns the reason or None"""
+    if PROFILING_ENABLED and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return "header"
+    if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+async def profile_request(request, call_next):
+    """Middleware body: profile the request when asked to, otherwise pass it through"""
+    reason = should_profile(request.headers)
+    if reason is None:
+        return await call_next(request)
+
+    # Another request is already being profiled in this worker
+    if not _profile_lock.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers["X-Profile-Skipped"] = "busy"
+        return response
+
+    # cProfile sees everything on the event loop thread, so coroutines of other
+    # requests interleaved with this one can show up in its call tree
+    profile = RequestProfile(request.method, request.url.path, reason)
+    token = _current_profile.set(profile)
+    response = None
+    status = 500
+    try:
+        profile.start()
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _current_profile.reset(token)
+        try:
+            profile.stop()
+            # Rendering and writing the profile would stall every other request on the event loop
+            await run_in_threadpool(_render_and_save, profile, status)
+        except Exception as e:
+            logger.error(f"Failed to store profile for {request.url.path}: {str(e)}")
+        finally:
+            _profile_lock.release()
+        if response is not None:
+            response.headers["X-Profile-Id"] = profile.id
+
+def _render_and_save(profile: RequestProfile, status: int):
+    profile.render(status)
+    save_profile(profile.result)
+
+def save_profile(result: Dict[str, Any]):
+    """Write a profile to disk and drop the oldest ones beyond PROFILE_HISTORY"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"{result['id']}.json"
+    path.write_text(json.dumps(result))
+    logger.info(f"Stored profile {result['id']} for {result['method']} {result['path']} "
+                f"({result['duration_ms']} ms)")
+
+    profiles = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for old in profiles[:-PROFILE_HISTORY]:
+        try:
+            old.unlink()
+        except OSError:
+            pass
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Summaries of the stored profiles, newest first"""
+    summaries = []
+    if not PROFILE_DIR.exists():
+        return summaries
+    for path in sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
+        try:
+            data = json.loads(path.read_text())
+        except Exception:
+            continue
+        summaries.append({key: data.get(key) for key in
+                          ("id", "method", "path", "status", "reason", "started_at", "duration_ms")})
+    return summaries
+
+def load_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    """Load a stored profile by id"""
+    if not profile_id.isalnum():
+        return None
+    path = PROFILE_DIR / f"{profile_id}.json"
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
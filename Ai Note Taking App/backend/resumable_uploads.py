@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from admission import IMAGE_TYPES, PDF_TYPES, SNIFF_BYTES, check_type
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent writes to one session are not serialised across workers
+    fcntl = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Partial uploads and their metadata; shared by all workers, so any worker can take the next chunk
+UPLOAD_SESSIONS_DIR = Path(__file__).parent / os.getenv("UPLOAD_SESSIONS_DIR", "upload_sessions")
+
+# Largest file accepted through a session, and how long an unfinished session is kept
+RESUMABLE_UPLOAD_MAX_BYTES = int(os.getenv("RESUMABLE_UPLOAD_MAX_MB", "1024")) * 1024 * 1024
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", "86400"))
+
+# Suggested chunk size for clients
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# How the finished file is processed (like /api/upload-pdf or /api/handwriting) and the file types each accepts
+UPLOAD_KINDS = {"pdf": PDF_TYPES, "handwriting": PDF_TYPES | IMAGE_TYPES}
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+class UploadSessionError(Exception):
+    """A session request that cannot be served, with the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, detail: str, offset: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.offset = offset
+
+class ResumableUploads:
+    """Upload sessions: chunks are written at their offset into a spool file until the declared size arrives"""
+
+    def __init__(self, root: Path = UPLOAD_SESSIONS_DIR, max_bytes: int = RESUMABLE_UPLOAD_MAX_BYTES,
+                 ttl: float = UPLOAD_SESSION_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._last_cleanup = 0.0
+        self._lock = threading.Lock()
+
+    def _paths(self, upload_id: str) -> Tuple[Path, Path]:
+        if not _SESSION_ID.match(upload_id):
+            raise UploadSessionError(404, "Upload not found")
+        return self.root / f"{upload_id}.json", self.root / f"{upload_id}.part"
+
+    def _load(self, upload_id: str) -> Tuple[Dict[str, Any], Path]:
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionError(404, "Upload not found")
+        return session, part_path
+
+    def create(self, filename: str, size: int, kind: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Start a session for a file of a known size"""
+        if kind not in UPLOAD_KINDS:
+            raise UploadSessionError(400, f"kind must be one of: {', '.join(UPLOAD_KINDS)}")
+        if size <= 0:
+            raise UploadSessionError(400, "size must be positive")
+        if size > self.max_bytes:
+            raise UploadSessionError(413, f"File is larger than {self.max_bytes // (1024 * 1024)} MB")
+        if kind == "pdf" and not filename.lower().endswith(".pdf"):
+            raise UploadSessionError(400, "Only PDF files are accepted")
+        if sha256 is not None and not _SHA256.match(sha256.lower()):
+            raise UploadSessionError(400, "sha256 must be 64 hex characters")
+        self.cleanup_expired()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        session = {"upload_id": upload_id, "filename": filename, "size": size, "kind": kind,
+                   "sha256": sha256.lower() if sha256 else None, "created": time.time()}
+        part_path.touch()
+        tmp_path = meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, meta_path)
+        logger.info(f"Created upload session {upload_id} for {filename} ({size} bytes)")
+        return self._status(session, 0)
+
+    def _status(self, session: Dict[str, Any], offset: int) -> Dict[str, Any]:
+        return {"upload_id": session["upload_id"], "filename": session["filename"], "kind": session["kind"],
+                "size": session["size"], "offset": offset, "complete": offset == session["size"],
+                "chunk_size": UPLOAD_CHUNK_SIZE}
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        """The session with the number of bytes received so far, where the client resumes"""
+        session, part_path = self._load(upload_id)
+        return self._status(session, part_path.stat().st_size)
+
+    async def write(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Append a chunk that starts at offset; bytes that arrive before a disconnect are kept"""
+        session, part_path = self._load(upload_id)
+        with open(part_path, "r+b") as f:
+            if fcntl is not None:
+                # Two retries of the same chunk can reach different workers
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadSessionError(409, "Another chunk of this upload is being written")
+            received = os.fstat(f.fileno()).st_size
+            if offset != received:
+                raise UploadSessionError(409, f"Expected offset {received}", offset=received)
+            f.seek(offset)
+            position = offset
+            # The first bytes of the file are checked before anything is written
+            head = b"" if offset == 0 else None
+            async for chunk in chunks:
+                if head is not None:
+                    head += chunk
+                    if len(head) < min(SNIFF_BYTES, session["size"]):
+                        continue
+                    check_type(head, UPLOAD_KINDS[session["kind"]])
+                    chunk, head = head, None
+                if position + len(chunk) > session["size"]:
+                    await run_in_threadpool(f.truncate, position)
+                    raise UploadSessionError(413, "Chunk goes past the declared upload size", offset=position)
+                # Disk writes stay off the event loop, which serves every other request meanwhile
+                await run_in_threadpool(f.write, chunk)
+                position += len(chunk)
+            if head:
+                # The whole body was shorter than the sniffed prefix; nothing written yet
+                check_type(head, UPLOAD_KINDS[session["kind"]])
+                if position + len(head) > session["size"]:
+                    raise UploadSessionError(413, "Chunk goes past the declared upload size", offset=position)
+                await run_in_threadpool(f.write, head)
+                position += len(head)
+            await run_in_threadpool(f.flush)
+        return self._status(session, position)
+
+    def finalize(self, upload_id: str, destination: Path, sha256: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+        """Check size and checksum, then move the file to destination; returns (session, sha256)"""
+        session, part_path = self._load(upload_id)
+        received = part_path.stat().st_size
+        if received != session["size"]:
+            raise UploadSessionError(409, f"Upload is incomplete: {received} of {session['size']} bytes",
+                                     offset=received)
+        digest = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(block)
+        actual = digest.hexdigest()
+        expected = (sha256 or session["sha256"] or "").lower()
+        if expected and expected != actual:
+            # The bytes on disk are wrong somewhere; the client has to start a new session
+            self.abort(upload_id)
+            raise UploadSessionError(422, "Checksum mismatch: the file was corrupted in transit, upload it again")
+        os.replace(part_path, destination)
+        self._paths(upload_id)[0].unlink(missing_ok=True)
+        return session, actual
+
+    def abort(self, upload_id: str):
+        meta_path, part_path = self._paths(upload_id)
+        if not meta_path.exists():
+            raise UploadSessionError(404, "Upload not found")
+        meta_path.unlink(missing_ok=True)
+        part_path.unlink(missing_ok=True)
+
+    def cleanup_expired(self, interval: float = 60.0) -> int:
+        """Delete sessions untouched for longer than the TTL (at most once per interval)"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup < interval:
+                return 0
+            self._last_cleanup = now
+        if not self.root.exists():
+            return 0
+        removed = 0
+        for meta_path in self.root.glob("*.json"):
+            part_path = meta_path.with_suffix(".part")
+            try:
+                last_write = part_path.stat().st_mtime if part_path.exists() else meta_path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if now - last_write > self.ttl:
+                meta_path.unlink(missing_ok=True)
+                part_path.unlink(missing_ok=True)
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} expired upload sessions")
+        return removed
+
+# Create a singleton instance
+_resumable_uploads = None
+
+def get_resumable_uploads() -> ResumableUploads:
+    """Get the resumable uploads singleton instance"""
+    global _resumable_uploads
+    if _resumable_uploads is None:
+        _resumable_uploads = ResumableUploads()
+    return _resumable_uploads
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from metrics import (SCHEDULER_IN_FLIGHT, SCHEDULER_QUEUE_DEPTH, SCHEDULER_QUEUE_SECONDS,
+                     SCHEDULER_SHED)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Give each request class its own concurrency limit and queue, and shed lower-priority work
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Weight of the latest queue wait in the moving average used to detect overload
+_EWMA_WEIGHT = 0.2
+
+class RequestClass:
+    """Concurrency pool and queue of one class of requests"""
+
+    def __init__(self, name: str, priority: int, concurrency: int, queue_slo: float, max_queue: int):
+        self.name = name
+        # Lower numbers are more important; work of a lower priority is shed first
+        self.priority = priority
+        self.concurrency = max(1, concurrency)
+        # Longest a request may wait for a slot before it is answered with 503
+        self.queue_slo = queue_slo
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.queue_wait = 0.0
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    @property
+    def overloaded(self) -> bool:
+        """Requests of this class wait, on average, more than half their SLO"""
+        return self.waiting > 0 and self.queue_wait > self.queue_slo / 2
+
+    def _observe_wait(self, seconds: float):
+        self.queue_wait += _EWMA_WEIGHT * (seconds - self.queue_wait)
+        SCHEDULER_QUEUE_SECONDS.observe(seconds, request_class=self.name)
+
+    async def acquire(self) -> bool:
+        """Wait for a slot for at most the queue SLO; False when the request should be shed"""
+        start = time.perf_counter()
+        self.waiting += 1
+        SCHEDULER_QUEUE_DEPTH.set(self.waiting, request_class=self.name)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_slo)
+        except asyncio.TimeoutError:
+            self._observe_wait(time.perf_counter() - start)
+            return False
+        finally:
+            self.waiting -= 1
+            SCHEDULER_QUEUE_DEPTH.set(self.waiting, request_class=self.name)
+        self._observe_wait(time.perf_counter() - start)
+        self.in_flight += 1
+        SCHEDULER_IN_FLIGHT.set(self.in_flight, request_class=self.name)
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        SCHEDULER_IN_FLIGHT.set(self.in_flight, request_class=self.name)
+        self._slots.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {"priority": self.priority, "concurrency": self.concurrency, "in_flight": self.in_flight,
+                "waiting": self.waiting, "queue_wait_avg": round(self.queue_wait, 4),
+                "queue_slo": self.queue_slo}
+
+def _request_class(name: str, priority: int, concurrency: str, queue_slo: str, max_queue: str) -> RequestClass:
+    prefix = name.upper()
+    return RequestClass(
+        name, priority,
+        int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+        float(os.getenv(f"{prefix}_QUEUE_SLO", queue_slo)),
+        int(os.getenv(f"{prefix}_MAX_QUEUE", max_queue)),
+    )
+
+# (method or None for any, path pattern, class); first match wins, unmatched requests are not scheduled
+_ROUTES: List[Tuple[Optional[str], "re.Pattern[str]", str]] = [
+    # Long-polls (up to sync.MAX_WAIT) and the change stream mostly wait for writes: holding an
+    # interactive slot meanwhile would starve note CRUD once enough tabs are open
+    (None, re.compile(r"^/api/notes/changes(/stream)?$"), ""),
+    ("POST", re.compile(r"^/api/notes/\d+/analyze$"), "ai"),
+    (None, re.compile(r"^/api/notes(/.*)?$"), "interactive"),
+    ("POST", re.compile(r"^/api/(summarize|generate-quiz|mindmap|test-ai|text-to-speech)$"), "ai"),
+    ("POST", re.compile(r"^/api/(upload-pdf|handwriting)$"), "ingestion"),
+    ("POST", re.compile(r"^/api/uploads/[^/]+/complete$"), "ingestion"),
+]
+
+class Scheduler:
+    """Per-class concurrency pools for interactive CRUD, AI generation and file ingestion"""
+
+    def __init__(self):
+        # Cheap note reads and autosaves get a wide pool and a tight SLO; the heavy classes
+        # together stay below the default threadpool size so interactive calls always find a thread
+        self.classes: Dict[str, RequestClass] = {
+            request_class.name: request_class for request_class in (
+                _request_class("interactive", 0, "64", "0.5", "256"),
+                _request_class("ai", 1, "8", "5", "32"),
+                _request_class("ingestion", 2, "4", "10", "16"),
+            )
+        }
+
+    def classify(self, method: str, path: str) -> Optional[RequestClass]:
+        for route_method, pattern, name in _ROUTES:
+            if (route_method is None or route_method == method) and pattern.match(path):
+                return self.classes.get(name)
+        return None
+
+    def shed_reason(self, request_class: RequestClass) -> Optional[str]:
+        """Why a new request of this class should be refused right away, if it should"""
+        if request_class.waiting >= request_class.max_queue:
+            return "queue_full"
+        # More important work is queueing: do not add load of a lower priority
+        for other in self.classes.values():
+            if other.priority < request_class.priority and other.overloaded:
+                return f"{other.name}_overloaded"
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: request_class.stats() for name, request_class in self.classes.items()}
+
+def _shed_response(request_class: RequestClass) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(max(1, math.ceil(request_class.queue_slo)))},
+        content={"detail": "Server is busy, try again shortly"},
+    )
+
+class SchedulerMiddleware:
+    """Queues each request in its class's pool and answers 503 when it would wait past the class SLO"""
+
+    def __init__(self, app, scheduler: Optional["Scheduler"] = None):
+        self.app = app
+        self.scheduler = scheduler or get_scheduler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SCHEDULER_ENABLED:
+            return await self.app(scope, receive, send)
+        request_class = self.scheduler.classify(scope["method"], scope["path"])
+        if request_class is None:
+            return await self.app(scope, receive, send)
+
+        reason = self.scheduler.shed_reason(request_class)
+        if reason is None and not await request_class.acquire():
+            reason = "queue_timeout"
+        if reason is not None:
+            SCHEDULER_SHED.inc(request_class=request_class.name, reason=reason)
+            logger.warning(f"Shedding {scope['method']} {scope['path']} ({request_class.name}): {reason}")
+            return await _shed_response(request_class)(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_class.release()
+
+# Create a singleton instance
+_scheduler = None
+
+def get_scheduler() -> Scheduler:
+    """Get the scheduler singleton instance"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
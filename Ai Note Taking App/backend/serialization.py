@@ -0,0 +1,34 @@
+import json
+import logging
+from typing import Any
+
+from fastapi.responses import JSONResponse, Response
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# orjson is optional - fall back to the standard library encoder if it is missing
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+except ImportError:
+    orjson = None
+    ORJSONResponse = None
+    logger.warning("orjson not installed, falling back to the standard json encoder")
+
+# Response class used by default for every route
+DefaultJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+def dumps(obj: Any) -> bytes:
+    """Serialize an object to JSON bytes using the fastest available encoder"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class RawJSONResponse(Response):
+    """Response for payloads that were already serialized to JSON bytes.
+
+    Skips response_model validation and jsonable_encoder entirely, so it should
+    only be used for trusted internal data such as rows read from the database.
+    """
+    media_type = "application/json"
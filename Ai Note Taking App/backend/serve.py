@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Production server: preload the app once, then fork worker processes.
+
+The master imports the app, initializes the database and warms up the heavy
+modules (PDF, OCR, NLTK data) before forking, so every worker shares those
+pages copy-on-write instead of loading its own copy. Workers share one
+listening socket; crashed workers are replaced, SIGHUP re-executes the master
+so new code is loaded while the old workers keep serving, and SIGTERM/SIGINT
+drains them gracefully.
+
+Usage:
+    python serve.py --workers 4 --port 8001
+    python app.py --workers 4
+    python app.py --reload          # development, single process with auto-reload
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = os.getenv("API_HOST", "0.0.0.0")
+DEFAULT_PORT = int(os.getenv("API_PORT", "8001"))
+DEFAULT_WORKERS = int(os.getenv("API_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+
+# Seconds a worker gets to finish in-flight requests before it is killed
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+# Passed from a master to the one it re-executes into on reload
+_LISTEN_FD_ENV = "SERVE_LISTEN_FD"
+_OLD_WORKERS_ENV = "SERVE_OLD_WORKERS"
+
+class PreforkServer:
+    """Master process that preloads the app and supervises forked uvicorn workers"""
+
+    def __init__(self, app, host: str, port: int, workers: int, log_level: str = "info"):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.log_level = log_level
+        self.workers: Dict[int, float] = {}
+        self._retiring: Set[int] = set()
+        self.sock: Optional[socket.socket] = None
+        self._stopping = False
+        self._reload = False
+
+    def _bind(self) -> socket.socket:
+        inherited = os.environ.pop(_LISTEN_FD_ENV, None)
+        if inherited is not None:
+            # Reloaded master: keep accepting on the socket the old workers are still using
+            sock = socket.socket(fileno=int(inherited))
+            sock.set_inheritable(True)
+            return sock
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _preload(self, reloading: bool = False):
+        """Load everything workers should share before forking"""
+        import metrics
+        from ai_service import get_ai_service
+        from database import init_db, prune_tombstones
+        from lazy import warm_up
+
+        # On reload the old workers' metrics are kept, they are still serving
+        if not reloading:
+            metrics.reset_multiproc_dir()
+        init_db()
+        prune_tombstones()
+        warm_up()
+        get_ai_service()
+
+        # Move preloaded objects out of the collector's view so reference count
+        # updates in workers do not trigger collections that touch shared pages
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            logger.info(f"Started worker {pid}")
+            return pid
+
+        # Worker process: uvicorn installs its own signal handlers
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            import uvicorn
+            config = uvicorn.Config(self.app, log_level=self.log_level)
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except Exception as e:
+            logger.error(f"Worker {os.getpid()} crashed: {str(e)}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _reap(self) -> List[int]:
+        """Collect exited workers without blocking"""
+        exited = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if self.workers.pop(pid, None) is not None:
+                exited.append(pid)
+                if pid in self._retiring:
+                    self._retiring.discard(pid)
+                    logger.info(f"Worker {pid} stopped")
+                else:
+                    logger.warning(f"Worker {pid} exited unexpectedly with code {os.waitstatus_to_exitcode(status)}")
+        return exited
+
+    def _reexec(self):
+        """Replace the master with a fresh one running the current code; it keeps the socket and pid,
+        forks its own workers and then drains these"""
+        # A master that fails to import would leave the workers without a supervisor
+        check = subprocess.run([sys.executable, "-c", "import app"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if check.returncode != 0:
+            logger.error(f"Not reloading, the app fails to import:\n{check.stderr.strip()[-2000:]}")
+            return
+        logger.info("Reloading: re-executing the master with the current code")
+        os.environ[_LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[_OLD_WORKERS_ENV] = ",".join(str(pid) for pid in self.workers)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def _retire_old_workers(self, pids: List[int]):
+        """Drain the workers of the master this one replaced, once its own workers are up"""
+        # Give the new workers time to run their lifespan startup
+        time.sleep(1)
+        for pid in pids:
+            # Still children of this process: exec keeps the pid
+            self.workers[pid] = 0.0
+            self._signal(pid, signal.SIGTERM)
+
+    def _signal(self, pid: int, sig: int):
+        self._retiring.add(pid)
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+            self._retiring.discard(pid)
+
+    def _shutdown(self):
+        logger.info(f"Stopping {len(self.workers)} workers")
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.time() + GRACEFUL_TIMEOUT
+        while self.workers and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            logger.warning(f"Worker {pid} did not stop in time, killing it")
+            self._signal(pid, signal.SIGKILL)
+        self._reap()
+
+    def run(self):
+        old_workers = [int(pid) for pid in os.environ.pop(_OLD_WORKERS_ENV, "").split(",") if pid]
+        self.sock = self._bind()
+        logger.info(f"Listening on {self.host}:{self.port} with {self.num_workers} workers")
+        self._preload(reloading=bool(old_workers))
+
+        def stop(signum, frame):
+            self._stopping = True
+
+        def reload(signum, frame):
+            self._reload = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, reload)
+
+        for _ in range(self.num_workers):
+            self.spawn()
+        if old_workers:
+            self._retire_old_workers(old_workers)
+
+        while not self._stopping:
+            self._reap()
+            if self._reload:
+                self._reload = False
+                self._reexec()
+            # Replace crashed workers
+            while not self._stopping and len(self.workers) - len(self._retiring) < self.num_workers:
+                self.spawn()
+            time.sleep(0.5)
+
+        self._shutdown()
+        self.sock.close()
+
+def run(app, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = DEFAULT_WORKERS,
+        log_level: str = "info"):
+    """Serve the app with the given number of worker processes"""
+    import uvicorn
+
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, log_level=log_level)
+    elif not hasattr(os, "fork"):
+        # No fork on Windows: uvicorn spawns workers that each import the app
+        uvicorn.run("app:app", host=host, port=port, workers=workers, log_level=log_level)
+    else:
+        PreforkServer(app, host, port, workers, log_level).run()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the note taking API")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Worker processes (defaults to API_WORKERS or WEB_CONCURRENCY)")
+    parser.add_argument("--reload", action="store_true", help="Single process with auto-reload for development")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None, app=None):
+    args = parse_args(argv)
+    # Read by the app's modules when they are imported below, e.g. write-behind needs a single worker
+    os.environ["API_WORKERS"] = "1" if args.reload else str(args.workers)
+    if args.reload:
+        import uvicorn
+        uvicorn.run("app:app", host=args.host, port=args.port, reload=True, log_level=args.log_level)
+        return
+    if app is None:
+        from app import app
+    run(app, args.host, args.port, args.workers, args.log_level)
+
+if __name__ == "__main__":
+    main()
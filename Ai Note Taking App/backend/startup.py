@@ -0,0 +1,43 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Reference point for every startup timing: when this module was first imported
+_process_start = time.perf_counter()
+_last_mark = _process_start
+_phases: List[Dict[str, Any]] = []
+_lock = threading.Lock()
+
+def record(name: str, seconds: float):
+    """Record the duration of a startup phase"""
+    with _lock:
+        _phases.append({"phase": name, "ms": round(seconds * 1000, 3),
+                        "at_ms": round((time.perf_counter() - _process_start) * 1000, 3)})
+    logger.info(f"Startup phase '{name}' took {seconds * 1000:.1f} ms")
+
+def mark(name: str):
+    """Record the time since the previous mark as a phase"""
+    global _last_mark
+    now = time.perf_counter()
+    with _lock:
+        elapsed, _last_mark = now - _last_mark, now
+    record(name, elapsed)
+
+@contextmanager
+def phase(name: str):
+    """Time a block as a startup phase"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def report() -> Dict[str, Any]:
+    """All recorded phases in order"""
+    with _lock:
+        return {"phases": list(_phases)}
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from database import get_change_cursor, get_changes_since
+from serialization import dumps
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# How often waiting clients re-check the database for writes made by other workers
+POLL_INTERVAL = 1.0
+
+# Upper bound for a single long-poll request
+MAX_WAIT = 60.0
+
+# Interval between SSE keep-alive comments
+HEARTBEAT_INTERVAL = 15.0
+
+class ChangeNotifier:
+    """Wakes up long-poll and SSE clients when this worker writes a note"""
+
+    def __init__(self):
+        self._event: Optional[asyncio.Event] = None
+
+    def _current_event(self) -> asyncio.Event:
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def notify(self):
+        """Signal every waiting client and arm a fresh event for the next write"""
+        event = self._current_event()
+        self._event = asyncio.Event()
+        event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for a local write; returns False when the timeout expires first"""
+        try:
+            await asyncio.wait_for(self._current_event().wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+change_notifier = ChangeNotifier()
+
+async def wait_for_change(since: int, timeout: float) -> int:
+    """Block until the change cursor moves past `since` or the timeout expires.
+
+    Local writes wake the waiter immediately; writes made by other workers are
+    picked up by polling the cursor every POLL_INTERVAL seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # The cursor is read off the event loop: every waiting client polls it once per interval
+    cursor = await run_in_threadpool(get_change_cursor)
+    while cursor <= since:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        await change_notifier.wait(min(POLL_INTERVAL, remaining))
+        cursor = await run_in_threadpool(get_change_cursor)
+    return cursor
+
+async def fetch_changes(since: int, wait: float = 0) -> Optional[Dict[str, Any]]:
+    """Return the changes after `since`, optionally long-polling until there are some"""
+    if wait > 0:
+        await wait_for_change(since, min(wait, MAX_WAIT))
+    return await run_in_threadpool(get_changes_since, since)
+
+def format_sse(changes: Dict[str, Any]) -> bytes:
+    """Format a change set as a server-sent event"""
+    return b"id: %d\nevent: changes\ndata: %s\n\n" % (changes["cursor"], dumps(changes))
+
+async def stream_changes(request, since: int) -> AsyncIterator[bytes]:
+    """Yield server-sent events for every change after `since` until the client disconnects"""
+    while not await request.is_disconnected():
+        cursor = await wait_for_change(since, HEARTBEAT_INTERVAL)
+        if cursor <= since:
+            yield b": keep-alive\n\n"
+            continue
+
+        changes = await run_in_threadpool(get_changes_since, since)
+        if changes is None:
+            logger.error("Failed to read changes for SSE client")
+            return
+        yield format_sse(changes)
+        since = changes["cursor"]
@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from werkzeug.utils import secure_filename
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Directory for uploaded files while they are processed
+TEMP_DIR = Path(__file__).parent / os.getenv("TEMP_DIR", "temp")
+
+# How long an upload is kept after processing, how often expired files are swept,
+# and the disk space uploads may use before the oldest are evicted early
+TEMP_FILE_TTL = float(os.getenv("TEMP_FILE_TTL", "600"))
+TEMP_SWEEP_INTERVAL = float(os.getenv("TEMP_SWEEP_INTERVAL", "30"))
+TEMP_QUOTA_BYTES = int(os.getenv("TEMP_QUOTA_MB", "512")) * 1024 * 1024
+
+# Files in the temp directory that are not uploads
+_KEEP = {".gitkeep"}
+
+class TempStorage:
+    """Upload files with unique paths, deleted by one sweeper in expiry order or earlier to stay under the
+    quota; files a request is still reading are never deleted by either"""
+
+    def __init__(self, root: Path = TEMP_DIR, ttl: float = TEMP_FILE_TTL, quota_bytes: int = TEMP_QUOTA_BYTES):
+        self.root = root
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        # Min-heap of (expiry, path); entries superseded by a later register() are skipped when popped
+        self._heap: List[Tuple[float, str]] = []
+        self._entries: Dict[str, Tuple[float, int]] = {}
+        self._total = 0
+        # Requests reading each file, see in_use()
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def new_path(self, filename: str) -> Path:
+        """A path no other upload uses, keeping the sanitized original name for readability"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root / f"{uuid.uuid4().hex}_{secure_filename(filename) or 'upload'}"
+
+    def register(self, path: Path, ttl: Optional[float] = None):
+        """Schedule a file for deletion after ttl seconds, evicting the soonest-expiring files if over quota"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return
+        key = str(path)
+        with self._lock:
+            previous = self._entries.get(key)
+            self._total += size - (previous[1] if previous else 0)
+            self._entries[key] = (expires_at, size)
+            heapq.heappush(self._heap, (expires_at, key))
+            evicted = self._pop_over_quota(keep=key)
+        for victim in evicted:
+            logger.warning(f"Temp storage over quota, deleting {victim} early")
+            self._unlink(victim)
+
+    @contextmanager
+    def in_use(self, path: Path):
+        """Keep a file from being swept or evicted while a request extracts it"""
+        key = str(path)
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    def discard(self, path: Path):
+        """Delete a file now (e.g. after a failed extraction)"""
+        key = str(path)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total -= entry[1]
+        self._unlink(key)
+
+    def sweep(self) -> int:
+        """Delete every file whose expiry has passed; returns how many were deleted"""
+        now = time.time()
+        expired = []
+        with self._lock:
+            busy = []
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, key = heapq.heappop(self._heap)
+                if not self._is_current(key, expires_at):
+                    continue
+                if key in self._pins:
+                    # Still being extracted: look again on the next sweep
+                    busy.append((expires_at, key))
+                    continue
+                self._total -= self._entries.pop(key)[1]
+                expired.append(key)
+            for entry in busy:
+                heapq.heappush(self._heap, entry)
+        for key in expired:
+            self._unlink(key)
+        if expired:
+            logger.info(f"Deleted {len(expired)} expired temporary files")
+        return len(expired)
+
+    def _is_current(self, key: str, expires_at: float) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] == expires_at
+
+    def _pop_over_quota(self, keep: str) -> List[str]:
+        evicted = []
+        kept = []
+        while self._total > self.quota_bytes and self._heap:
+            expires_at, key = heapq.heappop(self._heap)
+            if not self._is_current(key, expires_at):
+                continue
+            if key == keep or key in self._pins:
+                kept.append((expires_at, key))
+                continue
+            self._total -= self._entries.pop(key)[1]
+            evicted.append(key)
+        for entry in kept:
+            heapq.heappush(self._heap, entry)
+        if self._total > self.quota_bytes:
+            logger.warning(f"Temp storage stays over quota ({self._total} bytes): the remaining files are in use")
+        return evicted
+
+    def _unlink(self, key: str):
+        try:
+            os.unlink(key)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error deleting temporary file {key}: {str(e)}")
+
+    def cleanup_orphans(self) -> int:
+        """At startup: delete uploads left over from earlier runs and schedule the recent ones"""
+        if not self.root.exists():
+            return 0
+        now = time.time()
+        removed = 0
+        for path in self.root.iterdir():
+            if path.name in _KEEP or not path.is_file():
+                continue
+            try:
+                age = now - path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            # Recent files may belong to another worker that is still processing them
+            if age >= self.ttl:
+                self._unlink(str(path))
+                removed += 1
+            else:
+                self.register(path, ttl=self.ttl - age)
+        if removed:
+            logger.info(f"Removed {removed} orphaned temporary files")
+        return removed
+
+    async def run_janitor(self, interval: float = TEMP_SWEEP_INTERVAL,
+                          on_sweep: Optional[Callable[[], Any]] = None):
+        """Background task: sweep expired files, then run on_sweep in a thread, until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Temp file sweep failed: {str(e)}")
+            if on_sweep is not None:
+                try:
+                    await run_in_threadpool(on_sweep)
+                except Exception as e:
+                    logger.error(f"Janitor task failed: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._total}
+
+# Create a singleton instance
+_temp_storage = None
+
+def get_temp_storage() -> TempStorage:
+    """Get the temp storage singleton instance"""
+    global _temp_storage
+    if _temp_storage is None:
+        _temp_storage = TempStorage()
+    return _temp_storage
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Tests of the shared cache backends and namespaces, run against the memory and
+SQLite backends and the redis backend talking to the fake server
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from benchmarks.fake_redis import fake_redis_url, start_fake_redis
+import deadline
+from cache import CACHE_KEY_PREFIX, MemoryCache, Namespace, RedisCache, SQLiteCache
+
+@pytest.fixture(scope="module")
+def redis_server():
+    server = start_fake_redis(password="secret")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCache()
+    if request.param == "sqlite":
+        return SQLiteCache(tmp_path / "cache.db")
+    server = request.getfixturevalue("redis_server")
+    with server.lock:
+        server.databases.clear()
+    return RedisCache(fake_redis_url(server, db=1))
+
+def test_get_set_delete(backend):
+    assert backend.get("a") is None
+    backend.set("a", b"1", 60)
+    assert backend.get("a") == b"1"
+    backend.set("a", b"2", 60)
+    assert backend.get("a") == b"2"
+    backend.delete("a")
+    assert backend.get("a") is None
+
+def test_ttl_expiry(backend):
+    backend.set("short", b"x", 0.05)
+    backend.set("long", b"y", 60)
+    time.sleep(0.1)
+    assert backend.get("short") is None
+    assert backend.get("long") == b"y"
+
+def test_purge_expired(backend):
+    backend.set("short", b"x", 0.05)
+    backend.set("long", b"y", 60)
+    time.sleep(0.1)
+    # The redis server expires keys itself and purges nothing
+    expected = 0 if isinstance(backend, RedisCache) else 1
+    assert backend.purge_expired() == expected
+    assert backend.get("long") == b"y"
+
+def test_add_only_when_missing(backend):
+    assert backend.add("lock", b"first", 60)
+    assert not backend.add("lock", b"second", 60)
+    assert backend.get("lock") == b"first"
+
+def test_add_replaces_expired_value(backend):
+    assert backend.add("lock", b"first", 0.05)
+    time.sleep(0.1)
+    assert backend.add("lock", b"second", 60)
+    assert backend.get("lock") == b"second"
+
+def test_delete_if_checks_value(backend):
+    backend.set("lock", b"mine", 60)
+    assert not backend.delete_if("lock", b"theirs")
+    assert backend.get("lock") == b"mine"
+    assert backend.delete_if("lock", b"mine")
+    assert backend.get("lock") is None
+    assert not backend.delete_if("lock", b"mine")
+
+def test_namespaces_do_not_collide(backend):
+    notes = Namespace(backend, "notes")
+    quizzes = Namespace(backend, "quizzes")
+    notes.set("1", b"note")
+    quizzes.set("1", b"quiz")
+    assert notes.get("1") == b"note"
+    assert quizzes.get("1") == b"quiz"
+    assert backend.get(f"{CACHE_KEY_PREFIX}:notes:1") == b"note"
+    notes.delete("1")
+    assert notes.get("1") is None
+    assert quizzes.get("1") == b"quiz"
+
+def test_namespace_default_ttl(backend):
+    namespace = Namespace(backend, "short", ttl=0.05)
+    namespace.set("a", b"x")
+    namespace.set("b", b"y", ttl=60)
+    time.sleep(0.1)
+    assert namespace.get("a") is None
+    assert namespace.get("b") == b"y"
+
+def test_get_or_compute_caches_result(backend):
+    namespace = Namespace(backend, "compute")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return b"value"
+
+    assert namespace.get_or_compute("k", compute) == b"value"
+    assert namespace.get_or_compute("k", compute) == b"value"
+    assert len(calls) == 1
+
+def test_get_or_compute_does_not_cache_none(backend):
+    namespace = Namespace(backend, "compute")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return None
+
+    assert namespace.get_or_compute("k", compute) is None
+    assert namespace.get_or_compute("k", compute) is None
+    assert len(calls) == 2
+    assert backend.get(namespace.key("k") + ":lock") is None
+
+def test_get_or_compute_single_flight(backend):
+    # Two namespaces on one backend stand in for two workers: their threads miss together
+    workers = [Namespace(backend, "flight"), Namespace(backend, "flight")]
+    calls = []
+    calls_lock = threading.Lock()
+    results = []
+    barrier = threading.Barrier(8)
+
+    def compute():
+        with calls_lock:
+            calls.append(1)
+        time.sleep(0.3)
+        return b"value"
+
+    def run(namespace):
+        barrier.wait()
+        results.append(namespace.get_or_compute("k", compute))
+
+    threads = [threading.Thread(target=run, args=(workers[i % 2],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [b"value"] * 8
+    assert len(calls) == 1
+
+def test_expired_lock_holder_keeps_new_lock(backend, monkeypatch):
+    monkeypatch.setattr("cache.CACHE_LOCK_TTL", 0.05)
+    namespace = Namespace(backend, "slow")
+    lock_key = namespace.key("k") + ":lock"
+
+    def compute():
+        # The lock expires while computing and another worker takes it
+        time.sleep(0.1)
+        assert backend.add(lock_key, b"other", 60)
+        return b"value"
+
+    assert namespace.get_or_compute("k", compute) == b"value"
+    assert backend.get(lock_key) == b"other"
+
+def test_single_flight_wait_ends_at_the_deadline(backend):
+    namespace = Namespace(backend, "stuck")
+    started = threading.Event()
+    release = threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait(5)
+        return b"late"
+
+    holder = threading.Thread(target=namespace.get_or_compute, args=("k", stuck))
+    holder.start()
+    started.wait(5)
+    try:
+        # A thread of the same worker stops queueing behind the stuck one and computes itself
+        start = time.monotonic()
+        with deadline.budget(0.2):
+            assert namespace.get_or_compute("k", lambda: b"mine") == b"mine"
+        assert time.monotonic() - start < 2
+    finally:
+        release.set()
+        holder.join()
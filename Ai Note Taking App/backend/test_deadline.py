@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests of request time budgets: AI and CRUD routes get REQUEST_TIMEOUT, file
+ingestion gets the much larger INGESTION_TIMEOUT, and what ran out of it is reported
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import deadline
+from pdf_extraction import PDFExtraction, PDFPage
+
+def test_request_budget():
+    assert deadline.request_budget({}) == deadline.REQUEST_TIMEOUT
+    assert deadline.request_budget({}, ingestion=True) == deadline.INGESTION_TIMEOUT
+    assert deadline.request_budget({deadline.DEADLINE_HEADER: "5"}, ingestion=True) == 5
+    assert deadline.request_budget({deadline.DEADLINE_HEADER: "1e9"}) == deadline.REQUEST_TIMEOUT
+    assert deadline.request_budget({deadline.DEADLINE_HEADER: "soon"}) == deadline.REQUEST_TIMEOUT
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import app
+    from cache import MemoryCache, Namespace
+    from temp_storage import TempStorage
+    from upload_store import UploadStore
+
+    temp_storage = TempStorage(tmp_path / "temp")
+    upload_store = UploadStore(tmp_path / "upload_store")
+    upload_store.results = Namespace(MemoryCache(), "extraction")
+    monkeypatch.setattr(app, "get_temp_storage", lambda: temp_storage)
+    monkeypatch.setattr(app, "get_upload_store", lambda: upload_store)
+    # An extraction takes several times the budget of an AI request
+    monkeypatch.setattr(deadline, "REQUEST_TIMEOUT", 0.1)
+    return TestClient(app.app)
+
+def test_slow_extraction_keeps_its_budget(client, monkeypatch):
+    import app
+
+    seen = {}
+
+    def slow_extract(path, endpoint):
+        time.sleep(0.3)
+        seen["remaining"] = deadline.remaining()
+        return PDFExtraction([PDFPage(0, "image", "scanned text")])
+
+    monkeypatch.setattr(app, "extract_pdf", slow_extract)
+    response = client.post("/api/upload-pdf", files={"file": ("scan.pdf", b"%PDF-1.4 stub", "application/pdf")})
+    assert response.status_code == 200
+    assert response.json()["text"] == "scanned text"
+    assert seen["remaining"] > 1
+
+def test_pages_left_without_ocr_are_reported(client, monkeypatch):
+    import app
+
+    def extract_out_of_time(path, endpoint):
+        skipped = PDFPage(1, "image", "")
+        skipped.ocr_skipped = True
+        return PDFExtraction([PDFPage(0, "text", "first page"), skipped])
+
+    monkeypatch.setattr(app, "extract_pdf", extract_out_of_time)
+    response = client.post("/api/upload-pdf", files={"file": ("scan.pdf", b"%PDF-1.4 stub", "application/pdf")})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["truncated"], body["pages_extracted"], body["total_pages"]) == (True, 1, 2)
+    assert body["text"] == "first page"
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Tests of the per-worker note cache: invalidation from the change sequence, the
+generation check that keeps stale reads out, and the database read path around it
+"""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import database
+from note_cache import NoteCache, note_size
+
+def note(note_id, change_seq, title="Title"):
+    return {"id": note_id, "title": title, "content": "content", "change_seq": change_seq}
+
+def test_apply_changes_drops_notes_changed_elsewhere():
+    cache = NoteCache(1024 * 1024)
+    cache.fill(note(1, 5), cache.generation())
+    cache.fill(note(2, 5), cache.generation())
+    cache.apply_changes(7, [(1, 7)], [])
+    assert cache.get(1) is None
+    assert cache.get(2) is not None
+    assert cache.seen_seq == 7
+
+def test_apply_changes_keeps_own_write_through():
+    cache = NoteCache(1024 * 1024)
+    # This worker saved change 7 and cached it; the change feed then reports it
+    cache.put(note(1, 7, "mine"))
+    cache.apply_changes(7, [(1, 7)], [])
+    assert cache.get(1)["title"] == "mine"
+
+def test_apply_changes_drops_deleted_notes():
+    cache = NoteCache(1024 * 1024)
+    cache.put(note(1, 3))
+    cache.apply_changes(4, [], [1])
+    assert cache.get(1) is None
+
+def test_seen_seq_never_moves_back():
+    cache = NoteCache(1024 * 1024)
+    cache.apply_changes(9, [], [])
+    cache.apply_changes(4, [], [])
+    assert cache.seen_seq == 9
+
+def test_fill_after_invalidation_is_ignored():
+    cache = NoteCache(1024 * 1024)
+    # A read starts, a write to the note lands, then the read tries to cache its stale row
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.fill(note(1, 1, "stale"), generation)
+    assert cache.get(1) is None
+
+def test_fill_after_remote_changes_is_ignored():
+    cache = NoteCache(1024 * 1024)
+    generation = cache.generation()
+    cache.apply_changes(2, [(1, 2)], [])
+    cache.fill(note(1, 1, "stale"), generation)
+    assert cache.get(1) is None
+
+def test_older_row_does_not_replace_newer_one():
+    cache = NoteCache(1024 * 1024)
+    cache.put(note(1, 5, "new"))
+    cache.fill(note(1, 4, "old"), cache.generation())
+    assert cache.get(1)["title"] == "new"
+
+def test_get_returns_a_copy():
+    cache = NoteCache(1024 * 1024)
+    cache.put(note(1, 1))
+    cache.get(1)["title"] = "mutated"
+    assert cache.get(1)["title"] == "Title"
+
+def test_least_recently_used_dropped_past_max_bytes():
+    size = note_size(note(1, 1))
+    cache = NoteCache(size * 2 + size // 2)
+    cache.put(note(1, 1))
+    cache.put(note(2, 1))
+    cache.get(1)
+    cache.put(note(3, 1))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.get(3) is not None
+    assert cache.bytes <= cache.max_bytes
+
+def test_clear_resets_seen_seq():
+    cache = NoteCache(1024 * 1024)
+    cache.put(note(1, 1))
+    cache.clear(12)
+    assert cache.get(1) is None
+    assert cache.stats()["entries"] == 0
+    assert cache.seen_seq == 12
+
+@pytest.fixture
+def notes_db(tmp_path, monkeypatch):
+    cache = NoteCache(1024 * 1024)
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "notes.db")
+    monkeypatch.setattr(database, "get_note_cache", lambda: cache)
+    database.init_db()
+    return cache
+
+def _remote_update(note_id, title):
+    """Change a note the way another worker process would"""
+    conn = sqlite3.connect(str(database.DB_PATH))
+    cursor = conn.cursor()
+    seq = database.next_change_seq(cursor)
+    cursor.execute("UPDATE notes SET title = ?, change_seq = ? WHERE id = ?", (title, seq, note_id))
+    conn.commit()
+    conn.close()
+
+def test_get_note_sees_other_workers_changes(notes_db):
+    note_id = database.save_note("Local", "content")
+    assert database.get_note_by_id(note_id)["title"] == "Local"
+    _remote_update(note_id, "Remote")
+    assert database.get_note_by_id(note_id)["title"] == "Remote"
+
+def test_get_note_sees_own_updates(notes_db):
+    note_id = database.save_note("Before", "content")
+    database.get_note_by_id(note_id)
+    database.update_note(note_id, {"title": "After"})
+    assert database.get_note_by_id(note_id)["title"] == "After"
+    database.delete_note(note_id)
+    assert database.get_note_by_id(note_id) is None
+
+def test_cached_read_failure_falls_back_to_database(notes_db, monkeypatch):
+    note_id = database.save_note("Title", "content")
+
+    def broken_sync(cache, conn):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(database, "_sync_note_cache", broken_sync)
+    assert database.get_note_by_id(note_id)["title"] == "Title"
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests of the temp upload storage: quota eviction and expiry sweeps skip files
+a request is still extracting from
+"""
+
+import sys
+from pathlib import Path
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from temp_storage import TempStorage
+
+def upload(storage, size):
+    path = storage.new_path("scan.pdf")
+    path.write_bytes(b"x" * size)
+    return path
+
+def test_quota_evicts_soonest_expiring(tmp_path):
+    storage = TempStorage(tmp_path, quota_bytes=250)
+    first = upload(storage, 100)
+    storage.register(first, ttl=10)
+    second = upload(storage, 100)
+    storage.register(second, ttl=20)
+    third = upload(storage, 100)
+    storage.register(third, ttl=30)
+    assert not first.exists()
+    assert second.exists() and third.exists()
+
+def test_quota_skips_files_in_use(tmp_path):
+    storage = TempStorage(tmp_path, quota_bytes=250)
+    busy = upload(storage, 100)
+    idle = upload(storage, 100)
+    with storage.in_use(busy):
+        storage.register(busy, ttl=10)
+        storage.register(idle, ttl=20)
+        latest = upload(storage, 100)
+        storage.register(latest, ttl=30)
+        assert busy.exists()
+        assert not idle.exists()
+
+def test_sweep_waits_for_files_in_use(tmp_path):
+    storage = TempStorage(tmp_path)
+    path = upload(storage, 10)
+    with storage.in_use(path):
+        storage.register(path, ttl=0)
+        storage.sweep()
+        assert path.exists()
+    storage.sweep()
+    assert not path.exists()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Tests of note patching: edits and unified diffs applied to text, and the
+PATCH /api/notes/{id} endpoint with its version check
+"""
+
+import difflib
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import database
+from text_patch import PatchError, apply_edits, apply_unified_diff
+
+def unified_diff(old: str, new: str) -> str:
+    """A diff as `diff -u` writes it, including the no-newline markers difflib leaves out"""
+    lines = []
+    for line in difflib.unified_diff(old.splitlines(True), new.splitlines(True), "a", "b"):
+        lines.append(line)
+        if not line.endswith("\n"):
+            lines.append("\n\\ No newline at end of file\n")
+    return "".join(lines)
+
+def test_apply_edits():
+    assert apply_edits("hello world", [(0, 5, "goodbye"), (11, 0, "!")]) == "goodbye world!"
+    assert apply_edits("abc", []) == "abc"
+
+def test_apply_edits_offsets_are_code_points():
+    # "é" and the emoji are one code point each, but several UTF-8 bytes and UTF-16 units
+    assert apply_edits("é😀x", [(2, 1, "y")]) == "é😀y"
+    assert apply_edits("😀😀", [(1, 0, "-")]) == "😀-😀"
+
+def test_apply_edits_rejects_overlap():
+    with pytest.raises(PatchError):
+        apply_edits("hello world", [(0, 5, "a"), (3, 1, "b")])
+    with pytest.raises(PatchError):
+        apply_edits("hello world", [(6, 1, "a"), (0, 1, "b")])
+
+def test_apply_edits_rejects_out_of_range():
+    with pytest.raises(PatchError):
+        apply_edits("abc", [(2, 2, "")])
+    with pytest.raises(PatchError):
+        apply_edits("abc", [(4, 0, "x")])
+
+def test_unified_diff_round_trip():
+    old = "one\ntwo\nthree\nfour\nfive\nsix\nseven\neight\nnine\nten\n"
+    new = "zero\none\ntwo\nTHREE\nfour\nfive\nsix\nseven\nnine\nten\neleven\n"
+    assert apply_unified_diff(old, unified_diff(old, new)) == new
+
+def test_unified_diff_random_round_trips():
+    rng = random.Random(7)
+    words = ["alpha", "beta", "gamma", "", "delta  ", "é😀"]
+    for _ in range(300):
+        old_lines = [rng.choice(words) for _ in range(rng.randint(0, 12))]
+        new_lines = list(old_lines)
+        for _ in range(rng.randint(1, 4)):
+            position = rng.randint(0, len(new_lines))
+            if new_lines and rng.random() < 0.5:
+                del new_lines[min(position, len(new_lines) - 1)]
+            else:
+                new_lines.insert(position, rng.choice(words))
+        old = "\n".join(old_lines) + rng.choice(["", "\n"])
+        new = "\n".join(new_lines) + rng.choice(["", "\n"])
+        if old == new:
+            continue
+        assert apply_unified_diff(old, unified_diff(old, new)) == new
+
+def test_unified_diff_no_newline_at_end():
+    assert apply_unified_diff("a\nb\n", unified_diff("a\nb\n", "a\nc")) == "a\nc"
+    assert apply_unified_diff("a\nb", unified_diff("a\nb", "a\nb\n")) == "a\nb\n"
+
+def test_unified_diff_rejects_wrong_context():
+    diff = unified_diff("a\nb\nc\n", "a\nB\nc\n")
+    with pytest.raises(PatchError):
+        apply_unified_diff("a\nx\nc\n", diff)
+    with pytest.raises(PatchError):
+        apply_unified_diff("", diff)
+
+def test_unified_diff_rejects_malformed_diffs():
+    with pytest.raises(PatchError):
+        apply_unified_diff("a\n", "not a diff\n")
+    with pytest.raises(PatchError):
+        apply_unified_diff("a\n", "--- a\n+++ b\n")
+    # The header promises more lines than the hunk has
+    with pytest.raises(PatchError):
+        apply_unified_diff("a\nb\n", "@@ -1,2 +1,2 @@\n-a\n+A\n")
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import app
+    from note_cache import NoteCache
+    from write_behind import WriteBehindBuffer
+
+    cache = NoteCache()
+    write_behind = WriteBehindBuffer(window=60)
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "notes.db")
+    monkeypatch.setattr(database, "get_note_cache", lambda: cache)
+    monkeypatch.setattr(app, "get_write_behind", lambda: write_behind)
+    database.init_db()
+    # Without the lifespan: no background tasks, and buffered updates stay pending until flushed
+    return TestClient(app.app)
+
+def create_note(client, content):
+    return client.post("/api/notes", json={"title": "Note", "content": content}).json()["id"]
+
+def test_patch_note(client):
+    note_id = create_note(client, "hello world")
+    response = client.patch(f"/api/notes/{note_id}",
+                            json={"base_version": 1, "ops": [{"offset": 0, "delete": 5, "insert": "goodbye"}]})
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    note = client.get(f"/api/notes/{note_id}").json()
+    assert (note["content"], note["version"]) == ("goodbye world", 2)
+
+    response = client.patch(f"/api/notes/{note_id}",
+                            json={"base_version": 2, "diff": unified_diff("goodbye world", "goodbye moon")})
+    assert response.status_code == 200
+    assert response.json()["version"] == 3
+    assert client.get(f"/api/notes/{note_id}").json()["content"] == "goodbye moon"
+
+def test_patch_note_stale_base_version(client):
+    note_id = create_note(client, "hello")
+    assert client.patch(f"/api/notes/{note_id}", json={"base_version": 1, "ops": []}).status_code == 200
+    response = client.patch(f"/api/notes/{note_id}",
+                            json={"base_version": 1, "ops": [{"offset": 0, "insert": "x"}]})
+    assert response.status_code == 409
+    assert response.json()["version"] == 2
+    assert client.get(f"/api/notes/{note_id}").json()["content"] == "hello"
+
+def test_patch_note_after_buffered_update(client):
+    note_id = create_note(client, "hello")
+    # Autosaves waiting in the write-behind buffer are shown at the version they will be written as
+    assert client.put(f"/api/notes/{note_id}", json={"content": "hello"}).status_code == 200
+    assert client.put(f"/api/notes/{note_id}", json={"content": "hello there"}).status_code == 200
+    note = client.get(f"/api/notes/{note_id}").json()
+    assert (note["content"], note["version"]) == ("hello there", 2)
+    response = client.patch(f"/api/notes/{note_id}",
+                            json={"base_version": 1, "ops": [{"offset": 0, "insert": "x"}]})
+    assert response.status_code == 409
+    assert response.json()["version"] == 2
+
+    response = client.patch(f"/api/notes/{note_id}",
+                            json={"base_version": note["version"], "ops": [{"offset": 11, "insert": "!"}]})
+    assert response.status_code == 200
+    assert response.json()["version"] == 3
+    # Written before answering, not buffered
+    stored = database.get_note_by_id(note_id)
+    assert (stored["content"], stored["version"]) == ("hello there!", 3)
+
+def test_patch_note_bad_diff(client):
+    note_id = create_note(client, "a\nb\n")
+    response = client.patch(f"/api/notes/{note_id}",
+                            json={"base_version": 1, "diff": unified_diff("a\nx\n", "a\ny\n")})
+    assert response.status_code == 422
+    response = client.patch(f"/api/notes/{note_id}",
+                            json={"base_version": 1, "ops": [{"offset": 10, "delete": 1}]})
+    assert response.status_code == 422
+    assert client.get(f"/api/notes/{note_id}").json()["version"] == 1
+
+def test_patch_missing_note(client):
+    assert client.patch("/api/notes/999", json={"base_version": 1, "ops": []}).status_code == 404
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests of the guard in front of the inference API: concurrent calls queue for a
+slot instead of falling back, against the stub inference server
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import deadline
+import upstream
+from ai_service import AIService
+from benchmarks.stub_inference import start_stub_server, stub_base_url
+from upstream import AIMDLimiter, UpstreamGuard, UpstreamUnavailable
+
+@pytest.fixture
+def stub_server():
+    server = start_stub_server(latency=0.3)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def guard(monkeypatch):
+    # A fresh worker: nothing measured yet
+    guard = UpstreamGuard()
+    monkeypatch.setattr(upstream, "_guard", guard)
+    return guard
+
+def test_limiter_waits_for_a_slot():
+    limiter = AIMDLimiter(1, 1, 1)
+    assert limiter.acquire()
+    assert not limiter.acquire(0.05)
+    threading.Timer(0.1, limiter.release).start()
+    start = time.monotonic()
+    assert limiter.acquire(2)
+    assert time.monotonic() - start < 1
+
+def test_guard_gives_up_at_the_deadline(guard, monkeypatch):
+    monkeypatch.setattr(guard, "limiter", AIMDLimiter(1, 1, 1))
+    guard.acquire("summarize")
+    with deadline.budget(0.1):
+        with pytest.raises(UpstreamUnavailable):
+            guard.acquire("summarize")
+
+@pytest.fixture(params=["default", "one_slot"])
+def limited_guard(request, guard, monkeypatch):
+    if request.param == "one_slot":
+        # After the upstream was overloaded: the calls queue behind each other
+        monkeypatch.setattr(guard, "limiter", AIMDLimiter(1, 1, 8))
+    return guard
+
+def test_concurrent_generators_reach_upstream(stub_server, limited_guard, monkeypatch):
+    guard = limited_guard
+    monkeypatch.setenv("HUGGINGFACE_API_KEY", "test")
+    monkeypatch.setenv("HUGGINGFACE_API_URL", stub_base_url(stub_server))
+    service = AIService()
+    # Like /api/notes/{id}/analyze: summary, quiz and mind map start together
+    results = {}
+
+    def run(task):
+        with deadline.budget(10):
+            results[task] = service._request_model(f"prompt for {task}", task)
+
+    threads = [threading.Thread(target=run, args=(task,)) for task in ("summarize", "quiz", "mindmap")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(results[task] is not None for task in ("summarize", "quiz", "mindmap")), results
+    assert guard.limiter.in_flight == 0
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests of the autosave write-behind buffer: reads on the same worker overlay
+buffered updates without flushing them, and updates of notes deleted meanwhile
+are dropped when flushed
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import database
+from note_cache import NoteCache
+from write_behind import WriteBehindBuffer
+
+@pytest.fixture
+def write_behind(tmp_path, monkeypatch):
+    cache = NoteCache()
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "notes.db")
+    monkeypatch.setattr(database, "get_note_cache", lambda: cache)
+    database.init_db()
+    return WriteBehindBuffer(window=60)
+
+@pytest.fixture
+def client(write_behind, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import app
+
+    monkeypatch.setattr(app, "get_write_behind", lambda: write_behind)
+    # Without the lifespan: buffered updates stay pending until flushed
+    return TestClient(app.app)
+
+def test_listing_and_changes_overlay_without_flushing(client, write_behind):
+    note_id = client.post("/api/notes", json={"title": "Note", "content": "hello"}).json()["id"]
+    assert client.put(f"/api/notes/{note_id}", json={"content": "hello there"}).status_code == 200
+
+    listed = client.get("/api/notes").json()["notes"]
+    assert [note["content"] for note in listed] == ["hello there"]
+    changes = client.get("/api/notes/changes", params={"since": 0}).json()
+    assert [note["content"] for note in changes["notes"]] == ["hello there"]
+    # Still buffered, so the next autosave is merged into it
+    assert write_behind.has_unwritten()
+    assert database.get_note_by_id(note_id)["content"] == "hello"
+
+def test_flush_drops_updates_of_deleted_notes(write_behind):
+    kept = database.save_note("Kept", "a")
+    deleted = database.save_note("Deleted", "b")
+    write_behind.update(kept, {"content": "a2"}, 1)
+    write_behind.update(deleted, {"content": "b2"}, 1)
+    # Deleted by another worker, which knows nothing of this buffer
+    database.delete_note(deleted)
+    assert write_behind.flush() == 1
+    assert not write_behind.has_unwritten()
+    assert database.get_note_by_id(kept)["content"] == "a2"
+    assert database.get_note_by_id(deleted) is None
+
+def test_overlay_shows_the_version_a_flush_writes(write_behind):
+    note_id = database.save_note("Note", "a")
+    write_behind.update(note_id, {"content": "b"}, 1)
+    write_behind.update(note_id, {"content": "c"}, 2)
+    assert write_behind.overlay(database.get_note_by_id(note_id))["version"] == 2
+    write_behind.flush()
+    assert database.get_note_by_id(note_id)["version"] == 2
+    write_behind.update(note_id, {"content": "d"}, 2)
+    assert write_behind.overlay(database.get_note_by_id(note_id))["version"] == 3
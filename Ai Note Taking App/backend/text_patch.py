@@ -0,0 +1,100 @@
+import re
+from typing import Iterable, List, Tuple
+
+# Hunk header of a unified diff: @@ -start[,count] +start[,count] @@
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+class PatchError(ValueError):
+    """An edit that does not fit the text it is applied to"""
+
+def apply_edits(text: str, edits: Iterable[Tuple[int, int, str]]) -> str:
+    """Apply (offset, delete, insert) edits; offsets are code points into the original text,
+    sorted and not overlapping"""
+    parts: List[str] = []
+    position = 0
+    for offset, delete, insert in edits:
+        if offset < position:
+            raise PatchError("Edits must be sorted by offset and must not overlap")
+        if offset + delete > len(text):
+            raise PatchError(f"Edit at offset {offset} goes past the end of the text ({len(text)} characters)")
+        parts.append(text[position:offset])
+        parts.append(insert)
+        position = offset + delete
+    parts.append(text[position:])
+    return "".join(parts)
+
+def _lines(text: str) -> List[str]:
+    """Lines with their endings, split on "\n" only like diff tools (str.splitlines also splits on
+    form feeds and Unicode separators)"""
+    parts = text.split("\n")
+    lines = [part + "\n" for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+def _diff_lines(diff: str) -> List[Tuple[str, str]]:
+    """(tag, line) pairs of a unified diff, with "\\ No newline at end of file" folded into the line before"""
+    lines: List[Tuple[str, str]] = []
+    for line in _lines(diff):
+        if line.startswith("\\"):
+            if lines:
+                tag, previous = lines[-1]
+                lines[-1] = (tag, previous[:-1] if previous.endswith("\n") else previous)
+            continue
+        if line in ("\n", "\r\n"):
+            # Editors strip the trailing space of empty context lines
+            lines.append((" ", line))
+        else:
+            lines.append((line[:1], line[1:]))
+    return lines
+
+def apply_unified_diff(text: str, diff: str) -> str:
+    """Apply a unified diff to text; context and removed lines must match exactly"""
+    lines = _lines(text)
+    diff_lines = _diff_lines(diff)
+    result: List[str] = []
+    position = 0
+    index = 0
+    hunks = 0
+    while index < len(diff_lines):
+        tag, line = diff_lines[index]
+        header = _HUNK_HEADER.match(tag + line)
+        if header is None:
+            if hunks == 0 and (tag + line).startswith(("---", "+++", "diff ", "index ")):
+                index += 1
+                continue
+            raise PatchError(f"Unexpected line {index + 1} in diff: expected a hunk header")
+        hunks += 1
+        old_start, old_count = int(header.group(1)), int(header.group(2) or 1)
+        new_count = int(header.group(4) or 1)
+        # An empty old range starts after the given line rather than at it
+        begin = old_start - 1 if old_count else old_start
+        if begin < position or begin > len(lines):
+            raise PatchError(f"Hunk {hunks} is out of order or past the end of the text")
+        result.extend(lines[position:begin])
+        position = begin
+
+        index += 1
+        old_seen = new_seen = 0
+        while index < len(diff_lines) and not (diff_lines[index][0] == "@" and diff_lines[index][1].startswith("@ ")):
+            tag, line = diff_lines[index]
+            if tag in (" ", "-"):
+                if position >= len(lines) or lines[position] != line:
+                    raise PatchError(f"Hunk {hunks} does not match line {position + 1} of the text")
+                if tag == " ":
+                    result.append(line)
+                    new_seen += 1
+                position += 1
+                old_seen += 1
+            elif tag == "+":
+                result.append(line)
+                new_seen += 1
+            else:
+                raise PatchError(f"Unexpected line {index + 1} in diff")
+            index += 1
+        if (old_seen, new_seen) != (old_count, new_count):
+            raise PatchError(f"Hunk {hunks} has a different number of lines than its header")
+    if hunks == 0:
+        raise PatchError("Diff has no hunks")
+    result.extend(lines[position:])
+    return "".join(result)
@@ -0,0 +1,109 @@
+import logging
+import os
+import re
+import sys
+from typing import Callable, List, Optional
+
+from lazy import lazy_resource
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Sentence splitter: "regex" (default), "blingfire" (native, if installed) or "punkt" (NLTK data)
+TOKENIZER_BACKEND = os.getenv("TOKENIZER_BACKEND", "regex").lower()
+
+# Bundled NLTK data directory - resources are never downloaded at runtime
+nltk_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data')
+
+# Typographic punctuation from PDFs and word processors mapped to ASCII
+_PUNCTUATION = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"',
+    "\u2013": "-", "\u2014": "-", "\u2212": "-", "\u2026": "...",
+    "\u00a0": " ", "\u00ad": "", "\ufb01": "fi", "\ufb02": "fl",
+})
+
+# A sentence ends at . ! or ? (plus closing quotes/brackets) followed by whitespace and
+# something that can start a sentence; blank lines always end one
+_SENTENCE_BREAK = re.compile(r"""(?<=[.!?])["')\]]*\s+(?=["'(\[]?[A-Z0-9])|\n\s*\n""")
+
+# Words, keeping inner apostrophes and hyphens ("don't", "state-of-the-art")
+_WORD = re.compile(r"[^\W_]+(?:['\-][^\W_]+)*")
+
+# Tokens ending in a period that do not end a sentence
+_ABBREVIATIONS = frozenset(
+    "mr mrs ms dr prof sr jr st vs etc e.g i.e cf fig eq no vol pp al approx dept est inc ltd co".split())
+
+def normalize(text: str) -> str:
+    """Map typographic quotes, dashes and ligatures to plain ASCII punctuation"""
+    return text.translate(_PUNCTUATION)
+
+def _ends_with_abbreviation(chunk: str) -> bool:
+    if not chunk.endswith("."):
+        return False
+    last = chunk.rsplit(None, 1)[-1][:-1].lower()
+    # Single letters cover initials ("J. Smith") and dotted acronyms ("U.S.")
+    return last in _ABBREVIATIONS or all(len(part) == 1 for part in last.split("."))
+
+def regex_sentences(text: str) -> List[str]:
+    """Split text into sentences with a compiled regular expression"""
+    sentences: List[str] = []
+    for chunk in _SENTENCE_BREAK.split(normalize(text)):
+        chunk = " ".join(chunk.split())
+        if not chunk:
+            continue
+        if sentences and _ends_with_abbreviation(sentences[-1]):
+            sentences[-1] = f"{sentences[-1]} {chunk}"
+        else:
+            sentences.append(chunk)
+    return sentences
+
+def words(text: str) -> List[str]:
+    """Lowercased word tokens without punctuation, interned so repeated words share one string"""
+    intern = sys.intern
+    return [intern(token) for token in _WORD.findall(normalize(text).lower())]
+
+def sentence_words(sentence: str) -> List[str]:
+    """Like words(), for sentences returned by sentences() which are already normalized; not interned"""
+    return _WORD.findall(sentence.lower())
+
+def _load_blingfire() -> Optional[Callable[[str], List[str]]]:
+    """blingfire's native sentence breaker, if the package is installed"""
+    try:
+        from blingfire import text_to_sentences
+    except ImportError:
+        logger.info("blingfire is not installed, using the regex sentence splitter")
+        return None
+
+    def split(text: str) -> List[str]:
+        return [s for s in text_to_sentences(normalize(text)).split("\n") if s.strip()]
+    return split
+
+def _load_punkt() -> Optional[Callable[[str], List[str]]]:
+    """NLTK's punkt sentence tokenizer if its data is available locally"""
+    import nltk
+    if nltk_data_dir not in nltk.data.path:
+        nltk.data.path.append(nltk_data_dir)
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        logger.info("NLTK punkt data not found locally, using the regex sentence splitter")
+        return None
+    from nltk.tokenize import sent_tokenize
+    return lambda text: sent_tokenize(normalize(text))
+
+_BACKENDS = {"blingfire": _load_blingfire, "punkt": _load_punkt}
+
+# The optional backend is loaded on first use or during warm-up
+_backend = lazy_resource(f"tokenizer_{TOKENIZER_BACKEND}", _BACKENDS[TOKENIZER_BACKEND]) \
+    if TOKENIZER_BACKEND in _BACKENDS else None
+
+def sentences(text: str) -> List[str]:
+    """Split text into sentences with the configured backend, falling back to the regex splitter"""
+    split = _backend.get() if _backend is not None else None
+    if split is not None:
+        try:
+            return split(text)
+        except Exception as e:
+            logger.warning(f"{TOKENIZER_BACKEND} sentence splitting failed, using regex: {str(e)}")
+    return regex_sentences(text)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from cache import get_cache
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Uploaded files kept by content hash, shared by every worker on this host
+UPLOAD_STORE_DIR = Path(__file__).parent / os.getenv("UPLOAD_STORE_DIR", "upload_store")
+
+# Size limit before the least recently used blobs are evicted
+UPLOAD_STORE_MAX_BYTES = int(os.getenv("UPLOAD_STORE_MAX_MB", "1024")) * 1024 * 1024
+
+# Lifetime of extraction results in the shared cache, in seconds
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Size of the reads while spooling an upload to disk
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+async def spool_upload(file, path: Path) -> Tuple[str, int]:
+    """Write an UploadFile to path in chunks, hashing it on the way; returns (sha256 hex, size)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as buffer:
+        while True:
+            chunk = await file.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+class UploadStore:
+    """Content-addressed upload blobs, evicted least recently used first, plus their extraction
+    results in the shared cache so every node can reuse them"""
+
+    def __init__(self, root: Path = UPLOAD_STORE_DIR, max_bytes: int = UPLOAD_STORE_MAX_BYTES,
+                 ttl: int = EXTRACTION_CACHE_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.results = get_cache("extraction", ttl)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections are per thread and per process; a forked worker opens its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.root / "index.db"), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_last_used ON blobs(last_used)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.root / "blobs" / sha256[:2] / sha256
+
+    def get_result(self, sha256: str, kind: str) -> Optional[Dict[str, Any]]:
+        """Extraction result of an earlier upload with the same bytes, or None"""
+        cached = self.results.get(f"{kind}:{sha256}")
+        if cached is None:
+            return None
+        try:
+            self._connection().execute("UPDATE blobs SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+            return json.loads(cached)
+        except Exception as e:
+            logger.error(f"Upload store lookup failed for {sha256}: {str(e)}")
+            return None
+
+    def put(self, sha256: str, source: Path, kind: str, result: Dict[str, Any]):
+        """Keep the uploaded file and its extraction result, then evict beyond the limits"""
+        try:
+            self._store_blob(sha256, source)
+            self.results.set(f"{kind}:{sha256}", json.dumps(result).encode("utf-8"))
+            self.evict()
+        except Exception as e:
+            logger.error(f"Failed to store upload {sha256}: {str(e)}")
+
+    def _store_blob(self, sha256: str, source: Path):
+        path = self.blob_path(sha256)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{sha256}.{os.getpid()}.tmp")
+            try:
+                # A hard link costs nothing; copy when the store is on another filesystem
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO blobs (sha256, size, last_used) VALUES (?, ?, ?)",
+            (sha256, path.stat().st_size, time.time())
+        )
+
+    def evict(self):
+        """Drop least recently used blobs above max_bytes; results expire from the cache on their own"""
+        conn = self._connection()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total > self.max_bytes:
+            for sha256, size in conn.execute("SELECT sha256, size FROM blobs ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    self.blob_path(sha256).unlink()
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                total -= size
+                logger.info(f"Evicted upload blob {sha256}")
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connection()
+        blobs, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"blobs": blobs, "bytes": total}
+
+# Create a singleton instance
+_upload_store = None
+
+def get_upload_store() -> UploadStore:
+    """Get the upload store singleton instance"""
+    global _upload_store
+    if _upload_store is None:
+        _upload_store = UploadStore()
+    return _upload_store
@@ -0,0 +1,290 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, Optional
+
+import deadline
+from metrics import (UPSTREAM_CIRCUIT_STATE, UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_IN_FLIGHT,
+                     UPSTREAM_REJECTED)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Provider quota, per worker process: sustained requests per second and burst size
+RATE_LIMIT = float(os.getenv("INFERENCE_RATE_LIMIT", "1"))
+RATE_BURST = int(os.getenv("INFERENCE_RATE_BURST", "5"))
+
+# Bounds of the adaptive concurrency limit
+MIN_CONCURRENCY = int(os.getenv("INFERENCE_MIN_CONCURRENCY", "1"))
+MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", "8"))
+
+# Limit a fresh worker starts at, before the upstream has been measured
+INITIAL_CONCURRENCY = int(os.getenv("INFERENCE_INITIAL_CONCURRENCY", str(max(1, MAX_CONCURRENCY // 2))))
+
+# Longest a call waits for a free concurrency slot (also bounded by the request deadline)
+QUEUE_TIMEOUT = float(os.getenv("INFERENCE_QUEUE_TIMEOUT", "10"))
+
+# Consecutive failures that open the circuit, and how long it stays open
+BREAKER_FAILURES = int(os.getenv("INFERENCE_BREAKER_FAILURES", "3"))
+BREAKER_RESET = float(os.getenv("INFERENCE_BREAKER_RESET", "30"))
+
+# Send a second copy of a request that is slower than the recent p95 latency
+HEDGING_ENABLED = os.getenv("INFERENCE_HEDGING", "true").lower() in ("1", "true", "yes")
+
+# Hedge delay used until enough latencies have been observed
+HEDGE_DELAY = float(os.getenv("INFERENCE_HEDGE_DELAY", "10"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call is refused locally instead of being sent upstream"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class TokenBucket:
+    """Token bucket rate limiter; never blocks"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+class AIMDLimiter:
+    """Concurrency limit that grows by one per window of successes and halves on overload"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self._slot_freed = threading.Condition()
+        self._publish()
+
+    def acquire(self, timeout: float = 0.0) -> bool:
+        """Take a slot, waiting up to timeout seconds for one to be released"""
+        give_up = time.monotonic() + timeout
+        with self._slot_freed:
+            while self.in_flight >= int(self.limit):
+                left = give_up - time.monotonic()
+                if left <= 0:
+                    return False
+                self._slot_freed.wait(left)
+            self.in_flight += 1
+        UPSTREAM_IN_FLIGHT.inc()
+        return True
+
+    def try_acquire(self) -> bool:
+        return self.acquire(0.0)
+
+    def release(self, overloaded: bool = False, succeeded: bool = True):
+        with self._slot_freed:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._slot_freed.notify()
+        UPSTREAM_IN_FLIGHT.dec()
+        self._publish()
+
+    def _publish(self):
+        UPSTREAM_CONCURRENCY_LIMIT.set(int(self.limit))
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open single probe -> closed"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._publish()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self.opened_until:
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                # Only one probe at a time decides whether the upstream recovered
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        """Forget an admitted probe that was never sent"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self, open_for: Optional[float] = None):
+        """Count a failure; open_for (e.g. from Retry-After) opens the circuit right away"""
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if open_for is not None or self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_until = time.monotonic() + max(open_for or 0.0, self.reset_timeout)
+                self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Inference circuit breaker {self.state} -> {state}")
+        self.state = state
+        self._publish()
+
+    def _publish(self):
+        UPSTREAM_CIRCUIT_STATE.set(_STATE_VALUES[self.state])
+
+class Permit:
+    """One admitted upstream call; report its outcome exactly once"""
+
+    def __init__(self, guard: "UpstreamGuard"):
+        self._guard = guard
+        self._done = False
+
+    def success(self):
+        self._finish()
+        self._guard.breaker.record_success()
+
+    def overloaded(self, retry_after: Optional[float] = None):
+        """Upstream said slow down (429, 503 model loading)"""
+        self._finish(overloaded=True)
+        self._guard.breaker.record_failure(open_for=retry_after)
+
+    def failure(self):
+        """Timeout, connection error or 5xx"""
+        self._finish(overloaded=True)
+        self._guard.breaker.record_failure()
+
+    def cancel(self):
+        """Give the slot back without judging the upstream (e.g. a client error)"""
+        self._finish(succeeded=False)
+        self._guard.breaker.release_probe()
+
+    def _finish(self, overloaded: bool = False, succeeded: bool = True):
+        if self._done:
+            return
+        self._done = True
+        self._guard.limiter.release(overloaded=overloaded, succeeded=succeeded)
+
+class UpstreamGuard:
+    """Rate limit, adaptive concurrency limit and circuit breaker in front of the inference API"""
+
+    def __init__(self):
+        self.bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+        self.limiter = AIMDLimiter(INITIAL_CONCURRENCY, MIN_CONCURRENCY, MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET)
+
+    def acquire(self, task: str, wait: bool = True) -> Permit:
+        """Admit a call or raise UpstreamUnavailable; with wait, queue for a concurrency slot until
+        QUEUE_TIMEOUT or the request deadline"""
+        if not self.breaker.allow():
+            UPSTREAM_REJECTED.inc(task=task, reason="circuit_open")
+            raise UpstreamUnavailable("circuit_open")
+        if not self.limiter.acquire(deadline.cap(QUEUE_TIMEOUT) if wait else 0.0):
+            self.breaker.release_probe()
+            UPSTREAM_REJECTED.inc(task=task, reason="concurrency")
+            raise UpstreamUnavailable("concurrency")
+        if not self.bucket.try_acquire():
+            self.limiter.release(succeeded=False)
+            self.breaker.release_probe()
+            UPSTREAM_REJECTED.inc(task=task, reason="rate_limited")
+            raise UpstreamUnavailable("rate_limited")
+        return Permit(self)
+
+    def status(self) -> Dict[str, Any]:
+        retry_in = max(0.0, self.breaker.opened_until - time.monotonic()) if self.breaker.state == OPEN else 0.0
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_in_seconds": round(retry_in, 1),
+            "concurrency_limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight,
+            "rate_limit_per_second": self.bucket.rate,
+        }
+
+class LatencyTracker:
+    """Latencies of recent successful calls per task"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, task: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(task, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, task: str, q: float) -> Optional[float]:
+        """The q-th percentile (0-100), or None without enough samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(task, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+def hedge_delay(task: str) -> float:
+    """How long to wait for a response before sending a hedged request"""
+    p95 = get_latency_tracker().percentile(task, 95)
+    return max(HEDGE_MIN_DELAY, p95 if p95 is not None else HEDGE_DELAY)
+
+# Create singleton instances
+_guard = None
+_latency_tracker = None
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_upstream_guard() -> UpstreamGuard:
+    """Get the upstream guard singleton instance"""
+    global _guard
+    if _guard is None:
+        _guard = UpstreamGuard()
+    return _guard
+
+def get_latency_tracker() -> LatencyTracker:
+    """Get the latency tracker singleton instance"""
+    global _latency_tracker
+    if _latency_tracker is None:
+        _latency_tracker = LatencyTracker()
+    return _latency_tracker
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    """Threads that run upstream requests, including hedges (created lazily, after any fork)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY * 4, thread_name_prefix="inference")
+    return _executor
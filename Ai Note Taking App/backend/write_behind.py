@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from database import update_notes
+from metrics import WRITE_BEHIND_DROPPED, WRITE_BEHIND_FLUSHED, WRITE_BEHIND_MERGED, WRITE_BEHIND_PENDING
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds note updates are held and merged before being written together; 0 writes each update right away
+WRITE_BEHIND_WINDOW = float(os.getenv("WRITE_BEHIND_WINDOW", "1.0"))
+
+# Notes waiting to be written that trigger a flush before the window ends
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "256"))
+
+# Buffered updates live in one worker's memory and other workers would serve the older note
+# until the flush, so write-behind is only used with a single worker process
+API_WORKERS = int(os.getenv("API_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+if API_WORKERS > 1 and WRITE_BEHIND_WINDOW > 0:
+    logger.info(f"Write-behind disabled: running {API_WORKERS} worker processes")
+    WRITE_BEHIND_WINDOW = 0.0
+
+class WriteBehindBuffer:
+    """Autosave updates of this worker, merged per note and written in one transaction per window"""
+
+    def __init__(self, window: float = WRITE_BEHIND_WINDOW, max_pending: int = WRITE_BEHIND_MAX_PENDING):
+        self.window = window
+        self.max_pending = max_pending
+        # Fields to write per note, with the "version" the note will have once they are written
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        # The batch being written; still applied to reads until it is committed
+        self._writing: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def update(self, note_id: int, fields: Dict[str, Any], version: int):
+        """Queue an update of a note this worker shows at version; later fields of the same note replace
+        earlier ones. Each flush writes a note once and the database moves its version on by one, so
+        the update will give it version + 1."""
+        if not fields:
+            return
+        with self._lock:
+            pending = self._pending.get(note_id)
+            if pending is None:
+                self._pending[note_id] = {**fields, "version": version + 1}
+            else:
+                pending.update(fields)
+                WRITE_BEHIND_MERGED.inc()
+            count = len(self._pending)
+        WRITE_BEHIND_PENDING.set(count)
+        if count >= self.max_pending and self._wake is not None:
+            self._wake.set()
+
+    def overlay(self, note: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The note with this worker's unwritten updates applied, at the version they will give it, so
+        clients read their own writes"""
+        if note is None:
+            return None
+        with self._lock:
+            writing = self._writing.get(note["id"])
+            pending = self._pending.get(note["id"])
+        if writing is None and pending is None:
+            return note
+        return {**note, **(writing or {}), **(pending or {})}
+
+    def overlay_notes(self, notes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """overlay() for every note of a listing or change feed"""
+        if not self.has_unwritten():
+            return notes
+        return [self.overlay(note) for note in notes]
+
+    def has_unwritten(self) -> bool:
+        """Whether updates are pending or being written"""
+        with self._lock:
+            return bool(self._pending or self._writing)
+
+    def discard(self, note_id: int):
+        """Forget updates of a note that is being deleted"""
+        with self._lock:
+            self._pending.pop(note_id, None)
+            count = len(self._pending)
+        WRITE_BEHIND_PENDING.set(count)
+
+    def flush(self) -> int:
+        """Write every pending update in one transaction; returns the number of notes written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._writing = batch
+            WRITE_BEHIND_PENDING.set(0)
+            if not batch:
+                return 0
+            missing = update_notes({note_id: {key: value for key, value in fields.items() if key != "version"}
+                                    for note_id, fields in batch.items()})
+            with self._lock:
+                self._writing = {}
+                if missing is None:
+                    # Keep them for the next flush, under anything queued meanwhile; written together
+                    # they still move the version on only once
+                    for note_id, fields in batch.items():
+                        self._pending[note_id] = {**fields, **self._pending.get(note_id, {}),
+                                                  "version": fields["version"]}
+                count = len(self._pending)
+            WRITE_BEHIND_PENDING.set(count)
+            if missing is None:
+                logger.error(f"Write-behind flush of {len(batch)} notes failed, retrying in {self.window}s")
+                return 0
+            if missing:
+                # Deleted by another worker after the update was accepted; clients see the deletion
+                # in the change feed
+                WRITE_BEHIND_DROPPED.inc(len(missing))
+                logger.warning(f"Write-behind dropped updates of deleted notes {missing}")
+            WRITE_BEHIND_FLUSHED.inc(len(batch) - len(missing))
+            return len(batch) - len(missing)
+
+    async def run(self, on_flush: Callable[[], None]):
+        """Background task: flush every window (sooner when many notes are waiting) until cancelled"""
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                if await run_in_threadpool(self.flush):
+                    on_flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {str(e)}")
+
+# Create a singleton instance
+_write_behind = None
+
+def get_write_behind() -> WriteBehindBuffer:
+    """Get the write-behind buffer singleton instance"""
+    global _write_behind
+    if _write_behind is None:
+        _write_behind = WriteBehindBuffer()
+    return _write_behind
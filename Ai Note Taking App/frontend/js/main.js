@@ -5,6 +5,7 @@ const API_URL = location.protocol === 'file:'
 
 // Global variables
 let notes = [];
+let notesCursor = null; // Change cursor for delta sync with /api/notes/changes
 let currentNote = null;
 let summaryData = null;
 let quizData = null;
@@ -231,20 +232,45 @@ function toggleViews(viewToShow) {
 }
 
 // CRUD Operations
+// Fetch the full list once, then only the notes changed since the last cursor
+async function syncNotes() {
+    const url = notesCursor === null
+        ? `${API_URL}/api/notes`
+        : `${API_URL}/api/notes/changes?since=${notesCursor}`;
+    const response = await fetch(url);
+    
+    if (!response.ok) {
+        console.error('API response not OK:', response.status, response.statusText);
+        throw new Error('Failed to load notes');
+    }
+    
+    const data = await response.json();
+    
+    if (notesCursor === null || data.reset) {
+        notes = data.notes || [];
+    } else {
+        applyNoteChanges(data);
+    }
+    notesCursor = data.cursor ?? null;
+    return data;
+}
+
+// Merge a delta from /api/notes/changes into the local notes array
+function applyNoteChanges(changes) {
+    const changedIds = new Set((changes.notes || []).map(note => note.id));
+    const deletedIds = new Set(changes.deleted || []);
+    
+    notes = notes.filter(note => !changedIds.has(note.id) && !deletedIds.has(note.id));
+    
+    // Changes arrive oldest first; the list is ordered most recently updated first
+    notes = [...(changes.notes || [])].reverse().concat(notes);
+}
+
 async function loadNotes() {
     try {
         console.log('Loading notes from API...');
-        const response = await fetch(`${API_URL}/api/notes`);
-        
-        if (!response.ok) {
-            console.error('API response not OK:', response.status, response.statusText);
-            throw new Error('Failed to load notes');
-        }
-        
-        const data = await response.json();
+        const data = await syncNotes();
         console.log('Notes loaded:', data);
-        
-        notes = data.notes || [];
         console.log('Notes array:', notes);
         
         renderNotesList();
@@ -252,6 +278,7 @@ async function loadNotes() {
         console.error('Error loading notes:', error);
         window.aiFeatures.showAlert('Error loading notes: ' + error.message, 'danger');
         notes = [];
+        notesCursor = null;
         renderNotesList();
     }
 }
@@ -347,15 +374,7 @@ async function saveNote(e) {
 // New function to load notes in the background without changing the view
 async function loadNotesInBackground() {
     try {
-        const response = await fetch(`${API_URL}/api/notes`);
-        
-        if (!response.ok) {
-            console.error('API response not OK:', response.status, response.statusText);
-            throw new Error('Failed to load notes');
-        }
-        
-        const data = await response.json();
-        notes = data.notes || [];
+        await syncNotes();
         
         // Don't render the notes list or change the view
     } catch (error) {